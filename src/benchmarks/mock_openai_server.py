@@ -0,0 +1,394 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from random import random, uniform
+from threading import Thread, Lock
+from time import sleep, time
+from urllib.parse import urlparse, parse_qs
+from itertools import count
+from email.parser import BytesParser
+from email.policy import HTTP
+
+MODEL_SNAPSHOTS = {'gpt-4': 'gpt-4-0613', 'gpt-3.5-turbo': 'gpt-3.5-turbo-0613'}
+
+
+class MockOpenAIServer():
+    """Custom class to run a local stand-in for the OpenAI REST API (chat completions, batches, assistants, threads, messages, runs and files) with configurable latency, server errors and 429s"""
+    def __init__(self, latencySeconds=0.05, latencyJitterSeconds=0.01, errorRate=0.0, rateLimitRate=0.0, retryAfterMilliseconds=50, runPollsToComplete=2, completionTokens=50, overloadedModels=(), modelSnapshots=None, host='127.0.0.1', port=0):
+        self.latencySeconds = latencySeconds
+        self.latencyJitterSeconds = latencyJitterSeconds
+        self.errorRate = errorRate
+        self.rateLimitRate = rateLimitRate
+        self.retryAfterMilliseconds = retryAfterMilliseconds
+        self.runPollsToComplete = runPollsToComplete
+        self.completionTokens = completionTokens
+        self.overloadedModels = set(overloadedModels)
+        self.modelSnapshots = MODEL_SNAPSHOTS if modelSnapshots is None else modelSnapshots #Like the real API, aliases are answered with a dated model name
+
+        self.assistants = {}
+        self.threads = {}
+        self.runs = {}
+        self.files = {}
+        self.fileContents = {}
+        self.batches = {}
+        self.requestCounts = {}
+        self.ids = count(1)
+        self.lock = Lock()
+
+        self.server = ThreadingHTTPServer((host, port), self.create_handler())
+        self.server.daemon_threads = True
+        self.serverThread = None
+
+    @property
+    def baseURL(self):
+        """Function to get the base URL to hand to the integrations as apiBaseURL"""
+        host, port = self.server.server_address[:2]
+
+        return f'http://{host}:{port}/v1'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.stop()
+
+    def start(self):
+        """Function to serve requests on a background thread"""
+        self.serverThread = Thread(target=self.server.serve_forever, daemon=True)
+        self.serverThread.start()
+
+    def stop(self):
+        """Function to stop serving and release the port"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_id(self, prefix):
+        """Function to make an ID shaped like the real ones, e.g. thread_12"""
+        return f'{prefix}_{next(self.ids)}'
+
+    def count_request(self, routeName):
+        """Function to count requests per route for the benchmark report"""
+        with self.lock:
+            self.requestCounts[routeName] = self.requestCounts.get(routeName, 0) + 1
+
+    def get_injected_failure(self):
+        """Function to decide whether this request should fail with a 429 or a 500, returning (status, body, headers) or None"""
+        roll = random()
+
+        if roll < self.rateLimitRate:
+            return 429, {'error': {'message': 'Rate limit reached (mock)', 'type': 'requests', 'code': 'rate_limit_exceeded'}}, {'retry-after-ms': str(self.retryAfterMilliseconds)}
+        if roll < self.rateLimitRate + self.errorRate:
+            return 500, {'error': {'message': 'The server had an error (mock)', 'type': 'server_error', 'code': None}}, {}
+
+        return None
+
+    def wait_latency(self):
+        """Function to hold the response for the configured latency"""
+        delaySeconds = self.latencySeconds + uniform(-self.latencyJitterSeconds, self.latencyJitterSeconds)
+
+        if delaySeconds > 0:
+            sleep(delaySeconds)
+
+    def get_packed_question_keys(self, messages):
+        """Function to get the question keys of a packed request (a user message holding a JSON object of questions), or None for an ordinary prompt"""
+        try:
+            packedQuestions = loads(messages[-1]['content'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
+
+        return list(packedQuestions) if isinstance(packedQuestions, dict) else None
+
+    def create_chat_completion(self, payload):
+        """Function to answer a chat completion with a small JSON answer (one per key for packed requests) and token usage"""
+        messages = payload.get('messages', [])
+        promptTokens = sum(len(str(message.get('content', '')).split()) for message in messages) + 8 * len(messages)
+        questionKeys = self.get_packed_question_keys(messages)
+
+        if questionKeys:
+            answerContent = dumps({questionKey: {'answer': 'mock ' * 8} for questionKey in questionKeys})
+            completionTokens = self.completionTokens * len(questionKeys)
+        else:
+            answerContent = dumps({'answer': 'mock ' * 8})
+            completionTokens = self.completionTokens
+
+        return {
+            'id': self.new_id('chatcmpl'),
+            'object': 'chat.completion',
+            'created': int(time()),
+            'model': self.modelSnapshots.get(payload.get('model'), payload.get('model')),
+            'system_fingerprint': 'fp_mock',
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answerContent}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': promptTokens, 'completion_tokens': completionTokens, 'total_tokens': promptTokens + completionTokens}
+        }
+
+    def parse_multipart(self, contentType, body):
+        """Function to read the form fields and the uploaded file from a multipart request"""
+        message = BytesParser(policy=HTTP).parsebytes(f'Content-Type: {contentType}\r\n\r\n'.encode('utf-8') + body)
+        fields = {'bytes': len(body)}
+
+        for part in message.iter_parts():
+            if part.get_filename():
+                fields['content'] = part.get_payload(decode=True)
+                fields['filename'] = part.get_filename()
+                fields['bytes'] = len(fields['content'])
+            else:
+                fields[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True).decode('utf-8')
+
+        return fields
+
+    def create_file(self, payload, content=None, purpose=None, fileName=None):
+        """Function to store an uploaded (or generated) file and return its file object"""
+        fileId = self.new_id('file')
+        content = payload.get('content', b'') if content is None else content
+        self.fileContents[fileId] = content
+        self.files[fileId] = {'id': fileId, 'object': 'file', 'bytes': payload.get('bytes', len(content)), 'created_at': int(time()), 'filename': fileName or payload.get('filename', 'upload'), 'purpose': purpose or payload.get('purpose', 'assistants'), 'status': 'processed', 'status_details': None}
+
+        return self.files[fileId]
+
+    def get_batch(self, batchId):
+        """Function to report a batch, moving it to in_progress on the first poll and running every request once it has been polled runPollsToComplete times"""
+        batch = self.batches[batchId]
+        batch['polls'] += 1
+
+        if batch['status'] == 'validating':
+            batch['status'] = 'in_progress'
+            batch['in_progress_at'] = int(time())
+
+        if batch['status'] == 'in_progress' and batch['polls'] >= self.runPollsToComplete:
+            outputLines = []
+
+            for requestLine in self.fileContents[batch['input_file_id']].decode('utf-8').splitlines():
+                if requestLine.strip():
+                    request = loads(requestLine)
+                    outputLines.append(dumps({'id': self.new_id('batch_req'), 'custom_id': request['custom_id'], 'response': {'status_code': 200, 'request_id': self.new_id('req'), 'body': self.create_chat_completion(request['body'])}, 'error': None}))
+
+            batch['output_file_id'] = self.create_file({}, ('\n'.join(outputLines) + '\n').encode('utf-8'), 'batch_output', f'{batchId}_output.jsonl')['id']
+            batch['status'] = 'completed'
+            batch['completed_at'] = int(time())
+            batch['request_counts'] = {'total': len(outputLines), 'completed': len(outputLines), 'failed': 0}
+
+        return {key: value for key, value in batch.items() if key != 'polls'}
+
+    def get_stream_events(self, completion):
+        """Function to split a completion into server-sent events the way streaming responses arrive"""
+        content = completion['choices'][0]['message']['content']
+        baseChunk = {'id': completion['id'], 'object': 'chat.completion.chunk', 'created': completion['created'], 'model': completion['model']}
+
+        for position in range(0, len(content), 8):
+            yield {**baseChunk, 'choices': [{'index': 0, 'delta': {'content': content[position:position + 8]}, 'finish_reason': None}]}
+
+        yield {**baseChunk, 'choices': [], 'usage': completion['usage']}
+
+    def create_message(self, threadId, role, content, runId=None, assistantId=None, fileIds=[], metadata={}):
+        """Function to add a message to a mock thread"""
+        message = {
+            'id': self.new_id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time()),
+            'thread_id': threadId,
+            'role': role,
+            'content': [{'type': 'text', 'text': {'value': content, 'annotations': []}}],
+            'assistant_id': assistantId,
+            'run_id': runId,
+            'file_ids': fileIds,
+            'metadata': metadata
+        }
+        self.threads[threadId]['messages'].append(message)
+
+        return message
+
+    def get_run(self, threadId, runId):
+        """Function to advance a run one poll towards completion, adding the assistant reply when it completes"""
+        run = self.runs[runId]
+
+        if run['status'] in ('queued', 'in_progress'):
+            run['polls'] += 1
+            run['started_at'] = run['started_at'] or int(time())
+
+            if run['polls'] >= self.runPollsToComplete:
+                run['status'] = 'completed'
+                run['completed_at'] = int(time())
+                self.create_message(threadId, 'assistant', 'mock assistant reply ' * 4, runId, run['assistant_id'])
+            else:
+                run['status'] = 'in_progress'
+
+        return {key: value for key, value in run.items() if key != 'polls'}
+
+    def list_messages(self, threadId, query):
+        """Function to page through a thread's messages with order, after and limit like the real list endpoint"""
+        messages = self.threads[threadId]['messages']
+        if query.get('order', ['desc'])[0] == 'desc':
+            messages = list(reversed(messages))
+
+        if 'after' in query:
+            messageIds = [message['id'] for message in messages]
+            messages = messages[messageIds.index(query['after'][0]) + 1:] if query['after'][0] in messageIds else []
+
+        limit = int(query.get('limit', ['20'])[0])
+        page = messages[:limit]
+
+        return {'object': 'list', 'data': page, 'first_id': page[0]['id'] if page else None, 'last_id': page[-1]['id'] if page else None, 'has_more': len(messages) > limit}
+
+    def route(self, method, routePath, query, payload):
+        """Function to answer one API call, returning (status, body) or (status, list of stream events)"""
+        parts = routePath.strip('/').split('/')[1:] #Drop the v1 prefix
+        now = int(time())
+
+        if parts == ['chat', 'completions']:
+            if payload.get('model') in self.overloadedModels: #Lets failover be exercised one model at a time
+                return 503, {'error': {'message': f"{payload['model']} is currently overloaded (mock)", 'type': 'server_error', 'code': None}}
+
+            completion = self.create_chat_completion(payload)
+            return (200, list(self.get_stream_events(completion))) if payload.get('stream') else (200, completion)
+
+        if parts == ['files'] and method == 'POST':
+            return 200, self.create_file(payload)
+
+        if len(parts) == 3 and parts[0] == 'files' and parts[2] == 'content' and method == 'GET':
+            if parts[1] not in self.fileContents:
+                return 404, {'error': {'message': f'No file found with id {parts[1]}', 'type': 'invalid_request_error'}}
+            return 200, self.fileContents[parts[1]]
+
+        if parts[0] == 'batches':
+            if len(parts) == 1 and method == 'POST':
+                batchId = self.new_id('batch')
+                self.batches[batchId] = {'id': batchId, 'object': 'batch', 'endpoint': payload.get('endpoint'), 'errors': None, 'input_file_id': payload.get('input_file_id'), 'completion_window': payload.get('completion_window'), 'status': 'validating', 'output_file_id': None, 'error_file_id': None, 'created_at': now, 'in_progress_at': None, 'completed_at': None, 'request_counts': {'total': 0, 'completed': 0, 'failed': 0}, 'metadata': payload.get('metadata', {}), 'polls': 0}
+                return 200, {key: value for key, value in self.batches[batchId].items() if key != 'polls'}
+
+            if parts[1] not in self.batches:
+                return 404, {'error': {'message': f'No batch found with id {parts[1]}', 'type': 'invalid_request_error'}}
+
+            if len(parts) == 2 and method == 'GET':
+                return 200, self.get_batch(parts[1])
+
+        if parts[0] == 'assistants':
+            if len(parts) == 1 and method == 'POST':
+                assistantId = self.new_id('asst')
+                self.assistants[assistantId] = {'id': assistantId, 'object': 'assistant', 'created_at': now, 'name': payload.get('name'), 'description': None, 'model': payload.get('model'), 'instructions': payload.get('instructions'), 'tools': payload.get('tools', []), 'file_ids': payload.get('file_ids', []), 'metadata': payload.get('metadata', {})}
+                return 200, self.assistants[assistantId]
+
+            assistant = self.assistants.get(parts[1])
+            if assistant is None:
+                return 404, {'error': {'message': f'No assistant found with id {parts[1]}', 'type': 'invalid_request_error'}}
+
+            if len(parts) == 2 and method == 'GET':
+                return 200, assistant
+            if len(parts) == 2 and method == 'POST':
+                assistant.update({key: value for key, value in payload.items() if key in assistant})
+                return 200, assistant
+            if parts[2:] == ['files'] and method == 'POST':
+                assistant['file_ids'].append(payload['file_id'])
+                return 200, {'id': payload['file_id'], 'object': 'assistant.file', 'created_at': now, 'assistant_id': assistant['id']}
+
+        if parts[0] == 'threads':
+            if len(parts) == 1 and method == 'POST':
+                threadId = self.new_id('thread')
+                self.threads[threadId] = {'thread': {'id': threadId, 'object': 'thread', 'created_at': now, 'metadata': (payload or {}).get('metadata', {})}, 'messages': []}
+                return 200, self.threads[threadId]['thread']
+
+            if parts[1] not in self.threads:
+                return 404, {'error': {'message': f'No thread found with id {parts[1]}', 'type': 'invalid_request_error'}}
+
+            if parts[2:] == ['messages'] and method == 'POST':
+                return 200, self.create_message(parts[1], payload.get('role', 'user'), payload.get('content', ''), fileIds=payload.get('file_ids', []), metadata=payload.get('metadata', {}))
+            if parts[2:] == ['messages'] and method == 'GET':
+                return 200, self.list_messages(parts[1], query)
+            if parts[2:] == ['runs'] and method == 'POST':
+                runId = self.new_id('run')
+                self.runs[runId] = {'id': runId, 'object': 'thread.run', 'created_at': now, 'thread_id': parts[1], 'assistant_id': payload.get('assistant_id'), 'status': 'queued', 'required_action': None, 'last_error': None, 'expires_at': now + 600, 'started_at': None, 'cancelled_at': None, 'failed_at': None, 'completed_at': None, 'model': 'gpt-4-1106-preview', 'instructions': '', 'tools': [], 'file_ids': [], 'metadata': payload.get('metadata', {}), 'polls': 0}
+                return 200, {key: value for key, value in self.runs[runId].items() if key != 'polls'}
+            if len(parts) == 4 and parts[2] == 'runs' and method == 'GET':
+                return 200, self.get_run(parts[1], parts[3])
+
+        return 404, {'error': {'message': f'Unknown route {method} {routePath} (mock)', 'type': 'invalid_request_error'}}
+
+    def create_handler(self):
+        """Function to build the request handler class bound to this server's state"""
+        mockServer = self
+
+        class MockOpenAIRequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' #Keep-alive, so connection pooling behaves as it would against the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def read_payload(self):
+                contentLength = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(contentLength) if contentLength else b''
+
+                if self.headers.get('Content-Type', '').startswith('application/json') and body:
+                    return loads(body)
+
+                if self.headers.get('Content-Type', '').startswith('multipart/form-data'):
+                    return mockServer.parse_multipart(self.headers['Content-Type'], body)
+
+                return {'bytes': len(body)}
+
+            def send_json(self, status, body, headers={}):
+                responseBody = dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(responseBody)))
+                for headerName, headerValue in headers.items():
+                    self.send_header(headerName, headerValue)
+                self.end_headers()
+                self.wfile.write(responseBody)
+
+            def send_file(self, content):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def send_events(self, events):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for event in events:
+                    self.wfile.write(f'data: {dumps(event)}\n\n'.encode('utf-8'))
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.close_connection = True
+
+            def handle_request(self, method):
+                parsedURL = urlparse(self.path)
+
+                if parsedURL.path == '/mock/stats': #Lets a benchmark in another process read the request counts
+                    with mockServer.lock:
+                        self.send_json(200, {'request_counts': dict(mockServer.requestCounts)})
+                    return
+
+                payload = self.read_payload() if method == 'POST' else {}
+                mockServer.count_request(f'{method} {parsedURL.path}')
+                mockServer.wait_latency()
+
+                failure = mockServer.get_injected_failure()
+                if failure is not None:
+                    self.send_json(*failure)
+                    return
+
+                with mockServer.lock:
+                    status, body = mockServer.route(method, parsedURL.path, parse_qs(parsedURL.query), payload)
+
+                if isinstance(body, list):
+                    self.send_events(body)
+                elif isinstance(body, bytes):
+                    self.send_file(body)
+                else:
+                    self.send_json(status, body)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+        return MockOpenAIRequestHandler
+
+
+def serve_mock_server(serverOptions, addressQueue):
+    """Function to run a mock server until the process is stopped, reporting its base URL through the queue, used to keep server CPU out of the benchmark process"""
+    mockServer = MockOpenAIServer(**serverOptions)
+    addressQueue.put(mockServer.baseURL)
+    mockServer.server.serve_forever()
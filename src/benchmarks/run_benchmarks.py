@@ -0,0 +1,306 @@
+from argparse import ArgumentParser
+from json import dump, load, loads
+from math import ceil
+from multiprocessing import Process, Queue
+from os import chdir, getcwd, makedirs, walk, path
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+from urllib.request import urlopen
+import pypdfium2 as pdfium
+import caller.token_counting as token_counting
+from caller.api_integration import OpenAIAPIIntegration
+from caller.python_integration import OpenAIPythonIntegration
+from benchmarks.mock_openai_server import serve_mock_server
+
+###VARIABLES###
+virtualEnvironmentName = 'benchmark_local' #Holds placeholder keys, the mock server does not check them
+gptModel = 'gpt-3.5-turbo-1106'
+maxTokenLimit = 4096
+systemPrompt = 'You are a helpful assistant who answers questions about personal finance in one short paragraph.'
+
+
+class ApproximateEncoding():
+    """Custom class to stand in for a tiktoken encoding, counting about four characters per token, so benchmarks never download an encoding"""
+    def encode(self, inputToCheck, **encodeOptions):
+        return range(ceil(len(inputToCheck) / 4))
+
+    def encode_batch(self, inputsToCheck, num_threads=8, **encodeOptions):
+        return [self.encode(inputToCheck) for inputToCheck in inputsToCheck]
+
+
+def use_approximate_token_counts():
+    """Function to count tokens without tiktoken, which downloads the cl100k_base encoding on first use and would need network access"""
+    token_counting.load_encoding = lambda encodingName: ApproximateEncoding()
+
+
+def get_percentile(values, percentile):
+    """Function to get the nearest-rank percentile of a list of values"""
+    if not values:
+        return None
+
+    sortedValues = sorted(values)
+
+    return sortedValues[max(0, ceil(percentile / 100 * len(sortedValues)) - 1)]
+
+
+def get_folder_usage(folderName):
+    """Function to count the files and bytes under a folder"""
+    fileCount = 0
+    byteCount = 0
+
+    for folderPath, folderNames, fileNames in walk(folderName):
+        for fileName in fileNames:
+            fileCount += 1
+            byteCount += path.getsize(path.join(folderPath, fileName))
+
+    return fileCount, byteCount
+
+
+def time_each_call(latencies, function):
+    """Function to wrap a method so each call's duration is appended to latencies"""
+    def timed_function(*args, **kwargs):
+        startTime = perf_counter()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            latencies.append(perf_counter() - startTime)
+
+    return timed_function
+
+
+def measure_scenario(scenarioName, applicationName, runScenario):
+    """Function to run a scenario and report its throughput, p50/p99 latency, CPU time and file output per request"""
+    startFiles, startBytes = get_folder_usage(f'./src/{applicationName}')
+    startCPUSeconds = process_time()
+    startTime = perf_counter()
+
+    latencies, failedRequests = runScenario()
+
+    wallSeconds = perf_counter() - startTime
+    cpuSeconds = process_time() - startCPUSeconds
+    endFiles, endBytes = get_folder_usage(f'./src/{applicationName}')
+    requestCount = max(len(latencies), 1)
+
+    return {
+        'scenario': scenarioName,
+        'requests': len(latencies),
+        'failed_requests': failedRequests,
+        'wall_seconds': wallSeconds,
+        'throughput_per_second': len(latencies) / wallSeconds if wallSeconds else None,
+        'p50_latency_ms': (get_percentile(latencies, 50) or 0) * 1000,
+        'p99_latency_ms': (get_percentile(latencies, 99) or 0) * 1000,
+        'cpu_ms_per_request': cpuSeconds / requestCount * 1000,
+        'files_written_per_request': (endFiles - startFiles) / requestCount,
+        'bytes_written_per_request': (endBytes - startBytes) / requestCount
+    }
+
+
+def run_batch_chat(apiBaseURL, numPrompts=200, maxWorkers=16):
+    """Function to send a batch of distinct chat prompts through get_chat_responses_in_batch"""
+    applicationName = 'benchmark_batch_chat'
+    latencies = []
+
+    with OpenAIAPIIntegration(applicationName, virtualEnvironmentName, apiBaseURL=apiBaseURL, httpPoolSize=maxWorkers) as client:
+        client.process_chat_prompt = time_each_call(latencies, client.process_chat_prompt)
+
+        def runScenario():
+            promptPairs = ((systemPrompt, f'Question {promptNumber}: should I pay down my mortgage or invest the difference?') for promptNumber in range(numPrompts))
+            results = list(client.get_chat_responses_in_batch(promptPairs, gptModel, maxTokenLimit, maxWorkers=maxWorkers))
+
+            return latencies, sum(1 for result in results if result['status'] != 'success')
+
+        return measure_scenario('batch_chat', applicationName, runScenario)
+
+
+def run_packed_chat(apiBaseURL, numPrompts=200, maxWorkers=16):
+    """Function to send the same batch of short prompts as batch_chat, packed into as few requests as fit, through get_packed_chat_responses"""
+    applicationName = 'benchmark_packed_chat'
+    latencies = []
+
+    with OpenAIAPIIntegration(applicationName, virtualEnvironmentName, apiBaseURL=apiBaseURL, httpPoolSize=maxWorkers) as client:
+        client.process_packed_chat_prompts = time_each_call(latencies, client.process_packed_chat_prompts)
+
+        def runScenario():
+            userPrompts = [f'Question {promptNumber}: should I pay down my mortgage or invest the difference?' for promptNumber in range(numPrompts)]
+            results = list(client.get_packed_chat_responses(systemPrompt, userPrompts, gptModel, maxTokenLimit, maxWorkers=maxWorkers))
+
+            return latencies, sum(1 for result in results if result['status'] != 'success')
+
+        return measure_scenario('packed_chat', applicationName, runScenario)
+
+
+def run_similar_chat(apiBaseURL, numPrompts=200, maxWorkers=16):
+    """Function to send distinct prompts and then near-duplicates of them (changed case and punctuation) on an aliased model with the similarity cache on, counting any near-duplicate not answered from the cache as failed"""
+    applicationName = 'benchmark_similar_chat'
+    aliasedModel = 'gpt-3.5-turbo' #The mock answers with gpt-3.5-turbo-0613, so saved and looked up names differ
+    latencies = []
+
+    with OpenAIAPIIntegration(applicationName, virtualEnvironmentName, apiBaseURL=apiBaseURL, httpPoolSize=maxWorkers, similarityThreshold=0.95) as client:
+        client.process_chat_prompt = time_each_call(latencies, client.process_chat_prompt)
+
+        def runScenario():
+            userPrompts = [f'Question {promptNumber}: with {promptNumber} thousand dollars saved, should I pay down my mortgage or invest the difference?' for promptNumber in range(numPrompts // 2)]
+            firstResults = list(client.get_chat_responses_in_batch(((systemPrompt, userPrompt) for userPrompt in userPrompts), aliasedModel, maxTokenLimit, maxWorkers=maxWorkers))
+            similarResults = list(client.get_chat_responses_in_batch(((systemPrompt, userPrompt.upper().replace('?', '!!')) for userPrompt in userPrompts), aliasedModel, maxTokenLimit, maxWorkers=maxWorkers))
+
+            return latencies, sum(1 for result in firstResults if result['status'] != 'success') + sum(1 for result in similarResults if result['status'] != 'success' or 'similarity' not in result['response'])
+
+        return measure_scenario('similar_chat', applicationName, runScenario)
+
+
+def run_assistant_threads(apiBaseURL, numUsers=50, messagesPerUser=3, maxConcurrentThreads=16):
+    """Function to run several messages for many users against one assistant through run_user_jobs"""
+    applicationName = 'benchmark_assistant_threads'
+    client = OpenAIPythonIntegration(applicationName, virtualEnvironmentName, apiBaseURL=apiBaseURL)
+
+    try:
+        client.create_assistant(name='Benchmark Guru', instructions='Answer trivia questions.')
+        assistantId = client.get_assistant_id_from_config('Benchmark Guru')
+
+        def runScenario():
+            jobs = [(userId, f'Trivia question {messageNumber} from user {userId}') for messageNumber in range(messagesPerUser) for userId in range(numUsers)]
+            results = list(client.run_user_jobs(assistantId, jobs, maxConcurrentThreads=maxConcurrentThreads, initialPollIntervalSeconds=0.05))
+            latencies = [traceRecord['duration_seconds'] for traceRecord in client.metrics.recentTraces if traceRecord['name'] == 'assistant_run']
+
+            return latencies, sum(1 for result in results if result['status'] != 'completed')
+
+        return measure_scenario('assistant_threads', applicationName, runScenario)
+    finally:
+        client.close()
+
+
+def run_pdf_vision(apiBaseURL, numPages=8):
+    """Function to render a PDF to page images and send each page to the vision endpoint"""
+    applicationName = 'benchmark_pdf_vision'
+    latencies = []
+    makedirs(f'./src/{applicationName}/data/', exist_ok=True)
+
+    pdf = pdfium.PdfDocument.new()
+    for pageNumber in range(numPages):
+        pdf.new_page(612, 792)
+    pdf.save(f'./src/{applicationName}/data/benchmark.pdf')
+    pdf.close()
+
+    with OpenAIAPIIntegration(applicationName, virtualEnvironmentName, apiBaseURL=apiBaseURL) as client:
+        def runScenario():
+            failedRequests = 0
+
+            for pageFileName in client.convert_pdf_to_images('benchmark.pdf', renderDPIScale=2):
+                startTime = perf_counter()
+                response = client.get_vision_response_from_local_files(pageFileName, 'Describe this page.')
+                latencies.append(perf_counter() - startTime)
+                failedRequests += 'choices' not in response
+
+            return latencies, failedRequests
+
+        return measure_scenario('pdf_vision', applicationName, runScenario)
+
+
+def start_mock_server(serverOptions):
+    """Function to start the mock server in its own process so its CPU time is not counted against the integrations"""
+    addressQueue = Queue()
+    serverProcess = Process(target=serve_mock_server, args=(serverOptions, addressQueue), daemon=True)
+    serverProcess.start()
+
+    return serverProcess, addressQueue.get(timeout=30)
+
+
+def compare_to_baseline(reports, baselineFileName, maxRegression):
+    """Function to list the scenarios whose p50 latency or CPU per request got worse than the baseline by more than maxRegression (e.g. 0.2 = 20%)"""
+    with open(baselineFileName, 'r', encoding='utf-8') as data:
+        baselineReports = {report['scenario']: report for report in load(data)['scenarios']}
+
+    regressions = []
+
+    for report in reports:
+        baselineReport = baselineReports.get(report['scenario'])
+
+        if baselineReport is None:
+            continue
+
+        for metricName in ('p50_latency_ms', 'cpu_ms_per_request'):
+            if baselineReport[metricName] and report[metricName] > baselineReport[metricName] * (1 + maxRegression):
+                regressions.append(f"{report['scenario']} {metricName}: {baselineReport[metricName]:.2f} -> {report[metricName]:.2f}")
+
+    return regressions
+
+
+def print_reports(reports):
+    """Function to print the scenario reports as a table"""
+    columns = ['scenario', 'requests', 'failed_requests', 'throughput_per_second', 'p50_latency_ms', 'p99_latency_ms', 'cpu_ms_per_request', 'files_written_per_request', 'bytes_written_per_request']
+    print(' | '.join(columns))
+
+    for report in reports:
+        print(' | '.join(f'{report[column]:.2f}' if isinstance(report[column], float) else str(report[column]) for column in columns))
+
+
+def main():
+    """Function to run the benchmark scenarios against a local mock server, print a report and optionally check it against a baseline. Tokens are counted approximately unless --tiktoken is given, since tiktoken downloads its encoding on first use"""
+    parser = ArgumentParser(description='Offline benchmarks for the OpenAI integrations against a local mock server. Tokens are counted approximately so no network access is needed, pass --tiktoken to count them exactly, which downloads the cl100k_base encoding on first use unless it is already cached')
+    parser.add_argument('--scenarios', nargs='+', default=['batch_chat', 'packed_chat', 'similar_chat', 'assistant_threads', 'pdf_vision'])
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--num-prompts', type=int, default=200)
+    parser.add_argument('--num-users', type=int, default=50)
+    parser.add_argument('--messages-per-user', type=int, default=3)
+    parser.add_argument('--num-pages', type=int, default=8)
+    parser.add_argument('--output', help='Write the report to this JSON file')
+    parser.add_argument('--baseline', help='Fail if results regress against this earlier --output file')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--tiktoken', action='store_true', help='Count tokens with tiktoken, needs network access the first time the encoding is downloaded')
+    arguments = parser.parse_args()
+
+    if not arguments.tiktoken:
+        use_approximate_token_counts()
+
+    serverProcess, apiBaseURL = start_mock_server({'latencySeconds': arguments.latency_ms / 1000, 'latencyJitterSeconds': arguments.latency_ms / 5000, 'errorRate': arguments.error_rate, 'rateLimitRate': arguments.rate_limit_rate})
+    originalFolder = getcwd()
+    reports = []
+
+    try:
+        with TemporaryDirectory() as workFolder: #Integrations write under ./src/{applicationName}, so keep benchmark output out of the repo
+            chdir(workFolder)
+            makedirs(virtualEnvironmentName, exist_ok=True)
+            for keyFileName in ('API_KEY.txt', 'ORGANIZATION_KEY.txt'):
+                with open(f'{virtualEnvironmentName}/{keyFileName}', 'w', encoding='utf-8') as keyFile:
+                    keyFile.write('sk-benchmark')
+
+            scenarioRunners = {
+                'batch_chat': lambda: run_batch_chat(apiBaseURL, arguments.num_prompts),
+                'packed_chat': lambda: run_packed_chat(apiBaseURL, arguments.num_prompts),
+                'similar_chat': lambda: run_similar_chat(apiBaseURL, arguments.num_prompts),
+                'assistant_threads': lambda: run_assistant_threads(apiBaseURL, arguments.num_users, arguments.messages_per_user),
+                'pdf_vision': lambda: run_pdf_vision(apiBaseURL, arguments.num_pages)
+            }
+
+            for scenarioName in arguments.scenarios:
+                reports.append(scenarioRunners[scenarioName]())
+
+            chdir(originalFolder)
+
+        with urlopen(apiBaseURL.replace('/v1', '/mock/stats')) as statsResponse:
+            serverStats = loads(statsResponse.read())
+    finally:
+        chdir(originalFolder)
+        serverProcess.terminate()
+
+    print_reports(reports)
+
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as outputFile:
+            dump({'scenarios': reports, 'server': serverStats, 'settings': vars(arguments)}, outputFile, indent=2)
+
+    if arguments.baseline:
+        regressions = compare_to_baseline(reports, arguments.baseline, arguments.max_regression)
+
+        for regression in regressions:
+            print(f'Regression! {regression}')
+
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,293 +1,781 @@
-from os import makedirs, path, listdir
-from datetime import datetime
-from json import dump, load
-from tiktoken import get_encoding
-from requests import post
-from base64 import b64encode
-import pypdfium2 as pdfium
-
-
-class OpenAIAPIIntegration():
-    """Custom class to utilize APIs (REST) to work with OpenAI to do various functions"""
-    def __init__(self, applicationName, virtualEnvironmentName):
-        self.applicationName = applicationName
-        self.virtualEnvironmentName = virtualEnvironmentName
-
-        self.apiKey = self.get_api_key()
-        self.organizationId = self.get_organization_key()
-
-    def get_api_key(self): #Put API key in virtual environment folder, e.g. local
-        """Function to get the API key to use for authorization in API calls"""
-        try:
-            fileName = f'./{self.virtualEnvironmentName}/API_KEY.txt'
-            
-            with open(fileName, 'r', encoding='utf-8') as data:
-                key = data.read().strip()
-            return key
-        except FileNotFoundError as e:
-            print(f"Error: API key file not found! Full message: ${e}")
-
-    def get_organization_key(self):
-        """Function to get the Organization key to use with the API key when opening client object"""
-        try:
-            fileName = f'./{self.virtualEnvironmentName}/ORGANIZATION_KEY.txt'
-            
-            with open(fileName, 'r', encoding='utf-8') as data:
-                key = data.read().strip()
-            return key
-        except FileNotFoundError as e:
-            print(f"Error: Organization key file not found! Full message: ${e}")
-    
-    def get_chat_response(self, systemPrompt, userPrompt, gptModel, gptTemperature = 1, apiURL = 'https://api.openai.com/v1/chat/completions'):
-        """Function to call the OpenAI chat API and return a response in JSON format"""
-        header = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {self.apiKey}",
-        "OpenAI-Organization": self.organizationId
-        }
-
-        payload = {
-        "model": gptModel,
-        "temperature": gptTemperature,
-        "response_format": {"type": "json_object"},
-        "messages": [
-            {"role": "system", "content": systemPrompt + " #Output You will **ALWAYS** return your answer with keys in JSON format.  You will **NEVER** include linebreaks, indents, or extra formatting"},
-            {"role": "user", "content": userPrompt}
-            ],
-        }
-
-        response = post(apiURL, headers=header, json=payload)
-
-        return response.json()
-
-    def format_chat_response(self, gptResponse, systemPrompt, userPrompt):
-        """Function to take results from OpenAI and format them with appropriate data points"""
-        outputDict = {}
-        systemAnswerRaw = gptResponse['choices'][0]['message']['content']
-        systemAnswerFormatted = systemAnswerRaw.replace('\n', '').replace('{  ','{')
-
-        systemAnswerDateUnix = gptResponse['created']
-        systemAnswerDateTimeFormatted = datetime.utcfromtimestamp(systemAnswerDateUnix).strftime('%Y-%m-%d %H:%M:%S')
-        
-        systemModel = gptResponse['model']
-        systemCompletionTokens = gptResponse['usage']['completion_tokens']
-        systemPromptTokens = gptResponse['usage']['prompt_tokens']
-        systemTotalTokens = gptResponse['usage']['total_tokens']
-
-        outputDict['answer'] = systemAnswerFormatted
-        outputDict['system_prompt'] = systemPrompt
-        outputDict['user_prompt'] = userPrompt
-        outputDict['model'] = systemModel
-        outputDict['date_time_unix'] = systemAnswerDateUnix
-        outputDict['date_time_formatted'] = systemAnswerDateTimeFormatted
-        outputDict['prompt_tokens'] = systemPromptTokens
-        outputDict['completion_tokens'] = systemCompletionTokens
-        outputDict['total_tokens'] = systemTotalTokens
-
-        return outputDict
-    
-    def write_formatted_chat_response_to_json_file(self, results, unixDateTimeFieldName = 'date_time_unix', modelFieldName = 'model', mode='w', messageIndent=0):
-        """Function to take the results and output to JSON file for analysis"""
-        uniqueDateTimeStamp = results[unixDateTimeFieldName]
-        modelName = results[modelFieldName]
-        makedirs(path.dirname(f'./src/{self.applicationName}/data/chat_messages/'), exist_ok=True)
-        
-        with open(f'./src/{self.applicationName}/data/chat_messages/{modelName}_{uniqueDateTimeStamp}.json', mode, encoding='utf-8') as outputFile:
-            dump(results, outputFile, ensure_ascii=False, indent=messageIndent)
-    
-    def get_num_tokens_from_string(self, inputToCheck, encodingName='cl100k_base'):
-        """Function to get number of tokens in any string value"""
-        encoding = get_encoding(encodingName)
-        numTokens = len(encoding.encode(inputToCheck))
-        
-        return numTokens
-    
-    def check_num_tokens_for_inputs(self, systemPrompt, userPrompt, maxTokenLimit, averageResponseTokens = 1000):
-        """Function to check the number of tokens compared to the limit to proactively catch errors"""
-        systemPromptTokens = self.get_num_tokens_from_string(systemPrompt)
-        userPromptTokens = self.get_num_tokens_from_string(userPrompt) + 32
-
-        if systemPromptTokens + userPromptTokens + averageResponseTokens < maxTokenLimit:
-            proceed = True
-        else:
-            print('Too many tokens to send! Please choose another model or limit your prompts.')
-            proceed = False
-        
-        return proceed
-
-    def convert_pdf_to_images(self, pdfFileName, renderDPIScale=3, renderRotationDegrees=0):
-        fileNameExtensionCharacterPosition = pdfFileName.find('.')
-        fileNameWithoutExtension = pdfFileName[:fileNameExtensionCharacterPosition]
-        outputFileNames = []
-
-        try:
-            pdf = pdfium.PdfDocument(f"./src/{self.applicationName}/data/{pdfFileName}")
-        except pdfium.PdfiumError as e:
-            print(f'Error! Not a valid PDF, please upload a different file. Full error message: {e}')
-        else:
-            totalPages = len(pdf)  # get the number of pages in the document
-
-            for pageNumber in range(0, totalPages):
-                page = pdf[pageNumber]
-
-                bitmap = page.render(
-                    scale = renderDPIScale,    # 72 * scale dpi resolution, e.g. 3 scale = 72 * 3 or 216 dpi
-                    rotation = renderRotationDegrees, # 0, 90, 180, or 270 degrees (default is 0)
-                )
-
-                fileNameFormatted = f'./src/{self.applicationName}/data/{fileNameWithoutExtension}_{pageNumber + 1}.png'
-                
-                convertedImage = bitmap.to_pil()
-                convertedImage.save(fileNameFormatted)
-                
-                outputFileNames.append(fileNameFormatted)
-        
-        return outputFileNames
-    
-    def encode_image_to_b64(self, imagePath):
-        """Function to encode a local image to base64 to prep for sending to OpenAI"""
-        with open(imagePath, "rb") as imageFile:
-            return b64encode(imageFile.read()).decode('utf-8')
-    
-    def get_vision_response_from_local_files(self, imageFileNameOrNames, userPrompt, gptModel='gpt-4-vision-preview', maxTokens=4096, apiURL = 'https://api.openai.com/v1/chat/completions'):
-        """Function to call the open AI vision/image API and return a response in JSON format"""
-        
-        header = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {self.apiKey}",
-        "OpenAI-Organization": self.organizationId
-        }
-
-        imageFileNamesToEncode = []
-
-        if isinstance(imageFileNameOrNames, list):
-            imageFileNamesToEncode = imageFileNameOrNames
-        else:
-            imageFileNamesToEncode = list(imageFileNameOrNames)
-
-        contentArray = [{"type": "text", "text": userPrompt}]
-
-        for images in imageFileNamesToEncode:        
-            base64Image = self.encode_image(f'./{images}')
-            imageContent = {"type": "image_url"
-                 , "image_url": {"url": f"data:image/jpeg;base64,{base64Image}"}}
-            contentArray.append(imageContent)
-
-
-        payload = {
-        "model": gptModel,
-        "messages": [
-            {
-            "role": "user",
-            "content": contentArray
-            }
-        ],
-        "max_tokens": maxTokens
-        }
-
-        response = post(apiURL, headers=header, json=payload)
-
-        return response.json()
-    
-    def create_assistant(self, name, instructions, assistantType='retrieval', apiURL = 'https://api.openai.com/v1/assistants', gptModel='gpt-4-1106-preview', mode='w', messageIndent=0):
-        """Function to call the open AI API to create an assistant"""
-        header = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.apiKey}",
-            "OpenAI-Organization": self.organizationId,
-            "OpenAI-Beta": "assistants=v1"
-            }
-        
-        payload = {
-            "model": gptModel,
-            "name": name,
-            "instructions": instructions,
-            "tools": [
-                {
-                "type": assistantType
-                }
-            ]
-        }
-
-        response = post(apiURL, headers=header, json=payload)
-        responseJSON = response.json()
-
-        assistantId = responseJSON['id']
-        assistantName = responseJSON['name']
-
-        makedirs(path.dirname(f'./src/{self.applicationName}/data/config/'), exist_ok=True)
-        
-        with open(f'./src/{self.applicationName}/data/config/{assistantId}_{assistantName}.json', mode, encoding='utf-8') as outputFile:
-            dump(responseJSON, outputFile, ensure_ascii=False, indent=messageIndent)
-
-    def get_assistant_id_from_config(self, assistantName):
-        """Function to review the previously generated assistant json file configurations to return the ID associated"""
-        configFiles = listdir(f'./src/{self.applicationName}/config/')
-        assistantFiles = []
-
-        for file in configFiles:
-            if file.startswith('asst'):
-                assistantFiles.append(file)
-        
-        for file in assistantFiles:
-            with open(f'./src/{self.applicationName}/config/{file}', 'r') as data:
-                config = load(data)
-                name = config['name']
-            
-                if name == assistantName:
-                    assistantId = config['id']
-                    print('Found existing assistant with id: ' + assistantId)
-        
-        try:
-            return assistantId
-        except UnboundLocalError:
-            raise Exception('Error: Assistant does not exist by name entered.  Please check the application and assistant name or call the create assistant function.')
-    
-    def create_assistant_thread(self, assistantId, apiURL = 'https://api.openai.com/v1/threads', mode='w', messageIndent=0):
-        """Function to call the open AI API to create a thread"""
-        header = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.apiKey}",
-            "OpenAI-Organization": self.organizationId,
-            "OpenAI-Beta": "assistants=v1"
-            }
-
-        payload = ''
-
-        response = post(apiURL, headers=header, json=payload)
-        responseJSON = response.json()
-
-        threadId = responseJSON['id']
-        createdDate = responseJSON['created_at']
-
-        makedirs(path.dirname(f'./src/{self.applicationName}/data/config/'), exist_ok=True)
-        
-        with open(f'./src/{self.applicationName}/data/config/{threadId}_{createdDate}_{assistantId}.json', mode, encoding='utf-8') as outputFile:
-            dump(responseJSON, outputFile, ensure_ascii=False, indent=messageIndent)
-
-    def get_thread_id_for_user(self, assistantId, userId):
-        """Function to review the previously generated thread json file configurations to return the ID associated"""
-        configFiles = listdir(f'./src/{self.applicationName}/config/')
-        threadFiles = []
-
-        for file in configFiles:
-            if file.startswith('thread') and file.endswith(f'{assistantId}.json'):
-                threadFiles.append(file)
-    
-        for file in threadFiles:
-            with open(f'./src/{self.applicationName}/config/{file}', 'r') as data:
-                config = load(data)
-                threadId = config['id']
-                userId = config['user_id']
-
-            if userId == userId:
-                userSpecificFileId = threadId
-                print('Found existing thread for assistant and user with id: ' + str(userSpecificFileId))
-            
-        try:
-            return userSpecificFileId
-        except UnboundLocalError:
-            raise Exception('Error: Thread does not exist for assistant and user ID.  Please check the assistant ID, application name, and user ID or call the create thread function.')
-
-
-    modelInformation = {"latest_models": [{"name":"gpt-3.5-turbo-1106", "max_tokens_supported":4096, "cost_per_1k_tokens": 0.0030}, {"name":"gpt-4-1106-preview", "max_tokens_supported":128000, "cost_per_1k_tokens": 0.04}], "historical_models" : [{"name":"gpt-3.5-turbo", "max_tokens_supported":4000, "cost_per_1k_tokens": 0.0030}, {"name":"gpt-4", "max_tokens_supported":16000, "cost_per_1k_tokens": 0.009}, {"name":"gpt-4-32k", "max_tokens_supported":32000, "cost_per_1k_tokens": 0.18}]}
\ No newline at end of file
+from os import path
+from functools import cached_property
+from threading import Lock
+from datetime import datetime
+from time import perf_counter, time
+from uuid import uuid4
+from json import loads, dumps
+from urllib.parse import urlparse
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from os import cpu_count
+from caller.response_cache import ChatResponseCache
+from caller.similarity_cache import SimilarPromptCache
+from caller.model_router import ModelRouter
+from caller.rate_limiter import RateLimiter
+from caller.retry import RetryPolicy, RetryableHTTPError, RETRYABLE_STATUS_CODES, parse_retry_after_seconds
+from caller.config_index import ConfigIndex
+from caller.record_index import RecordIndex
+from caller.chat_stream import ChatStream
+from caller.chat_batch import ChatBatchJob
+from caller.chat_conversation import ChatConversation
+from caller.token_counting import get_encoding_name, count_tokens, count_tokens_in_batch
+from caller.output_sink import JSONFileSink, create_output_sink
+from caller.metrics import MetricsRegistry
+from caller.shared_clients import read_credential, get_shared_http_client
+
+
+class OpenAIAPIIntegration():
+    """Custom class to utilize APIs (REST) to work with OpenAI to do various functions"""
+    def __init__(self, applicationName, virtualEnvironmentName, cacheMaxEntries=5000, cacheMaxAgeSeconds=None, httpPoolSize=10, httpKeepAlive=True, httpConnectTimeoutSeconds=10, httpReadTimeoutSeconds=120, useHTTP2=False, useRateLimiter=True, maxRetries=5, retryDeadlineSeconds=120, outputSink='json', outputSinkOptions=None, metricsExporter=None, apiBaseURL='https://api.openai.com/v1', shareHTTPClient=True, similarityThreshold=None, routingPolicy='cheapest', routedModels=None, failoverRetries=1):
+        self.applicationName = applicationName
+        self.virtualEnvironmentName = virtualEnvironmentName
+        self.apiBaseURL = apiBaseURL.rstrip('/')
+
+        self.httpClientOptions = {'poolSize': httpPoolSize, 'keepAlive': httpKeepAlive, 'connectTimeoutSeconds': httpConnectTimeoutSeconds, 'readTimeoutSeconds': httpReadTimeoutSeconds, 'useHTTP2': useHTTP2}
+        self.shareHTTPClient = shareHTTPClient
+        self.httpClientLock = Lock()
+        self.rateLimiter = RateLimiter(self.get_model_rate_limits()) if useRateLimiter else None
+        self.retryPolicy = RetryPolicy(maxRetries=maxRetries, deadlineSeconds=retryDeadlineSeconds)
+        self.failoverRetryPolicy = RetryPolicy(maxRetries=failoverRetries, deadlineSeconds=retryDeadlineSeconds) #Routed calls move to the next model quickly instead of retrying an overloaded one
+
+        self.configIndex = ConfigIndex(f'./src/{self.applicationName}/data/config/')
+        self.responseCache = ChatResponseCache(f'./src/{self.applicationName}/data/cache/chat_responses/', maxEntries=cacheMaxEntries, maxAgeSeconds=cacheMaxAgeSeconds)
+        self.similarityCache = SimilarPromptCache(f'./src/{self.applicationName}/data/cache/similar_prompts/', similarityThreshold) if similarityThreshold is not None else None #Opt in, answers to near-duplicate prompts are reused without calling the API
+        self.configSink = JSONFileSink(f'./src/{self.applicationName}/data/') #Config files stay one JSON file each, the config index is rebuilt from them
+        self.outputSink = create_output_sink(outputSink, f'./src/{self.applicationName}/data/', outputSinkOptions)
+        self.metrics = MetricsRegistry(applicationName, {model['name']: model['cost_per_1k_tokens'] for modelList in self.modelInformation.values() for model in modelList}, metricsExporter)
+        self.modelRouter = ModelRouter(self.modelInformation, routedModels, routingPolicy)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+    @cached_property
+    def apiKey(self):
+        """Function to resolve the API key the first time a call needs it"""
+        return self.get_api_key()
+
+    @cached_property
+    def organizationId(self):
+        """Function to resolve the organization key the first time a call needs it"""
+        return self.get_organization_key()
+
+    @cached_property
+    def header(self):
+        """Function to build the request headers the first time a call needs them"""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.apiKey}",
+            "OpenAI-Organization": self.organizationId
+            }
+
+    @cached_property
+    def assistantHeader(self):
+        """Function to build the assistants (beta) request headers the first time a call needs them"""
+        return {**self.header, "OpenAI-Beta": "assistants=v1"}
+
+    @cached_property
+    def httpClient(self):
+        """Function to open the connection pool on the first call, shared with every other integration in the process unless shareHTTPClient is off"""
+        with self.httpClientLock: #Threads starting their first call together would otherwise each open a pool, leaking all but one
+            if 'httpClient' not in self.__dict__:
+                if self.shareHTTPClient:
+                    self.__dict__['httpClient'] = get_shared_http_client(**self.httpClientOptions)
+                else:
+                    from caller.http_client import PooledHTTPClient
+
+                    self.__dict__['httpClient'] = PooledHTTPClient(**self.httpClientOptions)
+
+            return self.__dict__['httpClient']
+
+    @cached_property
+    def recordIndex(self):
+        """Function to open the index over the saved chat messages and run logs the first time a query needs it"""
+        return RecordIndex(f'./src/{self.applicationName}/data/', self.metrics.costPerThousandTokens, outputSink=self.outputSink)
+
+    @cached_property
+    def imagePreparer(self):
+        """Function to set up image preparation on the first vision call, so chat-only scripts never import Pillow"""
+        from caller.image_preparation import VisionImagePreparer
+
+        return VisionImagePreparer(f'./src/{self.applicationName}/data/cache/vision_images/')
+
+    def close(self):
+        """Function to close the pooled HTTP connections, flush the output sink and export the metrics when finished with the client"""
+        if 'httpClient' in self.__dict__ and not self.shareHTTPClient: #The shared pool stays open for other integrations and closes at exit
+            self.httpClient.close()
+        self.outputSink.close()
+        self.metrics.export()
+        self.configIndex.close()
+
+        if 'recordIndex' in self.__dict__:
+            self.recordIndex.close()
+
+    def get_api_key(self): #Put API key in virtual environment folder, e.g. local, or set OPENAI_API_KEY
+        """Function to get the API key to use for authorization in API calls"""
+        return read_credential('OPENAI_API_KEY', self.virtualEnvironmentName, 'API_KEY.txt', 'API key')
+
+    def get_organization_key(self):
+        """Function to get the Organization key to use with the API key when opening client object"""
+        return read_credential('OPENAI_ORG_ID', self.virtualEnvironmentName, 'ORGANIZATION_KEY.txt', 'Organization key')
+    
+    def get_model_rate_limits(self):
+        """Function to get the requests and tokens per minute limits for each model listed in the model information"""
+        modelLimits = {}
+
+        for modelList in self.modelInformation.values():
+            for model in modelList:
+                modelLimits[model['name']] = {'requests_per_minute': model.get('requests_per_minute'), 'tokens_per_minute': model.get('tokens_per_minute')}
+
+        return modelLimits
+
+    def wait_for_rate_limit(self, gptModel, estimatedTokens):
+        """Function to hold a call until the rate limiter has budget for it, returning the seconds waited and the tokens charged, to settle once the call ends"""
+        if self.rateLimiter is None or gptModel is None:
+            return 0.0, 0
+
+        return self.rateLimiter.acquire(gptModel, estimatedTokens)
+
+    def update_rate_limit(self, gptModel, response):
+        """Function to feed the response headers back to the rate limiter"""
+        if self.rateLimiter is None or gptModel is None:
+            return
+
+        self.rateLimiter.update_from_headers(gptModel, response.headers)
+
+    def settle_rate_limit(self, gptModel, chargedTokens, responseJSON):
+        """Function to give back the charged tokens a call did not use, all of them when it was rejected or never got a response"""
+        if self.rateLimiter is None or gptModel is None:
+            return
+
+        if isinstance(responseJSON, dict) and responseJSON.get('usage'):
+            self.rateLimiter.settle(gptModel, chargedTokens, responseJSON['usage']['total_tokens'])
+        else: #Rejected calls, connection errors and timeouts do not use any tokens
+            self.rateLimiter.settle(gptModel, chargedTokens, 0)
+
+    def is_retryable_error(self, error):
+        """Function to decide if a failed call should be retried (connection errors, timeouts, 429s and 5xx)"""
+        return isinstance(error, RetryableHTTPError) or isinstance(error, self.httpClient.transientErrors)
+
+    def get_api_url(self, endpoint):
+        """Function to build the full URL for an API endpoint from the base URL, e.g. chat/completions"""
+        return f'{self.apiBaseURL}/{endpoint}'
+
+    def get_operation_name(self, apiURL):
+        """Function to name a call for the metrics by its API path, e.g. chat/completions"""
+        return urlparse(apiURL).path.split('/v1/', 1)[-1].strip('/')
+
+    def record_usage(self, callRecord, responseJSON):
+        """Function to copy the token usage and any API error from a response onto the call being timed"""
+        if not isinstance(responseJSON, dict):
+            return
+
+        if 'error' in responseJSON:
+            callRecord['status'] = 'api_error'
+
+        if responseJSON.get('usage'):
+            callRecord['prompt_tokens'] = responseJSON['usage'].get('prompt_tokens', 0)
+            callRecord['completion_tokens'] = responseJSON['usage'].get('completion_tokens', 0)
+
+    def send_request(self, apiURL, headers, payload, gptModel=None, estimatedTokens=0, method='POST', files=None, retryPolicy=None):
+        """Function to send a request (a JSON POST by default, a GET, or a multipart POST when files are given) with rate limiting and retries on transient failures, returning the response JSON and the number of retries used"""
+        with self.metrics.time_call(self.get_operation_name(apiURL), gptModel) as callRecord:
+            responseJSON, retryCount = (retryPolicy or self.retryPolicy).call(lambda: self.send_request_attempt(apiURL, headers, payload, gptModel, estimatedTokens, callRecord, method, files), self.is_retryable_error)
+            callRecord['retry_count'] = retryCount
+            self.record_usage(callRecord, responseJSON)
+
+            return responseJSON, retryCount
+
+    def send_request_attempt(self, apiURL, headers, payload, gptModel, estimatedTokens, callRecord, method='POST', files=None):
+        """Function to make one attempt at a request, raising a retryable error for 429/5xx and noting the queue, connect and first byte times"""
+        queueSeconds, chargedTokens = self.wait_for_rate_limit(gptModel, estimatedTokens)
+        callRecord['queue_seconds'] += queueSeconds
+        responseJSON = None
+
+        try:
+            self.httpClient.reset_connect_timing()
+
+            if method == 'GET':
+                response = self.httpClient.get(apiURL, headers=headers)
+            elif files is not None:
+                response = self.httpClient.post_files(apiURL, headers=headers, data=payload, files=files)
+            else:
+                response = self.httpClient.post(apiURL, headers=headers, json=payload)
+
+            callRecord['connect_seconds'] = self.httpClient.get_connect_seconds()
+            callRecord['first_byte_seconds'] = self.httpClient.get_first_byte_seconds(response)
+
+            try:
+                responseJSON = response.json()
+            except ValueError: #Gateway errors can come back as HTML
+                responseJSON = {'error': {'message': response.text}}
+
+            self.update_rate_limit(gptModel, response)
+        finally: #Settled even when the attempt fails on a connection error or timeout, so the charge is never kept
+            self.settle_rate_limit(gptModel, chargedTokens, responseJSON)
+
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            raise RetryableHTTPError(response.status_code, responseJSON, parse_retry_after_seconds(response.headers))
+
+        return responseJSON
+
+    def build_chat_payload(self, systemPrompt, userPrompt, gptModel, gptTemperature = 1, historyMessages=()):
+        """Function to build the chat completion payload sent to OpenAI, with any earlier conversation messages between the system prompt and the new question"""
+        payload = {
+        "model": gptModel,
+        "temperature": gptTemperature,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": systemPrompt + " #Output You will **ALWAYS** return your answer with keys in JSON format.  You will **NEVER** include linebreaks, indents, or extra formatting"},
+            *historyMessages,
+            {"role": "user", "content": userPrompt}
+            ],
+        }
+
+        return payload
+
+    def estimate_request_tokens(self, payload, gptModel, expectedCompletionTokens):
+        """Function to estimate the tokens a chat request will use for the rate limiter, every message sent plus the expected answer"""
+        return sum(self.get_num_tokens_from_string(message['content'], gptModel=gptModel) for message in payload['messages']) + expectedCompletionTokens #Single message counts are cached, so repeated history is not re-tokenized
+
+    def get_chat_response(self, systemPrompt, userPrompt, gptModel, gptTemperature = 1, apiURL = None, useCache=True, expectedCompletionTokens=1000, historyMessages=(), retryPolicy=None, useSimilarityCache=True):
+        """Function to call the OpenAI chat API and return a response in JSON format, reusing a locally cached response for an identical request, or with the similarity cache on a saved answer to a near-duplicate prompt, when available (marked with from_cache)"""
+        apiURL = apiURL or self.get_api_url('chat/completions')
+        payload = self.build_chat_payload(systemPrompt, userPrompt, gptModel, gptTemperature, historyMessages)
+
+        if useCache:
+            cachedResponse = self.responseCache.get(payload)
+
+            if cachedResponse is not None:
+                self.metrics.increment('openai_cache_hits_total', model=gptModel, operation=self.get_operation_name(apiURL))
+                return {**cachedResponse, 'from_cache': True, 'requested_model': gptModel}
+
+        if useSimilarityCache and not historyMessages: #Saved answers are indexed by system prompt and question only, so follow-ups with history never match
+            similarResponse = self.get_similar_chat_response(systemPrompt, userPrompt, gptModel)
+
+            if similarResponse is not None:
+                return similarResponse
+
+        estimatedTokens = self.estimate_request_tokens(payload, gptModel, expectedCompletionTokens)
+        responseJSON, retryCount = self.send_request(apiURL, self.header, payload, gptModel, estimatedTokens, retryPolicy=retryPolicy)
+
+        if useCache and 'choices' in responseJSON: #Only successful completions are cached, errors should be retried
+            self.cache_chat_response(payload, responseJSON)
+
+        return {**responseJSON, 'retry_count': retryCount, 'requested_model': gptModel}
+
+    def cache_chat_response(self, payload, responseJSON):
+        """Function to save a received response to the local cache, only logging a failed write so the response is still returned"""
+        try:
+            self.responseCache.set(payload, responseJSON)
+        except Exception as e:
+            print(f'Error: Could not cache the chat response. Full message: {e}')
+
+    def get_routed_chat_response(self, systemPrompt, userPrompt, gptTemperature = 1, routingPolicy=None, useCache=True, expectedCompletionTokens=1000, useSimilarityCache=True):
+        """Function to call the OpenAI chat API on the model the router picks for this request, failing over to the next model on 429s, 5xx and connection errors, and noting which model served it on the response"""
+        requiredTokens = self.get_num_tokens_from_string(systemPrompt) + self.get_num_tokens_from_string(userPrompt) + expectedCompletionTokens + 32
+        routedModels = self.modelRouter.get_route(requiredTokens, routingPolicy)
+        failedModels = []
+
+        if not routedModels:
+            raise Exception(f'Error: No routed model supports {requiredTokens} tokens.  Please choose another model or limit your prompts.')
+
+        for gptModel in routedModels:
+            startTime = perf_counter()
+
+            try:
+                rawResponse = self.get_chat_response(systemPrompt, userPrompt, gptModel, gptTemperature, useCache=useCache, expectedCompletionTokens=expectedCompletionTokens, retryPolicy=self.failoverRetryPolicy if gptModel != routedModels[-1] else None, useSimilarityCache=useSimilarityCache) #The last model left keeps the full retries
+            except Exception as e:
+                if not self.is_retryable_error(e):
+                    raise
+
+                self.modelRouter.record_failure(gptModel, getattr(e, 'retryAfterSeconds', None))
+                self.metrics.increment('openai_router_failovers_total', model=gptModel)
+                failedModels.append(gptModel)
+                print(f'Error: {gptModel} is unavailable, failing over to the next model. Full message: {e}')
+                continue
+
+            if 'choices' not in rawResponse: #An error the API answered without retrying, e.g. a rejected request, still counts against the model
+                self.modelRouter.record_failure(gptModel)
+            elif not rawResponse.get('from_cache'): #Cache hits say nothing about the model's latency
+                self.modelRouter.record_success(gptModel, perf_counter() - startTime)
+
+            return {**rawResponse, 'routed_model': gptModel, 'routing_policy': routingPolicy or self.modelRouter.policy, 'failed_over_from': failedModels}
+
+        raise Exception(f'Error: Every routed model failed ({", ".join(failedModels)}).  Please try again later.')
+
+    def get_chat_response_stream(self, systemPrompt, userPrompt, gptModel, gptTemperature = 1, apiURL = None, useCache=True, writeToFile=True, expectedCompletionTokens=1000, historyMessages=(), useSimilarityCache=True):
+        """Function to call the OpenAI chat API with streaming, returning an iterable of answer text as it arrives. After the loop ends the formatted response (with first/last token timings) is on formattedResponse and has been written to file"""
+        apiURL = apiURL or self.get_api_url('chat/completions')
+        payload = self.build_chat_payload(systemPrompt, userPrompt, gptModel, gptTemperature, historyMessages)
+        payload['stream'] = True
+        payload['stream_options'] = {'include_usage': True}
+
+        estimatedTokens = self.estimate_request_tokens(payload, gptModel, expectedCompletionTokens)
+
+        return ChatStream(self, payload, systemPrompt, userPrompt, apiURL, estimatedTokens, useCache, writeToFile, useSimilarityCache and not historyMessages)
+
+    def format_chat_response(self, gptResponse, systemPrompt, userPrompt):
+        """Function to take results from OpenAI and format them with appropriate data points"""
+        outputDict = {}
+        systemAnswerRaw = gptResponse['choices'][0]['message']['content']
+        systemAnswerFormatted = systemAnswerRaw.replace('\n', '').replace('{  ','{')
+
+        systemAnswerDateUnix = gptResponse['created']
+        systemAnswerDateTimeFormatted = datetime.utcfromtimestamp(systemAnswerDateUnix).strftime('%Y-%m-%d %H:%M:%S')
+        
+        systemModel = gptResponse['model']
+        systemCompletionTokens = gptResponse['usage']['completion_tokens']
+        systemPromptTokens = gptResponse['usage']['prompt_tokens']
+        systemTotalTokens = gptResponse['usage']['total_tokens']
+
+        outputDict['id'] = gptResponse['id']
+        outputDict['answer'] = systemAnswerFormatted
+        outputDict['system_prompt'] = systemPrompt
+        outputDict['user_prompt'] = userPrompt
+        outputDict['model'] = systemModel
+        outputDict['date_time_unix'] = systemAnswerDateUnix
+        outputDict['date_time_formatted'] = systemAnswerDateTimeFormatted
+        outputDict['prompt_tokens'] = systemPromptTokens
+        outputDict['completion_tokens'] = systemCompletionTokens
+        outputDict['total_tokens'] = systemTotalTokens
+        outputDict['retry_count'] = gptResponse.get('retry_count', 0)
+        outputDict['requested_model'] = gptResponse.get('requested_model', systemModel) #The API may answer with a dated snapshot name, e.g. gpt-4-0613 for gpt-4
+
+        if 'similarity' in gptResponse:
+            outputDict['similar_response_id'] = gptResponse['similar_response_id']
+            outputDict['similar_user_prompt'] = gptResponse['similar_user_prompt']
+            outputDict['similarity'] = gptResponse['similarity']
+
+        if 'routed_model' in gptResponse:
+            outputDict['routed_model'] = gptResponse['routed_model']
+            outputDict['routing_policy'] = gptResponse['routing_policy']
+            outputDict['failed_over_from'] = gptResponse['failed_over_from']
+
+        return outputDict
+    
+    def write_formatted_chat_response_to_json_file(self, results, unixDateTimeFieldName = 'date_time_unix', modelFieldName = 'model', idFieldName = 'id', mode='w', messageIndent=0):
+        """Function to take the results and output them for analysis through the configured output sink (one JSON file each by default)"""
+        uniqueDateTimeStamp = results[unixDateTimeFieldName]
+        modelName = results[modelFieldName]
+        responseId = results.get(idFieldName) #Responses created in the same second would otherwise overwrite each other
+        fileName = f'{modelName}_{uniqueDateTimeStamp}_{responseId}.json' if responseId else f'{modelName}_{uniqueDateTimeStamp}.json'
+        self.outputSink.write('chat_messages', fileName, results, mode, messageIndent)
+
+        if self.similarityCache is not None and 'conversation_id' not in results and 'similarity' not in results: #Conversation answers depend on the earlier turns, and reused answers are already indexed
+            self.similarityCache.add(results, results.get('requested_model'))
+
+    def get_similar_chat_response(self, systemPrompt, userPrompt, gptModel, similarityThreshold=None):
+        """Function to look up a saved answer to a near-duplicate prompt with the same model and system prompt, returning it as a chat response with its similarity score and no token usage, or None to fall through to the API"""
+        if self.similarityCache is None:
+            return None
+
+        similarMatch = self.similarityCache.find(gptModel, systemPrompt, userPrompt, similarityThreshold)
+
+        if similarMatch is None:
+            return None
+
+        self.metrics.increment('openai_similarity_cache_hits_total', model=gptModel)
+        savedResponse = similarMatch['response']
+
+        return {
+            'id': f"{savedResponse['id']}_similar_{uuid4().hex[:12]}", #Its own id, so saving it never overwrites the original record
+            'object': 'chat.completion',
+            'created': int(time()),
+            'model': savedResponse['model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': savedResponse['answer']}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}, #Nothing was sent to the API
+            'from_cache': True,
+            'requested_model': gptModel,
+            'similar_response_id': savedResponse['id'],
+            'similar_user_prompt': savedResponse['user_prompt'],
+            'similarity': similarMatch['similarity']
+        }
+
+    def get_num_tokens_from_string(self, inputToCheck, encodingName=None, gptModel=None):
+        """Function to get number of tokens in any string value, using the encoding for the model when one is given (cl100k_base otherwise)"""
+        numTokens = count_tokens(encodingName or get_encoding_name(gptModel), inputToCheck)
+        
+        return numTokens
+
+    def get_num_tokens_for_strings(self, inputsToCheck, encodingName=None, gptModel=None, numThreads=8):
+        """Function to get the number of tokens for many strings in one call, counting each distinct string once across multiple threads"""
+        return count_tokens_in_batch(encodingName or get_encoding_name(gptModel), list(inputsToCheck), numThreads)
+    
+    def check_num_tokens_for_inputs(self, systemPrompt, userPrompt, maxTokenLimit, averageResponseTokens = 1000, gptModel=None):
+        """Function to check the number of tokens compared to the limit to proactively catch errors"""
+        systemPromptTokens = self.get_num_tokens_from_string(systemPrompt, gptModel=gptModel)
+        userPromptTokens = self.get_num_tokens_from_string(userPrompt, gptModel=gptModel) + 32
+
+        if systemPromptTokens + userPromptTokens + averageResponseTokens < maxTokenLimit:
+            proceed = True
+        else:
+            print('Too many tokens to send! Please choose another model or limit your prompts.')
+            proceed = False
+        
+        return proceed
+
+    def process_chat_prompt(self, systemPrompt, userPrompt, gptModel, maxTokenLimit, gptTemperature = 1):
+        """Function to run a single prompt through the token check, chat call, formatting and file write steps and report the outcome"""
+        result = {'system_prompt': systemPrompt, 'user_prompt': userPrompt, 'status': None, 'response': None, 'error': None}
+
+        try:
+            if not self.check_num_tokens_for_inputs(systemPrompt, userPrompt, maxTokenLimit, gptModel=gptModel):
+                result['status'] = 'too_many_tokens'
+                return result
+
+            rawResponse = self.get_chat_response(systemPrompt, userPrompt, gptModel, gptTemperature)
+            formattedResponse = self.format_chat_response(rawResponse, systemPrompt, userPrompt)
+            self.write_formatted_chat_response_to_json_file(formattedResponse)
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        else:
+            result['status'] = 'success'
+            result['response'] = formattedResponse
+
+        return result
+
+    def get_chat_responses_in_batch(self, promptPairs, gptModel, maxTokenLimit, gptTemperature = 1, maxWorkers = 8):
+        """Function to run an iterable of (systemPrompt, userPrompt) pairs concurrently with at most maxWorkers calls in flight, yielding each result as it finishes"""
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            inFlight = set()
+
+            for systemPrompt, userPrompt in promptPairs:
+                if len(inFlight) >= maxWorkers: #Only pull the next prompt once a slot frees up so large iterables are not queued all at once
+                    finished, inFlight = wait(inFlight, return_when=FIRST_COMPLETED)
+
+                    for future in finished:
+                        yield future.result()
+
+                inFlight.add(executor.submit(self.process_chat_prompt, systemPrompt, userPrompt, gptModel, maxTokenLimit, gptTemperature))
+
+            while inFlight:
+                finished, inFlight = wait(inFlight, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    yield future.result()
+
+    def start_conversation(self, systemPrompt, gptModel, conversationId=None, **conversationOptions):
+        """Function to open a chat conversation for follow-up questions, loading its earlier turns from the saved chat messages when an existing conversation ID is given"""
+        conversation = ChatConversation(self, systemPrompt, gptModel, conversationId, **conversationOptions)
+
+        if conversationId is not None:
+            print(f'Found {conversation.load_history()} earlier turns for conversation: {conversationId}')
+
+        return conversation
+
+    def get_chat_batch(self, batchName):
+        """Function to open a chat batch job by name, picking up its saved state when it was started in an earlier run"""
+        return ChatBatchJob(self, batchName)
+
+    def run_chat_batch(self, batchName, promptPairs, gptModel, maxTokenLimit=None, gptTemperature = 1, completionWindow='24h', metadata={}, **pollingOptions):
+        """Function to send (systemPrompt, userPrompt) pairs through the Batch API instead of one call each, for work that can wait: submit them (or resume a batch already submitted under this name), wait for it to finish and save each response like process_chat_prompt would, returning the job state"""
+        batchJob = self.get_chat_batch(batchName)
+        batchJob.submit(promptPairs, gptModel, maxTokenLimit, gptTemperature, completionWindow, metadata)
+        batchJob.wait(**pollingOptions)
+        batchJob.collect_results()
+
+        return batchJob.state
+
+    def get_model_max_tokens(self, gptModel):
+        """Function to look up the max tokens a model supports from modelInformation, None for models that are not listed"""
+        for modelList in self.modelInformation.values():
+            for model in modelList:
+                if model['name'] == gptModel:
+                    return model['max_tokens_supported']
+
+    def build_packed_system_prompt(self, systemPrompt):
+        """Function to extend a shared system prompt so the model answers each keyed question in a packed request on its own"""
+        return systemPrompt + " #Input The user message is a JSON object of independent questions keyed q1, q2 and so on.  Answer each question as if it had been asked alone. #Packing Return one JSON object with exactly the same keys, each holding the JSON answer for that question"
+
+    def pack_prompts(self, systemPrompt, userPrompts, gptModel, maxTokenLimit=None, expectedTokensPerAnswer=200, maxPromptsPerPack=20, tokenBudgetShare=0.75):
+        """Function to group user prompts that share a system prompt into packs that fill a safe share of the model's token limit, returning the prompt positions in each pack"""
+        tokenBudget = int((maxTokenLimit or self.get_model_max_tokens(gptModel) or 4096) * tokenBudgetShare)
+        packOverheadTokens = self.get_num_tokens_from_string(self.build_chat_payload(self.build_packed_system_prompt(systemPrompt), '', gptModel)['messages'][0]['content'], gptModel=gptModel) + 32
+        packs = []
+        currentPack = []
+        currentTokens = packOverheadTokens
+
+        for promptPosition, promptTokens in enumerate(self.get_num_tokens_for_strings(userPrompts, gptModel=gptModel)):
+            questionTokens = promptTokens + expectedTokensPerAnswer + 8 #Room for the key and JSON punctuation around both the question and its answer
+
+            if currentPack and (currentTokens + questionTokens > tokenBudget or len(currentPack) >= maxPromptsPerPack):
+                packs.append(currentPack)
+                currentPack = []
+                currentTokens = packOverheadTokens
+
+            currentPack.append(promptPosition) #A prompt too large for any pack goes alone and gets the usual single-call token check
+            currentTokens += questionTokens
+
+        if currentPack:
+            packs.append(currentPack)
+
+        return packs
+
+    def split_token_count(self, totalTokens, weights):
+        """Function to split a token count across weights as whole numbers that add back up to the total"""
+        if not sum(weights):
+            weights = [1] * len(weights)
+
+        exactShares = [totalTokens * weight / sum(weights) for weight in weights]
+        shares = [int(exactShare) for exactShare in exactShares]
+        remainderOrder = sorted(range(len(weights)), key=lambda position: exactShares[position] - shares[position], reverse=True)
+
+        for position in remainderOrder[:totalTokens - sum(shares)]:
+            shares[position] += 1
+
+        return shares
+
+    def split_packed_chat_response(self, gptResponse, packedPrompts, gptModel):
+        """Function to split a packed chat response into one chat response per answered question, giving each a share of the prompt tokens by question length and of the completion tokens by answer length. Questions missing from the answer are left out"""
+        try:
+            packedAnswers = loads(gptResponse['choices'][0]['message']['content'])
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            print(f'Error: Packed response could not be parsed, falling back to single calls. Full message: {e}')
+            return {}
+
+        if not isinstance(packedAnswers, dict):
+            return {}
+
+        answers = {questionKey: packedAnswers[questionKey] if isinstance(packedAnswers[questionKey], str) else dumps(packedAnswers[questionKey], ensure_ascii=False) for questionKey in packedPrompts if questionKey in packedAnswers}
+
+        if not answers:
+            return {}
+
+        questionKeys = list(answers)
+        questionTokens = self.get_num_tokens_for_strings([packedPrompts[questionKey] for questionKey in questionKeys], gptModel=gptModel)
+        answerTokens = self.get_num_tokens_for_strings([answers[questionKey] for questionKey in questionKeys], gptModel=gptModel)
+        sharedPromptTokens = max(0, gptResponse['usage']['prompt_tokens'] - sum(questionTokens)) / len(questionKeys) #System prompt and packing overhead are shared evenly
+        promptTokenShares = self.split_token_count(gptResponse['usage']['prompt_tokens'], [tokens + sharedPromptTokens for tokens in questionTokens])
+        completionTokenShares = self.split_token_count(gptResponse['usage']['completion_tokens'], answerTokens)
+        splitResponses = {}
+
+        for questionKey, promptTokens, completionTokens in zip(questionKeys, promptTokenShares, completionTokenShares):
+            splitResponses[questionKey] = {
+                **gptResponse,
+                'id': f"{gptResponse['id']}_{questionKey}",
+                'choices': [{**gptResponse['choices'][0], 'message': {'role': 'assistant', 'content': answers[questionKey]}}],
+                'usage': {'prompt_tokens': promptTokens, 'completion_tokens': completionTokens, 'total_tokens': promptTokens + completionTokens}
+            }
+
+        return splitResponses
+
+    def process_packed_chat_prompts(self, systemPrompt, userPrompts, gptModel, maxTokenLimit, gptTemperature = 1, expectedTokensPerAnswer=200):
+        """Function to send several user prompts sharing a system prompt as one keyed JSON request, format and write one record per question, and fall back to single calls for any question whose answer cannot be parsed"""
+        if len(userPrompts) == 1:
+            return [self.process_chat_prompt(systemPrompt, userPrompts[0], gptModel, maxTokenLimit, gptTemperature)]
+
+        packedPrompts = {f'q{questionNumber + 1}': userPrompt for questionNumber, userPrompt in enumerate(userPrompts)}
+        splitResponses = {}
+
+        try:
+            rawResponse = self.get_chat_response(self.build_packed_system_prompt(systemPrompt), dumps(packedPrompts, ensure_ascii=False), gptModel, gptTemperature, expectedCompletionTokens=expectedTokensPerAnswer * len(userPrompts), useSimilarityCache=False) #Answers are indexed per question, never as a packed request
+            splitResponses = self.split_packed_chat_response(rawResponse, packedPrompts, gptModel)
+        except Exception as e:
+            print(f'Error: Packed request failed, falling back to single calls. Full message: {e}')
+
+        results = []
+
+        for questionKey, userPrompt in packedPrompts.items():
+            if questionKey not in splitResponses:
+                results.append(self.process_chat_prompt(systemPrompt, userPrompt, gptModel, maxTokenLimit, gptTemperature))
+                continue
+
+            formattedResponse = self.format_chat_response(splitResponses[questionKey], systemPrompt, userPrompt)
+            formattedResponse['packed_request_id'] = rawResponse['id']
+            formattedResponse['packed_question_count'] = len(packedPrompts)
+            self.write_formatted_chat_response_to_json_file(formattedResponse)
+            results.append({'system_prompt': systemPrompt, 'user_prompt': userPrompt, 'status': 'success', 'response': formattedResponse, 'error': None})
+
+        return results
+
+    def get_packed_chat_responses(self, systemPrompt, userPrompts, gptModel, maxTokenLimit=None, gptTemperature = 1, expectedTokensPerAnswer=200, maxPromptsPerPack=20, maxWorkers = 8):
+        """Function to answer many small user prompts that share a system prompt with as few requests as possible, packing them under the model's token limit and running the packs concurrently, yielding one result per prompt as each pack finishes"""
+        userPrompts = list(userPrompts)
+        maxTokenLimit = maxTokenLimit or self.get_model_max_tokens(gptModel) or 4096
+        packs = self.pack_prompts(systemPrompt, userPrompts, gptModel, maxTokenLimit, expectedTokensPerAnswer, maxPromptsPerPack)
+
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            inFlight = {executor.submit(self.process_packed_chat_prompts, systemPrompt, [userPrompts[promptPosition] for promptPosition in pack], gptModel, maxTokenLimit, gptTemperature, expectedTokensPerAnswer) for pack in packs}
+
+            while inFlight:
+                finished, inFlight = wait(inFlight, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    yield from future.result()
+
+    def convert_pdf_to_images(self, pdfFileName, renderDPIScale=3, renderRotationDegrees=0, maxWorkers=None, skipUpToDatePages=True):
+        """Function to render each PDF page to a PNG in the data folder across a process pool, skipping pages whose PNG is already newer than the PDF"""
+        fileNameExtensionCharacterPosition = pdfFileName.find('.')
+        fileNameWithoutExtension = pdfFileName[:fileNameExtensionCharacterPosition]
+        import pypdfium2 as pdfium
+        from caller.pdf_rendering import render_pdf_pages_to_files
+
+        pdfPath = f"./src/{self.applicationName}/data/{pdfFileName}"
+        outputFileNames = []
+
+        try:
+            pdf = pdfium.PdfDocument(pdfPath)
+        except pdfium.PdfiumError as e:
+            print(f'Error! Not a valid PDF, please upload a different file. Full error message: {e}')
+        else:
+            totalPages = len(pdf)  # get the number of pages in the document
+            pdf.close()
+
+            pdfModifiedTime = path.getmtime(pdfPath)
+            pagesToRender = []
+
+            for pageNumber in range(0, totalPages):
+                fileNameFormatted = f'./src/{self.applicationName}/data/{fileNameWithoutExtension}_{pageNumber + 1}.png'
+                outputFileNames.append(fileNameFormatted)
+
+                if not (skipUpToDatePages and path.exists(fileNameFormatted) and path.getmtime(fileNameFormatted) >= pdfModifiedTime):
+                    pagesToRender.append((pageNumber, fileNameFormatted))
+
+            workerCount = min(maxWorkers or cpu_count() or 1, len(pagesToRender))
+
+            if workerCount == 1: #Not worth starting a process pool for a single worker
+                render_pdf_pages_to_files(pdfPath, [page[0] for page in pagesToRender], [page[1] for page in pagesToRender], renderDPIScale, renderRotationDegrees)
+            elif workerCount > 1:
+                with ProcessPoolExecutor(max_workers=workerCount) as executor:
+                    workerPages = [pagesToRender[workerNumber::workerCount] for workerNumber in range(workerCount)] #Each worker opens the PDF once and renders every Nth page
+                    renderJobs = [executor.submit(render_pdf_pages_to_files, pdfPath, [page[0] for page in pages], [page[1] for page in pages], renderDPIScale, renderRotationDegrees) for pages in workerPages]
+
+                    for renderJob in renderJobs:
+                        renderJob.result()
+        
+        return outputFileNames
+
+    def iter_pdf_page_images(self, pdfFileName, renderDPIScale=3, renderRotationDegrees=0, imageFormat=None):
+        """Function to yield (page number, image) for each PDF page without writing to disk, as a PIL image or as encoded bytes if an image format such as PNG or JPEG is given"""
+        import pypdfium2 as pdfium
+        from caller.pdf_rendering import render_pdf_page, encode_pil_image
+
+        pdf = pdfium.PdfDocument(f"./src/{self.applicationName}/data/{pdfFileName}")
+
+        try:
+            for pageNumber in range(0, len(pdf)):
+                convertedImage = render_pdf_page(pdf, pageNumber, renderDPIScale, renderRotationDegrees)
+
+                if imageFormat is None:
+                    yield pageNumber + 1, convertedImage
+                else:
+                    yield pageNumber + 1, encode_pil_image(convertedImage, imageFormat)
+        finally:
+            pdf.close()
+    
+    def encode_image_to_b64(self, imagePath):
+        """Function to encode a local image to base64 to prep for sending to OpenAI"""
+        with open(imagePath, "rb") as imageFile:
+            return b64encode(imageFile.read()).decode('utf-8')
+    
+    def get_vision_response_from_local_files(self, imageFileNameOrNames, userPrompt, gptModel='gpt-4-vision-preview', maxTokens=4096, apiURL = None, prepareImages=True):
+        """Function to call the open AI vision/image API and return a response in JSON format. Images can be file paths, encoded bytes, PIL images or in-memory pages from iter_pdf_page_images, and are resized and recompressed before sending unless prepareImages is off"""
+        apiURL = apiURL or self.get_api_url('chat/completions')
+        imageFileNamesToEncode = []
+
+        isPageImage = isinstance(imageFileNameOrNames, tuple) and len(imageFileNameOrNames) == 2 and isinstance(imageFileNameOrNames[0], int) #One (page number, image) pair from iter_pdf_page_images, any other tuple is a list of images
+
+        if isinstance(imageFileNameOrNames, (str, bytes, bytearray)) or isPageImage or not hasattr(imageFileNameOrNames, '__iter__'):
+            imageFileNamesToEncode = [imageFileNameOrNames]
+        else:
+            imageFileNamesToEncode = list(imageFileNameOrNames)
+
+        contentArray = [{"type": "text", "text": userPrompt}]
+
+        for images in imageFileNamesToEncode:
+            if prepareImages:
+                imageDataURL = self.imagePreparer.get_data_url(images)
+            else:
+                imageDataURL = self.imagePreparer.get_original_data_url(images)
+
+            imageContent = {"type": "image_url"
+                 , "image_url": {"url": imageDataURL}}
+            contentArray.append(imageContent)
+
+
+        payload = {
+        "model": gptModel,
+        "messages": [
+            {
+            "role": "user",
+            "content": contentArray
+            }
+        ],
+        "max_tokens": maxTokens
+        }
+
+        estimatedTokens = self.get_num_tokens_from_string(userPrompt, gptModel=gptModel) + maxTokens
+        responseJSON, retryCount = self.send_request(apiURL, self.header, payload, gptModel, estimatedTokens)
+
+        return {**responseJSON, 'retry_count': retryCount}
+    
+    def create_assistant(self, name, instructions, assistantType='retrieval', apiURL = None, gptModel='gpt-4-1106-preview', mode='w', messageIndent=0):
+        """Function to call the open AI API to create an assistant"""
+        apiURL = apiURL or self.get_api_url('assistants')
+        payload = {
+            "model": gptModel,
+            "name": name,
+            "instructions": instructions,
+            "tools": [
+                {
+                "type": assistantType
+                }
+            ]
+        }
+
+        responseJSON, retryCount = self.send_request(apiURL, self.assistantHeader, payload)
+        responseJSON['retry_count'] = retryCount
+
+        assistantId = responseJSON['id']
+        assistantName = responseJSON['name']
+
+        configFileName = f'{assistantId}_{assistantName}.json'
+        self.configSink.write('config', configFileName, responseJSON, mode, messageIndent)
+        self.configIndex.add_assistant(responseJSON, configFileName)
+
+    def get_assistant_id_from_config(self, assistantName):
+        """Function to look up the ID of a previously created assistant from the config index"""
+        assistantId = self.configIndex.get_assistant_id(assistantName)
+
+        if assistantId is not None:
+            print('Found existing assistant with id: ' + assistantId)
+            return assistantId
+        else:
+            raise Exception('Error: Assistant does not exist by name entered.  Please check the application and assistant name or call the create assistant function.')
+    
+    def create_assistant_thread(self, assistantId, userId=None, apiURL = None, mode='w', messageIndent=0):
+        """Function to call the open AI API to create a thread"""
+        apiURL = apiURL or self.get_api_url('threads')
+        payload = ''
+
+        responseJSON, retryCount = self.send_request(apiURL, self.assistantHeader, payload)
+        responseJSON['retry_count'] = retryCount
+        responseJSON['assistant_id'] = assistantId
+        responseJSON['user_id'] = userId
+
+        threadId = responseJSON['id']
+        createdDate = responseJSON['created_at']
+
+        configFileName = f'{threadId}_{createdDate}_{assistantId}.json'
+        self.configSink.write('config', configFileName, responseJSON, mode, messageIndent)
+
+        if userId is not None:
+            self.configIndex.add_thread(responseJSON, configFileName)
+
+    def get_thread_id_for_user(self, assistantId, userId):
+        """Function to look up the thread previously created for an assistant and user from the config index"""
+        userSpecificThreadId = self.configIndex.get_thread_id(assistantId, userId)
+
+        if userSpecificThreadId is not None:
+            print('Found existing thread for assistant and user with id: ' + str(userSpecificThreadId))
+            return userSpecificThreadId
+        else:
+            raise Exception('Error: Thread does not exist for assistant and user ID.  Please check the assistant ID, application name, and user ID or call the create thread function.')
+
+
+    modelInformation = {"latest_models": [{"name":"gpt-3.5-turbo-1106", "max_tokens_supported":4096, "cost_per_1k_tokens": 0.0030, "requests_per_minute": 3500, "tokens_per_minute": 60000}, {"name":"gpt-4-1106-preview", "max_tokens_supported":128000, "cost_per_1k_tokens": 0.04, "requests_per_minute": 500, "tokens_per_minute": 150000}], "historical_models" : [{"name":"gpt-3.5-turbo", "max_tokens_supported":4000, "cost_per_1k_tokens": 0.0030, "requests_per_minute": 3500, "tokens_per_minute": 60000}, {"name":"gpt-4", "max_tokens_supported":16000, "cost_per_1k_tokens": 0.009, "requests_per_minute": 500, "tokens_per_minute": 10000}, {"name":"gpt-4-32k", "max_tokens_supported":32000, "cost_per_1k_tokens": 0.18, "requests_per_minute": 500, "tokens_per_minute": 10000}]}
\ No newline at end of file
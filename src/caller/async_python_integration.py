@@ -0,0 +1,274 @@
+from asyncio import sleep, to_thread, gather, as_completed, Semaphore
+from time import monotonic
+from openai import AsyncOpenAI
+from caller.python_integration import OpenAIPythonIntegrationBase, RUN_PENDING_STATUSES
+
+
+class AsyncOpenAIPythonIntegration(OpenAIPythonIntegrationBase):
+    """Custom class to utilize Python with asyncio to directly work with OpenAI, so one process can drive many assistant threads at once"""
+    sdkClientClass = AsyncOpenAI
+    def __init__(self, applicationName, virtualEnvironmentName, maxRetries=5, retryDeadlineSeconds=120, outputSink='json', outputSinkOptions=None, metricsExporter=None, apiBaseURL=None):
+        self.setup_integration(applicationName, virtualEnvironmentName, maxRetries, retryDeadlineSeconds, outputSink, outputSinkOptions, metricsExporter, apiBaseURL)
+
+    def open_client(self):
+        """Function to build the AsyncOpenAI client, its connection pool belongs to this integration since async pools cannot be shared across event loops"""
+        return AsyncOpenAI(organization=self.organizationId, api_key=self.apiKey, base_url=self.apiBaseURL, max_retries=0) #Retries are handled by the shared retry policy instead
+
+    async def call_with_retry(self, function, **kwargs):
+        """Function to await an OpenAI SDK method with retries on transient failures, returning the result and the number of retries used"""
+        with self.metrics.time_call(self.get_operation_name(function)) as callRecord:
+            result, callRecord['retry_count'] = await self.retryPolicy.call_async(lambda: function(**kwargs), self.is_retryable_error, self.get_retry_after_seconds)
+
+            return result, callRecord['retry_count']
+
+    async def save_json_file(self, folderName, fileName, outputDict, mode='w', messageIndent=0):
+        """Function to write a JSON file on a worker thread so the event loop is not blocked by disk I/O"""
+        await to_thread(self.write_json_file, folderName, fileName, outputDict, mode, messageIndent)
+
+    async def save_records(self, folderName, namedRecords, mode='w', messageIndent=0):
+        """Function to send records to the output sink on a worker thread so the event loop is not blocked by disk I/O"""
+        await to_thread(self.write_records, folderName, namedRecords, mode, messageIndent)
+
+    async def close(self):
+        """Function to flush the output sink, export the metrics and close the config index along with the OpenAI client"""
+        await to_thread(self.outputSink.close)
+        await to_thread(self.metrics.export)
+        await to_thread(self.configIndex.close)
+
+        if 'recordIndex' in self.__dict__:
+            await to_thread(self.recordIndex.close)
+
+        if 'client' in self.__dict__:
+            await self.client.close()
+
+    async def get_assistant_id_from_config(self, assistantName):
+        """Function to look up the ID of a previously created assistant from the config index"""
+        return await to_thread(super().get_assistant_id_from_config, assistantName)
+
+    async def check_for_existing_assistant_file_id_from_config(self, assistantId, fileName):
+        """Function to look up the ID of a file previously uploaded to an assistant from the config index"""
+        return await to_thread(super().check_for_existing_assistant_file_id_from_config, assistantId, fileName)
+
+    async def get_thread_id_for_user(self, assistantId, userId):
+        """Function to look up the thread previously created for an assistant and user from the config index"""
+        return await to_thread(super().get_thread_id_for_user, assistantId, userId)
+
+    async def create_assistant(self, name, instructions, metadata = {}, assistantType='retrieval', gptModel='gpt-4-1106-preview', mode='w', messageIndent=0):
+        """Function to directly use OpenAI to create an assistant"""
+        try:
+            assistantResponse, retryCount = await self.call_with_retry(
+                self.client.beta.assistants.create,
+                name=name,
+                instructions=instructions,
+                model=gptModel,
+                tools=[{"type": assistantType}],
+                metadata=metadata
+            )
+
+            assistantDict = self.format_assistant_response(assistantResponse, retryCount)
+            configFileName = f'{assistantResponse.id}_{assistantResponse.name}.json'
+
+            await self.save_json_file('config', configFileName, assistantDict, mode, messageIndent)
+            await to_thread(self.configIndex.add_assistant, assistantDict, configFileName)
+            print('Success! Assistant successfully created and saved to config file with id: ' + str(assistantResponse.id))
+
+        except Exception as e:
+            print('Failure! Assistant failed to create, full response: ' + str(e))
+
+    async def upload_file_to_assistant(self, fileName, assistantId, filePurpose='assistants', fileReadMode = 'rb', fileWriteMode = 'w', messageIndent=0):
+        """Function to directly upload a file to OpenAI, skipping the upload when the same content is already there"""
+        return await self.sync_files_to_assistant(assistantId, [fileName], maxWorkers=1, filePurpose=filePurpose, showProgress=False, fileWriteMode=fileWriteMode, messageIndent=messageIndent)
+
+    async def upload_file_by_hash(self, fileName, contentHash, filePurpose='assistants'):
+        """Function to get the OpenAI file for some content, uploading it only if that content was never uploaded before"""
+        fileId = await to_thread(self.configIndex.get_uploaded_file_id, contentHash)
+
+        if fileId is not None:
+            return {'file_id': fileId, 'bytes': None, 'created_at': None, 'retry_count': 0, 'uploaded': False}
+
+        def read_file():
+            with open(f'./src/{self.applicationName}/data/{fileName}', mode='rb') as fileToUpload:
+                return fileToUpload.read()
+
+        uploadResponse, retryCount = await self.call_with_retry(self.client.files.create, file=(fileName, await to_thread(read_file)), purpose=filePurpose)
+        await to_thread(self.configIndex.add_uploaded_file, contentHash, uploadResponse.id, fileName, uploadResponse.bytes, uploadResponse.created_at)
+
+        return {'file_id': uploadResponse.id, 'bytes': uploadResponse.bytes, 'created_at': uploadResponse.created_at, 'retry_count': retryCount, 'uploaded': True}
+
+    async def sync_files_to_assistant(self, assistantId, fileNames, maxWorkers=8, filePurpose='assistants', showProgress=True, fileWriteMode='w', messageIndent=0):
+        """Function to make an assistant's files match the given files under the data folder, hashing contents on worker threads to skip unchanged files, uploading new content concurrently and attaching everything in one assistant update"""
+        from tqdm import tqdm
+
+        summary = {'unchanged': 0, 'uploaded': 0, 'reused': 0, 'failed': 0}
+        uploadSlots = Semaphore(maxWorkers)
+
+        async def upload_content(contentHash):
+            async with uploadSlots:
+                try:
+                    return contentHash, await self.upload_file_by_hash(filesByHash[contentHash][0], contentHash, filePurpose), None
+                except Exception as e:
+                    return contentHash, None, e
+
+        try:
+            contentHashes = dict(zip(fileNames, await gather(*(to_thread(self.get_file_hash, fileName) for fileName in fileNames))))
+            existingFiles, changedFiles = await to_thread(self.get_changed_files, assistantId, fileNames, contentHashes)
+            summary['unchanged'] = len(fileNames) - len(changedFiles)
+
+            filesByHash = self.group_files_by_hash(changedFiles, contentHashes)
+            uploadedFiles = {}
+
+            with tqdm(total=len(changedFiles), desc='Uploading files', unit='file', disable=not showProgress) as progressBar:
+                for uploadTask in as_completed([upload_content(contentHash) for contentHash in filesByHash]):
+                    contentHash, uploadResult, uploadError = await uploadTask
+                    hashFiles = filesByHash[contentHash]
+
+                    if uploadError is not None:
+                        summary['failed'] += len(hashFiles)
+                        print('Failure! Could not upload file ' + ', '.join(hashFiles) + ', full error message: ' + str(uploadError))
+                    else:
+                        self.add_upload_result(uploadedFiles, summary, hashFiles, uploadResult)
+
+                    progressBar.update(len(hashFiles))
+
+            if uploadedFiles:
+                await self.attach_files_to_assistant(assistantId, uploadedFiles, existingFiles, contentHashes, fileWriteMode, messageIndent)
+
+            print(f"Success! Files synced to assistant: {summary['uploaded']} uploaded, {summary['reused']} reused, {summary['unchanged']} unchanged, {summary['failed']} failed")
+        except Exception as e:
+            print('Failure! Could not sync files to assistant, full error message: ' + str(e))
+
+        return summary
+
+    async def attach_files_to_assistant(self, assistantId, uploadedFiles, existingFiles, contentHashes, fileWriteMode='w', messageIndent=0):
+        """Function to attach uploaded files to an assistant with a single update, replacing older versions of the same file names, and record them in the config"""
+        assistantResponse, retrieveRetryCount = await self.call_with_retry(self.client.beta.assistants.retrieve, assistant_id=assistantId)
+        assistantResponse, updateRetryCount = await self.call_with_retry(self.client.beta.assistants.update, assistant_id=assistantId, file_ids=self.get_assistant_file_ids(assistantResponse.file_ids, uploadedFiles, existingFiles))
+
+        await to_thread(self.save_assistant_files, assistantId, uploadedFiles, existingFiles, contentHashes, retrieveRetryCount + updateRetryCount, fileWriteMode, messageIndent)
+
+    async def create_assistant_thread(self, assistantId, userId, metadata = {}, mode='w', messageIndent=0):
+        """Function to directly create a thread and associate with an assistant at OpenAI"""
+        try:
+            threadResponse, retryCount = await self.call_with_retry(
+                self.client.beta.threads.create,
+                metadata=metadata
+            )
+
+            threadDict = self.format_thread_response(threadResponse, assistantId, userId, retryCount)
+            configFileName = f'{threadResponse.id}_{threadResponse.created_at}_{assistantId}.json'
+
+            await self.save_json_file('config', configFileName, threadDict, mode, messageIndent)
+            await to_thread(self.configIndex.add_thread, threadDict, configFileName)
+            print('Success! Thread successfully created and saved to config file with id: ' + str(threadResponse.id))
+
+            return threadResponse.id
+
+        except Exception as e:
+            print('Failure! Thread failed to create, full response: ' + str(e))
+
+    async def add_message_in_existing_thread(self, threadId, message, fileListToInclude, userId, metadata={}, mode='w', messageIndent=0):
+        try:
+            messageResponse, retryCount = await self.call_with_retry(
+                self.client.beta.threads.messages.create,
+                thread_id = threadId,
+                role = 'user',
+                content = message,
+                file_ids=fileListToInclude,
+                metadata=metadata
+            )
+
+            messageResponseDict = self.format_message_response(messageResponse, messageResponse.content[0], userId, retryCount)
+            await self.save_records('data/chat_messages', [(self.get_message_file_name(messageResponse, userId), messageResponseDict)], mode, messageIndent)
+
+            print('Success! Message added to thread, full response: ' + str(messageResponse))
+
+            return messageResponseDict
+        except Exception as e:
+            print('Failure! Message not added to thread, full response: ' + str(e))
+
+    async def wait_for_run_completion(self, threadId, runId, initialPollIntervalSeconds=0.25, maxPollIntervalSeconds=3, pollBackoffMultiplier=1.5, runDeadlineSeconds=300):
+        """Function to poll a run without blocking the event loop, backing off from a short first interval until the run leaves the queued/in progress states or the deadline passes"""
+        deadline = monotonic() + runDeadlineSeconds
+        pollIntervalSeconds = initialPollIntervalSeconds
+        totalRetryCount = 0
+
+        while True:
+            await sleep(max(0.0, min(pollIntervalSeconds, deadline - monotonic())))
+
+            runResponse, retryCount = await self.call_with_retry(
+                self.client.beta.threads.runs.retrieve,
+                thread_id = threadId,
+                run_id = runId
+            )
+            totalRetryCount += retryCount
+
+            if runResponse.status not in RUN_PENDING_STATUSES or monotonic() >= deadline:
+                return runResponse, totalRetryCount
+
+            pollIntervalSeconds = min(maxPollIntervalSeconds, pollIntervalSeconds * pollBackoffMultiplier)
+
+    async def run_thread_for_assistant_response(self, threadId, assistantId, userId, metadata={}, mode='w', messageIndent=0, initialPollIntervalSeconds=0.25, maxPollIntervalSeconds=3, pollBackoffMultiplier=1.5, runDeadlineSeconds=300):
+        try:
+            createRunResponse, runRetryCount = await self.call_with_retry(
+                self.client.beta.threads.runs.create,
+                thread_id = threadId,
+                assistant_id = assistantId,
+                metadata=metadata
+            )
+        except Exception as e:
+            print('Failure! Could not run thread, full response: ' + str(e))
+        else:
+            try:
+                runResponse, retryCount = await self.wait_for_run_completion(threadId, createRunResponse.id, initialPollIntervalSeconds, maxPollIntervalSeconds, pollBackoffMultiplier, runDeadlineSeconds)
+
+                if runResponse.status in RUN_PENDING_STATUSES:
+                    print('Failure! Run not completed before the deadline.  Please try again later.')
+                else:
+                    runResponseDict = self.format_run_response(runResponse, userId, runRetryCount + retryCount)
+                    await self.save_records('data/run_logs', [(self.get_run_log_file_name(runResponse), runResponseDict)], mode, messageIndent)
+
+                    return runResponseDict
+
+            except Exception as e:
+                print('Failure! Could not retrieve run thread, full response: ' + str(e))
+
+    async def get_latest_assistant_message_in_existing_thread(self, threadId, userId, assistantRoleName = 'assistant', mode='w', messageIndent=0):
+        try:
+            threadMessageResponse, retryCount = await self.call_with_retry(self.client.beta.threads.messages.list, thread_id = threadId)
+            latestMessage = threadMessageResponse.data[0]
+
+            if latestMessage.role == assistantRoleName:
+                messageRecords = self.format_message_records([latestMessage], userId, retryCount)
+                await self.save_records('data/chat_messages', messageRecords, mode, messageIndent)
+
+                return [messageResponseDict for fileName, messageResponseDict in messageRecords]
+            else:
+                print('Failure! Latest message is not an assistant response.  Please re-run the function to run the assistant thread and try again.')
+        except Exception as e:
+            print('Failure! Could not retrieve thread messages, full response: ' + str(e))
+
+    async def get_all_messages_in_existing_thread(self, threadId, userId, mode='w', messageIndent=0, pageSize=100, fullResync=False):
+        """Function to save every message in a thread newer than the last sync, paging through the message list with after cursors"""
+        try:
+            if fullResync:
+                await to_thread(self.configIndex.clear_thread_sync_state, threadId)
+
+            syncState = await to_thread(self.configIndex.get_thread_sync_state, threadId)
+            afterMessageId = syncState['last_message_id'] if syncState else None
+            newMessages = 0
+
+            while True:
+                messagePage, retryCount = await self.call_with_retry(self.client.beta.threads.messages.list, **self.get_message_page_parameters(threadId, afterMessageId, pageSize))
+
+                if messagePage.data:
+                    afterMessageId = await to_thread(self.save_message_page, threadId, userId, messagePage.data, retryCount, mode, messageIndent)
+                    newMessages += len(messagePage.data)
+
+                if not self.has_more_messages(messagePage, pageSize):
+                    break
+
+            print(f'Success! {newMessages} new thread messages retrieved and saved')
+
+            return newMessages
+        except Exception as e:
+            print('Failure! Could not retrieve thread messages, full response: ' + str(e))
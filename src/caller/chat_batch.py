@@ -0,0 +1,211 @@
+from os import makedirs, path, replace
+from json import dump, dumps, load, loads
+from time import monotonic, sleep
+
+BATCH_PENDING_STATUSES = ('validating', 'in_progress', 'finalizing', 'cancelling')
+
+
+class ChatBatchJob():
+    """Custom class to run chat prompts through the OpenAI Batch API, keeping the job state on disk so a batch can be submitted, polled and collected across separate runs"""
+    def __init__(self, client, batchName):
+        self.client = client
+        self.batchName = batchName
+
+        self.batchFolder = f'./src/{client.applicationName}/data/batches/'
+        self.stateFileName = f'{self.batchFolder}{batchName}.json'
+        self.requestsFileName = f'{self.batchFolder}{batchName}_requests.jsonl'
+        self.promptsFileName = f'{self.batchFolder}{batchName}_prompts.jsonl'
+        self.state = self.load_state()
+
+    def load_state(self):
+        """Function to read the saved job state, or start a new one if this batch has not been seen before"""
+        try:
+            with open(self.stateFileName, 'r', encoding='utf-8') as stateFile:
+                return load(stateFile)
+        except FileNotFoundError:
+            return {'batch_name': self.batchName, 'status': 'new', 'request_count': 0, 'skipped_requests': 0, 'input_file_id': None, 'batch_id': None, 'output_file_id': None, 'error_file_id': None, 'request_counts': None, 'collected_output_lines': 0, 'collected_error_lines': 0, 'saved_responses': 0, 'failed_custom_ids': [], 'results_collected': False}
+
+    def save_state(self):
+        """Function to write the job state atomically so an interrupted run never leaves it half written"""
+        makedirs(self.batchFolder, exist_ok=True)
+        with open(f'{self.stateFileName}.tmp', 'w', encoding='utf-8') as stateFile:
+            dump(self.state, stateFile, ensure_ascii=False)
+        replace(f'{self.stateFileName}.tmp', self.stateFileName)
+
+    def get_upload_header(self):
+        """Function to get the request headers without the JSON content type, so the HTTP client can set the multipart boundary"""
+        return {headerName: headerValue for headerName, headerValue in self.client.header.items() if headerName != 'Content-Type'}
+
+    def check_response(self, responseJSON, action):
+        """Function to raise when the API answered with an error instead of the expected object"""
+        if 'error' in responseJSON:
+            raise Exception(f"Error: Could not {action} for batch {self.batchName}. Full response: {responseJSON['error']}")
+
+        return responseJSON
+
+    def write_request_files(self, promptPairs, gptModel, maxTokenLimit=None, gptTemperature = 1):
+        """Function to write one chat completion request per prompt pair to the batch input JSONL, along with the original prompts for formatting the results"""
+        makedirs(self.batchFolder, exist_ok=True)
+        requestCount = 0
+        skippedRequests = 0
+
+        with open(self.requestsFileName, 'w', encoding='utf-8') as requestsFile, open(self.promptsFileName, 'w', encoding='utf-8') as promptsFile:
+            for requestNumber, (systemPrompt, userPrompt) in enumerate(promptPairs):
+                if maxTokenLimit is not None and not self.client.check_num_tokens_for_inputs(systemPrompt, userPrompt, maxTokenLimit, gptModel=gptModel):
+                    skippedRequests += 1
+                    continue
+
+                customId = f'request-{requestNumber}'
+                requestLine = {'custom_id': customId, 'method': 'POST', 'url': '/v1/chat/completions', 'body': self.client.build_chat_payload(systemPrompt, userPrompt, gptModel, gptTemperature)}
+
+                requestsFile.write(dumps(requestLine, ensure_ascii=False) + '\n')
+                promptsFile.write(dumps({'custom_id': customId, 'system_prompt': systemPrompt, 'user_prompt': userPrompt}, ensure_ascii=False) + '\n')
+                requestCount += 1
+
+        self.state.update({'status': 'prepared', 'request_count': requestCount, 'skipped_requests': skippedRequests, 'model': gptModel})
+        self.save_state()
+
+    def upload_requests(self):
+        """Function to upload the batch input JSONL as a file with the batch purpose"""
+        with open(self.requestsFileName, 'rb') as requestsFile:
+            responseJSON, retryCount = self.client.send_request(self.client.get_api_url('files'), self.get_upload_header(), {'purpose': 'batch'}, files={'file': (path.basename(self.requestsFileName), requestsFile.read(), 'application/jsonl')})
+
+        self.state.update({'status': 'uploaded', 'input_file_id': self.check_response(responseJSON, 'upload the requests')['id']})
+        self.save_state()
+
+    def create_batch(self, completionWindow='24h', metadata={}):
+        """Function to start the batch on the uploaded input file"""
+        payload = {'input_file_id': self.state['input_file_id'], 'endpoint': '/v1/chat/completions', 'completion_window': completionWindow, 'metadata': {'batch_name': self.batchName, **metadata}}
+        responseJSON, retryCount = self.client.send_request(self.client.get_api_url('batches'), self.client.header, payload)
+
+        self.update_from_batch(self.check_response(responseJSON, 'create the batch'))
+
+    def submit(self, promptPairs, gptModel, maxTokenLimit=None, gptTemperature = 1, completionWindow='24h', metadata={}):
+        """Function to write, upload and start the batch, skipping whichever of those steps an earlier run already finished"""
+        if self.state['status'] == 'new':
+            self.write_request_files(promptPairs, gptModel, maxTokenLimit, gptTemperature)
+
+        if self.state['status'] == 'prepared':
+            self.upload_requests()
+
+        if self.state['status'] == 'uploaded':
+            self.create_batch(completionWindow, metadata)
+            print(f"Success! Batch {self.batchName} submitted with id: {self.state['batch_id']}")
+        else:
+            print(f"Found existing batch {self.batchName} with id: {self.state['batch_id']} and status: {self.state['status']}")
+
+    def update_from_batch(self, batchJSON):
+        """Function to copy the batch status, request counts and result file IDs onto the job state and save it"""
+        self.state.update({
+            'batch_id': batchJSON['id'],
+            'status': batchJSON['status'],
+            'output_file_id': batchJSON.get('output_file_id'),
+            'error_file_id': batchJSON.get('error_file_id'),
+            'request_counts': batchJSON.get('request_counts')
+        })
+        self.save_state()
+
+    def refresh(self):
+        """Function to fetch the latest batch status from OpenAI"""
+        responseJSON, retryCount = self.client.send_request(self.client.get_api_url(f"batches/{self.state['batch_id']}"), self.client.header, None, method='GET')
+        self.update_from_batch(self.check_response(responseJSON, 'retrieve the batch'))
+
+        return self.state['status']
+
+    def wait(self, initialPollIntervalSeconds=5, maxPollIntervalSeconds=300, pollBackoffMultiplier=1.5, batchDeadlineSeconds=None):
+        """Function to poll the batch, backing off from a short first interval, until it leaves the pending states or the deadline passes, returning the last status"""
+        deadline = monotonic() + batchDeadlineSeconds if batchDeadlineSeconds is not None else None
+        pollIntervalSeconds = initialPollIntervalSeconds
+
+        while self.state['status'] in BATCH_PENDING_STATUSES:
+            if deadline is not None and monotonic() >= deadline:
+                print(f"Failure! Batch {self.batchName} still {self.state['status']} at the deadline.  Call wait or run_chat_batch again later to resume.")
+                break
+
+            sleep(pollIntervalSeconds if deadline is None else max(0.0, min(pollIntervalSeconds, deadline - monotonic())))
+            self.refresh()
+            pollIntervalSeconds = min(maxPollIntervalSeconds, pollIntervalSeconds * pollBackoffMultiplier)
+
+        return self.state['status']
+
+    def load_prompts(self):
+        """Function to read back the original prompts for each request by custom ID"""
+        with open(self.promptsFileName, 'r', encoding='utf-8') as promptsFile:
+            return {prompt['custom_id']: (prompt['system_prompt'], prompt['user_prompt']) for prompt in map(loads, promptsFile)}
+
+    def iter_result_lines(self, fileId, skipLines=0):
+        """Function to stream a result file from OpenAI line by line, skipping the lines an earlier run already collected"""
+        response = self.client.httpClient.open_stream(self.client.get_api_url(f'files/{fileId}/content'), self.client.header, method='GET')
+
+        try:
+            if response.status_code != 200:
+                raise Exception(f'Error: Could not download batch results for {self.batchName}, OpenAI returned status {response.status_code}. Full response: {self.client.httpClient.read_json(response)}')
+
+            lineNumber = 0
+
+            for line in self.client.httpClient.iter_lines(response):
+                if not line:
+                    continue
+
+                lineNumber += 1
+
+                if lineNumber > skipLines:
+                    yield loads(line)
+        finally:
+            response.close()
+
+    def save_progress(self, stateFieldName, collectedLines):
+        """Function to flush the saved responses before recording how far through a result file this job has got, so the state never runs ahead of the output"""
+        self.client.outputSink.flush()
+        self.state[stateFieldName] = collectedLines
+        self.save_state()
+
+    def collect_results(self, saveProgressEveryLines=500):
+        """Function to stream the finished batch's results through format_chat_response into the output sink, recording the custom IDs that failed, and returning the total number of responses saved"""
+        if self.state['results_collected']:
+            return self.state['saved_responses']
+
+        if self.state['status'] != 'completed' and not self.state['output_file_id']:
+            print(f"Failure! Batch {self.batchName} has no results yet, status: {self.state['status']}")
+            return 0
+
+        prompts = self.load_prompts()
+        savedResponses = 0
+
+        for fileId, stateFieldName in ((self.state['output_file_id'], 'collected_output_lines'), (self.state['error_file_id'], 'collected_error_lines')):
+            if not fileId:
+                continue
+
+            collectedLines = self.state[stateFieldName]
+
+            for resultLine in self.iter_result_lines(fileId, collectedLines):
+                response = resultLine.get('response') or {}
+                systemPrompt, userPrompt = prompts[resultLine['custom_id']]
+
+                if response.get('status_code') == 200 and 'choices' in response.get('body', {}):
+                    formattedResponse = self.client.format_chat_response({**response['body'], 'requested_model': self.state.get('model')}, systemPrompt, userPrompt)
+                    formattedResponse['batch_id'] = self.state['batch_id']
+                    formattedResponse['custom_id'] = resultLine['custom_id']
+                    self.client.write_formatted_chat_response_to_json_file(formattedResponse)
+                    self.client.metrics.increment('openai_batch_results_total', status='success', model=formattedResponse['model'])
+                    savedResponses += 1
+                else:
+                    self.state['failed_custom_ids'].append(resultLine['custom_id'])
+                    self.client.metrics.increment('openai_batch_results_total', status='failed', model=self.state.get('model'))
+
+                collectedLines += 1
+
+                if collectedLines % saveProgressEveryLines == 0:
+                    self.state['saved_responses'] += savedResponses
+                    savedResponses = 0
+                    self.save_progress(stateFieldName, collectedLines)
+
+            self.state['saved_responses'] += savedResponses
+            savedResponses = 0
+            self.save_progress(stateFieldName, collectedLines)
+
+        self.state['results_collected'] = True
+        self.save_state()
+        print(f"Success! {self.state['saved_responses']} batch responses saved for {self.batchName}, {len(self.state['failed_custom_ids'])} failed")
+
+        return self.state['saved_responses']
@@ -0,0 +1,119 @@
+from json import loads
+from uuid import uuid4
+
+MESSAGE_OVERHEAD_TOKENS = 4 #Role and separator tokens the chat format adds around every message
+
+
+class ChatConversation():
+    """Custom class to hold the turns of a chat so follow-up questions are sent with as much earlier history as fits the model's token budget, dropping or summarizing the oldest turns once it does not"""
+    def __init__(self, client, systemPrompt, gptModel, conversationId=None, maxTokenLimit=None, gptTemperature = 1, expectedCompletionTokens=1000, compactionMode='drop', summaryTokenLimit=300):
+        self.client = client
+        self.systemPrompt = systemPrompt
+        self.gptModel = gptModel
+        self.conversationId = conversationId or uuid4().hex
+        self.maxTokenLimit = maxTokenLimit or client.get_model_max_tokens(gptModel) or 4096
+        self.gptTemperature = gptTemperature
+        self.expectedCompletionTokens = expectedCompletionTokens
+        self.compactionMode = compactionMode
+        self.summaryTokenLimit = summaryTokenLimit
+        self.systemMessageTokens = self.count_tokens(client.build_chat_payload(systemPrompt, '', gptModel)['messages'][0]['content']) #The system message as sent, with the JSON format instructions added
+
+        self.turns = []
+        self.summary = None
+        self.summarizedTurns = 0 #Turns before this position are covered by the summary
+
+    def count_tokens(self, content):
+        """Function to count the tokens of one message, including the chat format overhead"""
+        return self.client.get_num_tokens_from_string(content, gptModel=self.gptModel) + MESSAGE_OVERHEAD_TOKENS
+
+    def add_turn(self, userPrompt, answer, responseId=None):
+        """Function to add a question and its answer to the history, counting their tokens once so they are never re-tokenized"""
+        self.turns.append({'id': responseId, 'user_prompt': userPrompt, 'answer': answer, 'tokens': self.count_tokens(userPrompt) + self.count_tokens(answer)})
+
+    def load_history(self):
+        """Function to load the earlier turns of this conversation from the saved chat messages, whichever output sink wrote them, oldest first"""
+        if not self.client.recordIndex.readsOutputSink:
+            print(f'Error: Cannot load the earlier turns of conversation {self.conversationId}, {type(self.client.outputSink).__name__} saves chat messages where the record index cannot read them.')
+            return 0
+
+        savedTurns = list(self.client.recordIndex.iter_records('chat_messages', conversationId=self.conversationId))
+
+        for record in sorted(savedTurns, key=lambda record: (record.get('turn_number', 0), record['date_time_unix'])):
+            self.add_turn(record['user_prompt'], record['answer'], record['id'])
+
+        return len(savedTurns)
+
+    def get_history_budget(self, userPrompt):
+        """Function to get how many tokens are left for earlier turns after the system prompt, the new question, any summary and the expected answer"""
+        fixedTokens = self.systemMessageTokens + self.count_tokens(userPrompt) + self.expectedCompletionTokens + 32
+
+        if self.summary is not None:
+            fixedTokens += self.count_tokens(self.summary)
+
+        return self.maxTokenLimit - fixedTokens
+
+    def get_turns_in_budget(self, historyBudget):
+        """Function to get the position of the oldest turn that still fits, keeping the newest turns first"""
+        usedTokens = 0
+        firstTurn = len(self.turns)
+
+        while firstTurn > self.summarizedTurns and usedTokens + self.turns[firstTurn - 1]['tokens'] <= historyBudget:
+            firstTurn -= 1
+            usedTokens += self.turns[firstTurn]['tokens']
+
+        return firstTurn
+
+    def summarize_turns(self, firstTurn):
+        """Function to fold the turns that no longer fit into a short running summary, so their facts survive after they are dropped"""
+        droppedTurns = ' '.join(f"Question: {turn['user_prompt']} Answer: {turn['answer']}" for turn in self.turns[self.summarizedTurns:firstTurn])
+        summaryPrompt = f'Earlier summary: {self.summary or "none"} Newer turns: {droppedTurns}'
+
+        rawResponse = self.client.get_chat_response(f'Summarize the conversation below in at most {self.summaryTokenLimit} tokens, keeping names, numbers and decisions. Return it under the key summary', summaryPrompt, self.gptModel, 0, expectedCompletionTokens=self.summaryTokenLimit)
+        formattedResponse = self.client.format_chat_response(rawResponse, 'summary', summaryPrompt)
+
+        try:
+            self.summary = str(loads(formattedResponse['answer'])['summary'])
+        except (ValueError, KeyError, TypeError): #Keep the whole answer if the model used another key
+            self.summary = formattedResponse['answer']
+
+        self.summarizedTurns = firstTurn
+
+    def build_history_messages(self, userPrompt):
+        """Function to build the earlier messages to send before a new question, trimming or compacting the oldest turns to stay within the token budget"""
+        firstTurn = self.get_turns_in_budget(self.get_history_budget(userPrompt))
+
+        if firstTurn > self.summarizedTurns and self.compactionMode == 'summarize':
+            self.summarize_turns(firstTurn)
+            firstTurn = self.get_turns_in_budget(self.get_history_budget(userPrompt))
+
+        historyMessages = []
+
+        if self.summary is not None:
+            historyMessages.append({'role': 'system', 'content': f'Summary of the earlier conversation: {self.summary}'})
+
+        for turn in self.turns[firstTurn:]:
+            historyMessages.append({'role': 'user', 'content': turn['user_prompt']})
+            historyMessages.append({'role': 'assistant', 'content': turn['answer']})
+
+        return historyMessages, len(self.turns) - firstTurn
+
+    def ask(self, userPrompt, useCache=True, writeToFile=True):
+        """Function to send a follow-up question with the conversation so far, save the answer like process_chat_prompt would and add it to the history"""
+        if self.get_history_budget(userPrompt) < 0:
+            print('Too many tokens to send! Please choose another model or limit your prompts.')
+            return None
+
+        historyMessages, historyTurns = self.build_history_messages(userPrompt)
+        rawResponse = self.client.get_chat_response(self.systemPrompt, userPrompt, self.gptModel, self.gptTemperature, useCache=useCache, expectedCompletionTokens=self.expectedCompletionTokens, historyMessages=historyMessages)
+
+        formattedResponse = self.client.format_chat_response(rawResponse, self.systemPrompt, userPrompt)
+        formattedResponse['conversation_id'] = self.conversationId
+        formattedResponse['turn_number'] = len(self.turns) + 1
+        formattedResponse['history_turns'] = historyTurns
+
+        if writeToFile:
+            self.client.write_formatted_chat_response_to_json_file(formattedResponse)
+
+        self.add_turn(userPrompt, formattedResponse['answer'], formattedResponse['id'])
+
+        return formattedResponse
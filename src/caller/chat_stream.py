@@ -0,0 +1,148 @@
+from json import loads
+from time import monotonic, time
+from caller.retry import RetryableHTTPError, RETRYABLE_STATUS_CODES, parse_retry_after_seconds
+
+
+class ChatStream():
+    """Custom class to iterate over the content deltas of a streamed chat completion, then assemble, format and save the full response once the stream ends"""
+    def __init__(self, client, payload, systemPrompt, userPrompt, apiURL, estimatedTokens, useCache=True, writeToFile=True, useSimilarityCache=False):
+        self.client = client
+        self.payload = payload
+        self.systemPrompt = systemPrompt
+        self.userPrompt = userPrompt
+        self.apiURL = apiURL
+        self.estimatedTokens = estimatedTokens
+        self.useCache = useCache
+        self.writeToFile = writeToFile
+        self.useSimilarityCache = useSimilarityCache
+
+        self.rawResponse = None
+        self.formattedResponse = None
+        self.retryCount = 0
+        self.callRecord = None
+        self.chargedTokens = 0 #Rate limiter tokens charged for the attempt that opened the stream
+
+    def get_cache_payload(self):
+        """Function to get the payload without the streaming flags so streamed and regular calls share cache entries"""
+        return {key: value for key, value in self.payload.items() if key not in ('stream', 'stream_options')}
+
+    def open_response(self):
+        """Function to open the streamed response, raising a retryable error for 429/5xx so the retry policy can try again"""
+        httpClient = self.client.httpClient
+        gptModel = self.payload['model']
+
+        queueSeconds, self.chargedTokens = self.client.wait_for_rate_limit(gptModel, self.estimatedTokens)
+        self.callRecord['queue_seconds'] += queueSeconds
+
+        try:
+            httpClient.reset_connect_timing()
+            response = httpClient.open_stream(self.apiURL, self.client.header, self.payload)
+        except Exception: #Connection errors and timeouts use no tokens
+            self.client.settle_rate_limit(gptModel, self.chargedTokens, None)
+            raise
+
+        self.callRecord['connect_seconds'] = httpClient.get_connect_seconds()
+        self.client.update_rate_limit(gptModel, response)
+
+        if response.status_code == 200: #Settled with the real usage once the stream ends
+            return response
+
+        try:
+            responseJSON = httpClient.read_json(response)
+        finally:
+            response.close()
+            self.client.settle_rate_limit(gptModel, self.chargedTokens, None)
+
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            raise RetryableHTTPError(response.status_code, responseJSON, parse_retry_after_seconds(response.headers))
+
+        raise Exception(f'Error: OpenAI returned status {response.status_code}. Full response: {responseJSON}')
+
+    def __iter__(self):
+        """Function to yield each piece of answer text as soon as it arrives"""
+        startTime = monotonic()
+        firstTokenSeconds = None
+
+        if self.useCache:
+            cachedResponse = self.client.responseCache.get(self.get_cache_payload())
+
+            if cachedResponse is not None:
+                self.client.metrics.increment('openai_cache_hits_total', model=self.payload['model'], operation=self.client.get_operation_name(self.apiURL))
+                firstTokenSeconds = monotonic() - startTime
+                yield cachedResponse['choices'][0]['message']['content']
+                self.finish(cachedResponse, firstTokenSeconds, monotonic() - startTime)
+                return
+
+        if self.useSimilarityCache:
+            similarResponse = self.client.get_similar_chat_response(self.systemPrompt, self.userPrompt, self.payload['model'])
+
+            if similarResponse is not None:
+                firstTokenSeconds = monotonic() - startTime
+                yield similarResponse['choices'][0]['message']['content']
+                self.finish(similarResponse, firstTokenSeconds, monotonic() - startTime)
+                return
+
+        with self.client.metrics.time_call(self.client.get_operation_name(self.apiURL), self.payload['model']) as self.callRecord:
+            response, self.retryCount = self.client.retryPolicy.call(self.open_response, self.client.is_retryable_error)
+            answerParts = []
+            streamedResponse = {'id': None, 'object': 'chat.completion', 'created': int(time()), 'model': self.payload['model'], 'usage': None}
+
+            try:
+                for line in self.client.httpClient.iter_lines(response):
+                    if not line or not line.startswith('data:'):
+                        continue
+
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        break
+
+                    chunk = loads(data)
+                    streamedResponse['id'] = chunk.get('id', streamedResponse['id'])
+                    streamedResponse['created'] = chunk.get('created', streamedResponse['created'])
+                    streamedResponse['model'] = chunk.get('model', streamedResponse['model'])
+
+                    if chunk.get('usage'):
+                        streamedResponse['usage'] = chunk['usage']
+
+                    for choice in chunk.get('choices', []):
+                        content = choice.get('delta', {}).get('content')
+
+                        if content:
+                            if firstTokenSeconds is None:
+                                firstTokenSeconds = monotonic() - startTime
+                            answerParts.append(content)
+                            yield content
+            finally:
+                response.close()
+
+            answer = ''.join(answerParts)
+            streamedResponse['choices'] = [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}]
+
+            if streamedResponse['usage'] is None: #Fall back to counting locally if the API did not send a usage chunk
+                gptModel = self.payload['model']
+                promptTokens = sum(self.client.get_num_tokens_from_string(message['content'], gptModel=gptModel) for message in self.payload['messages']) #System prompt, any history and the question
+                completionTokens = self.client.get_num_tokens_from_string(answer, gptModel=gptModel)
+                streamedResponse['usage'] = {'prompt_tokens': promptTokens, 'completion_tokens': completionTokens, 'total_tokens': promptTokens + completionTokens}
+
+            self.client.settle_rate_limit(self.payload['model'], self.chargedTokens, streamedResponse)
+
+            if self.useCache:
+                self.client.cache_chat_response(self.get_cache_payload(), streamedResponse)
+
+            self.callRecord['retry_count'] = self.retryCount
+            self.callRecord['first_byte_seconds'] = firstTokenSeconds
+            self.client.record_usage(self.callRecord, streamedResponse)
+            lastTokenSeconds = monotonic() - startTime
+
+        self.finish(streamedResponse, firstTokenSeconds, lastTokenSeconds)
+
+    def finish(self, gptResponse, firstTokenSeconds, lastTokenSeconds):
+        """Function to format the assembled response with its stream timings and save it like a regular chat response"""
+        self.rawResponse = {**gptResponse, 'retry_count': self.retryCount, 'requested_model': self.payload['model']}
+        self.formattedResponse = self.client.format_chat_response(self.rawResponse, self.systemPrompt, self.userPrompt)
+        self.formattedResponse['streamed'] = True
+        self.formattedResponse['time_to_first_token_seconds'] = firstTokenSeconds
+        self.formattedResponse['time_to_last_token_seconds'] = lastTokenSeconds
+
+        if self.writeToFile:
+            self.client.write_formatted_chat_response_to_json_file(self.formattedResponse)
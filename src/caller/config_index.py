@@ -0,0 +1,165 @@
+from os import makedirs, path, listdir
+from json import load
+from sqlite3 import connect
+from threading import Lock
+
+
+class ConfigIndex():
+    """Custom class to keep a SQLite index over the assistant, thread and file config JSON files so lookups do not scan the config folder"""
+    def __init__(self, configFolder, indexFileName='config_index.sqlite'):
+        self.configFolder = configFolder
+        self.indexFileName = f'{configFolder}{indexFileName}'
+        self.connection = None
+        self.lock = Lock()
+
+    def get_connection(self):
+        """Function to open the index on first use, creating and back-filling it from existing config files if needed"""
+        if self.connection is None:
+            makedirs(path.dirname(self.configFolder), exist_ok=True)
+            isNewIndex = not path.exists(self.indexFileName)
+
+            self.connection = connect(self.indexFileName, check_same_thread=False)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS assistants (name TEXT PRIMARY KEY, assistant_id TEXT NOT NULL, config_file TEXT);
+                CREATE TABLE IF NOT EXISTS threads (assistant_id TEXT NOT NULL, user_id TEXT NOT NULL, thread_id TEXT NOT NULL, created_at INTEGER, config_file TEXT, PRIMARY KEY (assistant_id, user_id));
+                CREATE TABLE IF NOT EXISTS assistant_files (assistant_id TEXT NOT NULL, original_file_name TEXT NOT NULL, file_id TEXT NOT NULL, created_at INTEGER, config_file TEXT, content_hash TEXT, PRIMARY KEY (assistant_id, original_file_name));
+                CREATE TABLE IF NOT EXISTS uploaded_files (content_hash TEXT PRIMARY KEY, file_id TEXT NOT NULL, original_file_name TEXT, bytes INTEGER, created_at INTEGER);
+                CREATE TABLE IF NOT EXISTS thread_sync (thread_id TEXT PRIMARY KEY, last_message_id TEXT NOT NULL, last_created_at INTEGER, synced_messages INTEGER NOT NULL DEFAULT 0);
+            """)
+
+            if 'content_hash' not in [row[1] for row in self.connection.execute('PRAGMA table_info(assistant_files)')]: #Indexes created before content hashes were tracked
+                self.connection.execute('ALTER TABLE assistant_files ADD COLUMN content_hash TEXT')
+
+            if isNewIndex:
+                self.rebuild_from_config_files()
+
+        return self.connection
+
+    def fetch_one(self, statement, parameters=()):
+        """Function to run a lookup against the index and return the first row"""
+        with self.lock:
+            return self.get_connection().execute(statement, parameters).fetchone()
+
+    def rebuild_from_config_files(self):
+        """Function to scan the config folder once and load every existing assistant, thread and file config into the index"""
+        for file in sorted(listdir(self.configFolder)):
+            if not file.endswith('.json'):
+                continue
+
+            with open(f'{self.configFolder}{file}', 'r', encoding='utf-8') as data:
+                config = load(data)
+
+            if file.startswith('asst'):
+                self.write_assistant(config, file)
+            elif file.startswith('thread') and config.get('user_id') is not None and 'assistant_id' in config:
+                self.write_thread(config, file)
+            elif file.startswith('file') and 'original_file_name' in config:
+                self.write_assistant_file(config, file)
+
+        self.connection.commit()
+
+    def write_assistant(self, config, configFile):
+        """Function to upsert an assistant row, the caller commits"""
+        self.connection.execute('INSERT OR REPLACE INTO assistants (name, assistant_id, config_file) VALUES (?, ?, ?)', (config['name'], config['id'], configFile))
+
+    def write_thread(self, config, configFile):
+        """Function to upsert a thread row, the caller commits"""
+        self.connection.execute('INSERT OR REPLACE INTO threads (assistant_id, user_id, thread_id, created_at, config_file) VALUES (?, ?, ?, ?, ?)', (config['assistant_id'], str(config['user_id']), config['id'], config.get('created_at'), configFile))
+
+    def write_assistant_file(self, config, configFile):
+        """Function to upsert an assistant file row, the caller commits"""
+        self.connection.execute('INSERT OR REPLACE INTO assistant_files (assistant_id, original_file_name, file_id, created_at, config_file, content_hash) VALUES (?, ?, ?, ?, ?, ?)', (config['assistant_id'], config['original_file_name'], config['id'], config.get('created_at'), configFile, config.get('content_hash')))
+
+        if config.get('content_hash') is not None:
+            self.write_uploaded_file(config['content_hash'], config['id'], config['original_file_name'], config.get('bytes'), config.get('created_at'))
+
+    def write_uploaded_file(self, contentHash, fileId, fileName, fileBytes, createdAt):
+        """Function to upsert the OpenAI file holding a given content hash, the caller commits"""
+        self.connection.execute('INSERT OR REPLACE INTO uploaded_files (content_hash, file_id, original_file_name, bytes, created_at) VALUES (?, ?, ?, ?, ?)', (contentHash, fileId, fileName, fileBytes, createdAt))
+
+    def add_assistant(self, config, configFile):
+        """Function to record a newly created assistant config"""
+        with self.lock:
+            self.get_connection()
+            self.write_assistant(config, configFile)
+            self.connection.commit()
+
+    def add_thread(self, config, configFile):
+        """Function to record a newly created thread config for an assistant and user"""
+        with self.lock:
+            self.get_connection()
+            self.write_thread(config, configFile)
+            self.connection.commit()
+
+    def add_assistant_file(self, config, configFile):
+        """Function to record a newly uploaded file config for an assistant"""
+        with self.lock:
+            self.get_connection()
+            self.write_assistant_file(config, configFile)
+            self.connection.commit()
+
+    def add_uploaded_file(self, contentHash, fileId, fileName, fileBytes, createdAt):
+        """Function to record the OpenAI file ID for an uploaded file's content hash so identical content is never uploaded twice"""
+        with self.lock:
+            self.get_connection()
+            self.write_uploaded_file(contentHash, fileId, fileName, fileBytes, createdAt)
+            self.connection.commit()
+
+    def get_assistant_id(self, assistantName):
+        """Function to look up an assistant ID by name, returning None if it is not indexed"""
+        row = self.fetch_one('SELECT assistant_id FROM assistants WHERE name = ?', (assistantName,))
+
+        return row[0] if row else None
+
+    def get_thread_id(self, assistantId, userId):
+        """Function to look up the thread ID for an assistant and user, returning None if it is not indexed"""
+        row = self.fetch_one('SELECT thread_id FROM threads WHERE assistant_id = ? AND user_id = ?', (assistantId, str(userId)))
+
+        return row[0] if row else None
+
+    def get_assistant_file_id(self, assistantId, fileName):
+        """Function to look up the file ID for a file name uploaded to an assistant, returning None if it is not indexed"""
+        row = self.fetch_one('SELECT file_id FROM assistant_files WHERE assistant_id = ? AND original_file_name = ?', (assistantId, fileName))
+
+        return row[0] if row else None
+
+    def get_uploaded_file_id(self, contentHash):
+        """Function to look up an already uploaded OpenAI file by content hash, returning None if that content was never uploaded"""
+        row = self.fetch_one('SELECT file_id FROM uploaded_files WHERE content_hash = ?', (contentHash,))
+
+        return row[0] if row else None
+
+    def get_assistant_file(self, assistantId, fileName):
+        """Function to look up the file ID, content hash and config file for a file name attached to an assistant, returning None if it is not indexed"""
+        row = self.fetch_one('SELECT file_id, content_hash, config_file FROM assistant_files WHERE assistant_id = ? AND original_file_name = ?', (assistantId, fileName))
+
+        return {'file_id': row[0], 'content_hash': row[1], 'config_file': row[2]} if row else None
+
+    def get_thread_sync_state(self, threadId):
+        """Function to look up the newest message saved for a thread, returning None if the thread was never synced"""
+        row = self.fetch_one('SELECT last_message_id, last_created_at, synced_messages FROM thread_sync WHERE thread_id = ?', (threadId,))
+
+        return {'last_message_id': row[0], 'last_created_at': row[1], 'synced_messages': row[2]} if row else None
+
+    def set_thread_sync_state(self, threadId, lastMessageId, lastCreatedAt, newMessages):
+        """Function to move a thread's high-water mark forward after a page of messages has been saved"""
+        with self.lock:
+            self.get_connection().execute(
+                'INSERT INTO thread_sync (thread_id, last_message_id, last_created_at, synced_messages) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (thread_id) DO UPDATE SET last_message_id = excluded.last_message_id, last_created_at = excluded.last_created_at, synced_messages = synced_messages + excluded.synced_messages',
+                (threadId, lastMessageId, lastCreatedAt, newMessages)
+            )
+            self.connection.commit()
+
+    def clear_thread_sync_state(self, threadId):
+        """Function to forget a thread's high-water mark so the next sync starts from its first message"""
+        with self.lock:
+            self.get_connection().execute('DELETE FROM thread_sync WHERE thread_id = ?', (threadId,))
+            self.connection.commit()
+
+    def close(self):
+        """Function to close the index connection"""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
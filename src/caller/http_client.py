@@ -0,0 +1,153 @@
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from threading import local
+from time import perf_counter
+
+connectTimings = local() #Connections are opened on the thread that sends the request
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """Custom class to record how long opening a new connection took"""
+    def connect(self):
+        startTime = perf_counter()
+        super().connect()
+        connectTimings.seconds = perf_counter() - startTime
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """Custom class to record how long opening a new connection, including the TLS handshake, took"""
+    def connect(self):
+        startTime = perf_counter()
+        super().connect()
+        connectTimings.seconds = perf_counter() - startTime
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Custom class to make the requests connection pool open timed connections"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class PooledHTTPClient():
+    """Custom class to hold a pool of keep-alive connections that is reused across REST calls instead of opening a new connection per request"""
+    def __init__(self, poolSize=10, keepAlive=True, connectTimeoutSeconds=10, readTimeoutSeconds=120, useHTTP2=False):
+        self.poolSize = poolSize
+        self.keepAlive = keepAlive
+        self.connectTimeoutSeconds = connectTimeoutSeconds
+        self.readTimeoutSeconds = readTimeoutSeconds
+        self.useHTTP2 = False
+
+        if useHTTP2:
+            try:
+                self.client = self.create_httpx_client()
+                self.useHTTP2 = True
+            except ImportError as e: #httpx needs the optional h2 package for HTTP/2
+                print(f'Error: HTTP/2 not available, falling back to HTTP/1.1 connection pool. Full message: {e}')
+
+        if not self.useHTTP2:
+            self.client = self.create_requests_session()
+            self.transientErrors = (RequestsConnectionError, RequestsTimeout)
+
+    def create_requests_session(self):
+        """Function to create a requests session with a connection pool sized for the expected concurrency"""
+        session = Session()
+        adapter = TimedHTTPAdapter(pool_connections=self.poolSize, pool_maxsize=self.poolSize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        if not self.keepAlive:
+            session.headers['Connection'] = 'close'
+
+        return session
+
+    def create_httpx_client(self):
+        """Function to create an httpx client with HTTP/2 enabled"""
+        from httpx import Client, Limits, Timeout, TransportError
+
+        self.transientErrors = (TransportError,)
+
+        return Client(
+            http2=True,
+            limits=Limits(max_connections=self.poolSize, max_keepalive_connections=self.poolSize if self.keepAlive else 0),
+            timeout=Timeout(self.readTimeoutSeconds, connect=self.connectTimeoutSeconds)
+        )
+
+    def reset_connect_timing(self):
+        """Function to clear the connect time recorded on this thread before sending a request"""
+        connectTimings.seconds = 0.0
+
+    def get_connect_seconds(self):
+        """Function to get how long the last request on this thread spent opening a connection (0 when a pooled connection was reused, None when the backend cannot tell)"""
+        if self.useHTTP2:
+            return None
+
+        return getattr(connectTimings, 'seconds', None)
+
+    def get_first_byte_seconds(self, response):
+        """Function to get the time from sending a request until its response headers were parsed (None when the backend cannot tell)"""
+        if self.useHTTP2:
+            return None
+
+        return response.elapsed.total_seconds()
+
+    def post(self, url, headers, json):
+        """Function to send a POST request over the pooled connections"""
+        if self.useHTTP2:
+            return self.client.post(url, headers=headers, json=json)
+
+        return self.client.post(url, headers=headers, json=json, timeout=(self.connectTimeoutSeconds, self.readTimeoutSeconds))
+
+    def get(self, url, headers):
+        """Function to send a GET request over the pooled connections"""
+        if self.useHTTP2:
+            return self.client.get(url, headers=headers)
+
+        return self.client.get(url, headers=headers, timeout=(self.connectTimeoutSeconds, self.readTimeoutSeconds))
+
+    def post_files(self, url, headers, data, files):
+        """Function to send a multipart POST request, such as a file upload, over the pooled connections"""
+        if self.useHTTP2:
+            return self.client.post(url, headers=headers, data=data, files=files)
+
+        return self.client.post(url, headers=headers, data=data, files=files, timeout=(self.connectTimeoutSeconds, self.readTimeoutSeconds))
+
+    def open_stream(self, url, headers, json=None, method='POST'):
+        """Function to send a request and return the response without reading the body, so it can be consumed line by line"""
+        if self.useHTTP2:
+            return self.client.send(self.client.build_request(method, url, headers=headers, json=json), stream=True)
+
+        return self.client.request(method, url, headers=headers, json=json, stream=True, timeout=(self.connectTimeoutSeconds, self.readTimeoutSeconds))
+
+    def iter_lines(self, response):
+        """Function to yield the decoded lines of a streamed response body as they arrive"""
+        if self.useHTTP2:
+            yield from response.iter_lines()
+        else:
+            for line in response.iter_lines(decode_unicode=True):
+                yield line
+
+    def read_json(self, response):
+        """Function to read the whole body of a streamed response as JSON, used for error responses"""
+        if self.useHTTP2:
+            response.read()
+
+        try:
+            return response.json()
+        except ValueError: #Gateway errors can come back as HTML
+            return {'error': {'message': response.text}}
+
+    def close(self):
+        """Function to close every pooled connection"""
+        self.client.close()
@@ -0,0 +1,153 @@
+from os import makedirs, path, stat, replace, remove, fdopen
+from base64 import b64encode
+from hashlib import sha256
+from io import BytesIO
+from mimetypes import guess_type
+from threading import Lock
+from tempfile import mkstemp
+from PIL import Image
+
+IMAGE_MIME_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+
+
+class VisionImagePreparer():
+    """Custom class to resize, recompress and base64 encode images for the vision API, caching the encoded payloads on disk by file hash"""
+    def __init__(self, cacheFolder, maxLongSide=2048, maxShortSide=768, jpegQuality=85):
+        self.cacheFolder = cacheFolder
+        self.maxLongSide = maxLongSide #The vision model scales high detail images to fit 2048 x 2048 and then to 768 on the short side, anything larger is wasted upload
+        self.maxShortSide = maxShortSide
+        self.jpegQuality = jpegQuality
+
+        self.fileHashes = {} #(path, size, modified time) -> content hash, so unchanged files are not re-hashed
+        self.lock = Lock()
+
+    def get_settings_key(self):
+        """Function to get a short key for the resize/recompress settings so cache entries change when the settings do"""
+        return f'{self.maxLongSide}x{self.maxShortSide}q{self.jpegQuality}'
+
+    def resize_image(self, image):
+        """Function to shrink an image to the largest size the vision model will actually use"""
+        width, height = image.size
+        scale = min(1.0, self.maxLongSide / max(width, height), self.maxShortSide / min(width, height))
+
+        if scale < 1.0:
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+        return image
+
+    def prepare_image(self, image):
+        """Function to resize and recompress a PIL image, keeping PNG for images with transparency and using JPEG otherwise, returning the MIME type and bytes"""
+        image = self.resize_image(image)
+        outputBuffer = BytesIO()
+
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image.save(outputBuffer, format='PNG', optimize=True)
+            imageFormat = 'PNG'
+        else:
+            image.convert('RGB').save(outputBuffer, format='JPEG', quality=self.jpegQuality, optimize=True)
+            imageFormat = 'JPEG'
+
+        return IMAGE_MIME_TYPES[imageFormat], outputBuffer.getvalue()
+
+    def build_data_url(self, mimeType, imageBytes):
+        """Function to build the base64 data URL sent in the image_url content"""
+        return f'data:{mimeType};base64,{b64encode(imageBytes).decode("utf-8")}'
+
+    def get_file_hash(self, imagePath):
+        """Function to get the content hash of a file, reusing the last hash while its size and modified time are unchanged"""
+        fileStats = stat(imagePath)
+        statKey = (path.abspath(imagePath), fileStats.st_size, fileStats.st_mtime_ns)
+
+        with self.lock:
+            fileHash = self.fileHashes.get(statKey)
+
+        if fileHash is None:
+            with open(imagePath, 'rb') as imageFile:
+                fileHash = sha256(imageFile.read()).hexdigest()
+
+            with self.lock:
+                self.fileHashes[statKey] = fileHash
+
+        return fileHash
+
+    def get_cached_data_url(self, cacheKey):
+        """Function to read a previously encoded data URL, returning None when it is not cached"""
+        try:
+            with open(f'{self.cacheFolder}{cacheKey}.txt', 'r', encoding='utf-8') as data:
+                return data.read()
+        except FileNotFoundError:
+            return None
+
+    def set_cached_data_url(self, cacheKey, dataURL):
+        """Function to save an encoded data URL for later prompts over the same image"""
+        makedirs(path.dirname(self.cacheFolder), exist_ok=True)
+        fileName = f'{self.cacheFolder}{cacheKey}.txt'
+
+        fileDescriptor, temporaryFileName = mkstemp(suffix='.tmp', dir=path.dirname(self.cacheFolder)) #Each writer gets its own file, so the same image prepared by two threads never shares one
+        with fdopen(fileDescriptor, 'w', encoding='utf-8') as outputFile:
+            outputFile.write(dataURL)
+
+        try:
+            replace(temporaryFileName, fileName)
+        except PermissionError: #Another writer is replacing the same entry (Windows), its copy is just as good
+            remove(temporaryFileName)
+
+    def get_data_url_for_file(self, imagePath):
+        """Function to get the prepared data URL for an image file, from the cache when the same content was prepared before"""
+        cacheKey = f'{self.get_file_hash(imagePath)}_{self.get_settings_key()}'
+        dataURL = self.get_cached_data_url(cacheKey)
+
+        if dataURL is None:
+            with Image.open(imagePath) as image:
+                dataURL = self.build_data_url(*self.prepare_image(image))
+            self.set_cached_data_url(cacheKey, dataURL)
+
+        return dataURL
+
+    def get_data_url_for_bytes(self, imageBytes):
+        """Function to get the prepared data URL for encoded image bytes held in memory, cached by their hash"""
+        cacheKey = f'{sha256(imageBytes).hexdigest()}_{self.get_settings_key()}'
+        dataURL = self.get_cached_data_url(cacheKey)
+
+        if dataURL is None:
+            with Image.open(BytesIO(imageBytes)) as image:
+                dataURL = self.build_data_url(*self.prepare_image(image))
+            self.set_cached_data_url(cacheKey, dataURL)
+
+        return dataURL
+
+    def get_data_url(self, imageSource):
+        """Function to get the prepared data URL for a file path, encoded bytes, a PIL image, or a (page number, image) pair from iter_pdf_page_images"""
+        if isinstance(imageSource, tuple):
+            imageSource = imageSource[1]
+
+        if isinstance(imageSource, str):
+            return self.get_data_url_for_file(imageSource)
+        elif isinstance(imageSource, (bytes, bytearray)):
+            return self.get_data_url_for_bytes(bytes(imageSource))
+        else: #PIL images rendered in memory are prepared directly, hashing their pixels would cost as much as encoding them
+            return self.build_data_url(*self.prepare_image(imageSource))
+
+    def get_original_data_url(self, imageSource):
+        """Function to base64 encode an image as is, without resizing, from a file path with the MIME type from its extension, encoded bytes with the MIME type of their format, a PIL image saved in its own format (PNG if it has none), or a (page number, image) pair from iter_pdf_page_images"""
+        if isinstance(imageSource, tuple):
+            imageSource = imageSource[1]
+
+        if isinstance(imageSource, str):
+            mimeType = guess_type(imageSource)[0] or 'image/jpeg'
+
+            with open(imageSource, 'rb') as imageFile:
+                return self.build_data_url(mimeType, imageFile.read())
+        elif isinstance(imageSource, (bytes, bytearray)):
+            with Image.open(BytesIO(imageSource)) as image:
+                imageFormat = image.format
+
+            return self.build_data_url(IMAGE_MIME_TYPES.get(imageFormat, f'image/{(imageFormat or "jpeg").lower()}'), bytes(imageSource))
+        elif isinstance(imageSource, Image.Image):
+            imageFormat = imageSource.format if imageSource.format in IMAGE_MIME_TYPES else 'PNG' #Pages rendered in memory have no format, PNG keeps them lossless
+            outputBuffer = BytesIO()
+            imageSource.save(outputBuffer, format=imageFormat)
+
+            return self.build_data_url(IMAGE_MIME_TYPES[imageFormat], outputBuffer.getvalue())
+
+        raise TypeError(f'Error: Cannot send {type(imageSource).__name__} as an image, pass a file path, encoded bytes, a PIL image or a (page number, image) pair.')
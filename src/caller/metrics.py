@@ -0,0 +1,230 @@
+from os import makedirs, path, replace
+from json import dump
+from threading import Lock
+from contextvars import ContextVar
+from time import perf_counter, time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 131072)
+
+activeTraces = ContextVar('activeTraces', default=()) #Per thread and per asyncio task, so concurrent flows do not share a trace
+
+
+class Histogram():
+    """Custom class to count observations into fixed cumulative buckets, the way Prometheus histograms do"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucketCounts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Function to add one observation"""
+        self.bucketCounts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self):
+        """Function to get the (upper bound, count at or below it) pairs, ending with +Inf"""
+        cumulativeCounts = []
+        runningCount = 0
+
+        for upperBound, bucketCount in zip(list(self.buckets) + ['+Inf'], self.bucketCounts):
+            runningCount += bucketCount
+            cumulativeCounts.append((upperBound, runningCount))
+
+        return cumulativeCounts
+
+
+class MetricsRegistry():
+    """Custom class to collect per-call counters and histograms (queue time, connect time, time to first byte, latency, retries, tokens and cost) labelled by application, model and operation"""
+    def __init__(self, applicationName, costPerThousandTokens={}, exporter=None, maxRecentTraces=1000):
+        self.applicationName = applicationName
+        self.costPerThousandTokens = costPerThousandTokens
+        self.exporter = exporter
+
+        self.counters = {}
+        self.histograms = {}
+        self.recentTraces = deque(maxlen=maxRecentTraces)
+        self.lock = Lock()
+
+    def get_key(self, metricName, labels):
+        """Function to build the lookup key for a metric and its labels, always including the application"""
+        return metricName, tuple(sorted({'application': self.applicationName, **{labelName: str(labelValue) for labelName, labelValue in labels.items()}}.items()))
+
+    def increment(self, metricName, value=1, **labels):
+        """Function to add to a counter"""
+        key = self.get_key(metricName, labels)
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, metricName, value, buckets=LATENCY_BUCKETS_SECONDS, **labels):
+        """Function to add an observation to a histogram"""
+        key = self.get_key(metricName, labels)
+
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def get_cost(self, gptModel, promptTokens, completionTokens):
+        """Function to price a call from the model's cost per 1k tokens, 0 for models without a listed price"""
+        return (promptTokens + completionTokens) / 1000 * self.costPerThousandTokens.get(gptModel, 0)
+
+    def record_call(self, operation, gptModel=None, status='ok', totalSeconds=0.0, queueSeconds=0.0, connectSeconds=None, firstByteSeconds=None, retryCount=0, promptTokens=0, completionTokens=0):
+        """Function to record everything known about one call (after its retries) and add it to the trace running on this thread, if any"""
+        labels = {'model': gptModel or 'none', 'operation': operation}
+        cost = self.get_cost(gptModel, promptTokens, completionTokens)
+
+        self.increment('openai_requests_total', status=status, **labels)
+        self.increment('openai_retries_total', retryCount, **labels)
+        self.observe('openai_request_seconds', totalSeconds, **labels)
+        self.observe('openai_queue_seconds', queueSeconds, **labels)
+
+        if connectSeconds is not None:
+            self.observe('openai_connect_seconds', connectSeconds, **labels)
+        if firstByteSeconds is not None:
+            self.observe('openai_time_to_first_byte_seconds', firstByteSeconds, **labels)
+
+        if promptTokens or completionTokens:
+            self.increment('openai_prompt_tokens_total', promptTokens, **labels)
+            self.increment('openai_completion_tokens_total', completionTokens, **labels)
+            self.increment('openai_cost_dollars_total', cost, **labels)
+            self.observe('openai_tokens_per_call', promptTokens + completionTokens, TOKEN_BUCKETS, **labels)
+
+        for traceRecord in activeTraces.get():
+            traceRecord['calls'] += 1
+            traceRecord['retries'] += retryCount
+            traceRecord['prompt_tokens'] += promptTokens
+            traceRecord['completion_tokens'] += completionTokens
+            traceRecord['cost'] += cost
+
+    @contextmanager
+    def time_call(self, operation, gptModel=None):
+        """Function to time a block as one call, recording it as an error if the block raises; set status, retry_count, queue_seconds or token fields on the yielded dict to include them"""
+        callRecord = {'status': 'ok', 'retry_count': 0, 'queue_seconds': 0.0, 'connect_seconds': None, 'first_byte_seconds': None, 'prompt_tokens': 0, 'completion_tokens': 0}
+        startTime = perf_counter()
+
+        try:
+            yield callRecord
+        except Exception as e:
+            callRecord['status'] = type(e).__name__
+            raise
+        finally:
+            self.record_call(operation, gptModel, callRecord['status'], perf_counter() - startTime, callRecord['queue_seconds'], callRecord['connect_seconds'], callRecord['first_byte_seconds'], callRecord['retry_count'], callRecord['prompt_tokens'], callRecord['completion_tokens'])
+
+    @contextmanager
+    def trace(self, traceName, **attributes):
+        """Function to trace a multi-step flow (such as message, run, poll and fetch for an assistant) as one unit, totalling the calls, retries, tokens and cost inside it"""
+        traceRecord = {'name': traceName, 'started_at': time(), 'status': 'ok', 'calls': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0, 'steps': [], **attributes}
+        traceToken = activeTraces.set(activeTraces.get() + (traceRecord,))
+        startTime = perf_counter()
+
+        try:
+            yield traceRecord
+        except Exception as e:
+            traceRecord['status'] = type(e).__name__
+            raise
+        finally:
+            activeTraces.reset(traceToken)
+            traceRecord['duration_seconds'] = perf_counter() - startTime
+            self.observe('openai_trace_seconds', traceRecord['duration_seconds'], trace=traceName, status=traceRecord['status'])
+
+            with self.lock:
+                self.recentTraces.append(traceRecord)
+
+    @contextmanager
+    def step(self, traceRecord, stepName):
+        """Function to time one named step inside a trace"""
+        startTime = perf_counter()
+
+        try:
+            yield
+        finally:
+            stepSeconds = perf_counter() - startTime
+            traceRecord['steps'].append({'name': stepName, 'duration_seconds': stepSeconds})
+            self.observe('openai_trace_step_seconds', stepSeconds, trace=traceRecord['name'], step=stepName)
+
+    def get_snapshot(self):
+        """Function to copy the current counters, histograms and recent traces into plain structures"""
+        with self.lock:
+            return {
+                'counters': [{'name': metricName, 'labels': dict(labels), 'value': value} for (metricName, labels), value in self.counters.items()],
+                'histograms': [{'name': metricName, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum, 'buckets': histogram.get_cumulative_counts()} for (metricName, labels), histogram in self.histograms.items()],
+                'traces': list(self.recentTraces)
+            }
+
+    def export(self):
+        """Function to hand the current metrics to the configured exporter, if there is one"""
+        if self.exporter is not None:
+            self.exporter.export(self.get_snapshot())
+
+
+class PrometheusTextExporter():
+    """Custom class to render metrics in the Prometheus text exposition format, optionally writing them to a file for the node exporter textfile collector"""
+    def __init__(self, fileName=None):
+        self.fileName = fileName
+
+    def escape_label_value(self, labelValue):
+        """Function to escape backslashes, quotes and newlines in a label value"""
+        return str(labelValue).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def format_labels(self, labels, extraLabels={}):
+        """Function to render a label set as {name="value",...}"""
+        allLabels = {**labels, **extraLabels}
+        escapedLabels = ','.join(f'{labelName}="{self.escape_label_value(labelValue)}"' for labelName, labelValue in allLabels.items())
+
+        return f'{{{escapedLabels}}}' if escapedLabels else ''
+
+    def render(self, snapshot):
+        """Function to render a metrics snapshot as Prometheus text"""
+        lines = []
+        declaredMetrics = set()
+
+        for counter in sorted(snapshot['counters'], key=lambda counter: counter['name']):
+            if counter['name'] not in declaredMetrics:
+                lines.append(f"# TYPE {counter['name']} counter")
+                declaredMetrics.add(counter['name'])
+            lines.append(f"{counter['name']}{self.format_labels(counter['labels'])} {counter['value']}")
+
+        for histogram in sorted(snapshot['histograms'], key=lambda histogram: histogram['name']):
+            if histogram['name'] not in declaredMetrics:
+                lines.append(f"# TYPE {histogram['name']} histogram")
+                declaredMetrics.add(histogram['name'])
+            for upperBound, bucketCount in histogram['buckets']:
+                lines.append(f"{histogram['name']}_bucket{self.format_labels(histogram['labels'], {'le': upperBound})} {bucketCount}")
+            lines.append(f"{histogram['name']}_sum{self.format_labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{histogram['name']}_count{self.format_labels(histogram['labels'])} {histogram['count']}")
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, snapshot):
+        """Function to write the rendered metrics to the file atomically, or print them when no file is set"""
+        text = self.render(snapshot)
+
+        if self.fileName is None:
+            print(text)
+            return
+
+        makedirs(path.dirname(self.fileName) or '.', exist_ok=True)
+        with open(f'{self.fileName}.tmp', 'w', encoding='utf-8') as outputFile:
+            outputFile.write(text)
+        replace(f'{self.fileName}.tmp', self.fileName)
+
+
+class JSONFileMetricsExporter():
+    """Custom class to write the metrics snapshot, including recent traces, to a local JSON file"""
+    def __init__(self, fileName, messageIndent=0):
+        self.fileName = fileName
+        self.messageIndent = messageIndent
+
+    def export(self, snapshot):
+        """Function to write the snapshot to the file atomically"""
+        makedirs(path.dirname(self.fileName) or '.', exist_ok=True)
+        with open(f'{self.fileName}.tmp', 'w', encoding='utf-8') as outputFile:
+            dump(snapshot, outputFile, ensure_ascii=False, indent=self.messageIndent)
+        replace(f'{self.fileName}.tmp', self.fileName)
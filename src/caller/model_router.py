@@ -0,0 +1,78 @@
+from collections import deque
+from math import ceil
+from threading import Lock
+from time import monotonic
+
+ROUTING_POLICIES = ('cheapest', 'fastest', 'failover')
+
+
+class ModelRouter():
+    """Custom class to pick the model for each chat request from its token count, each model's context limit and price, and the latency and errors seen so far, giving the order of fallbacks to try when a model is overloaded"""
+    def __init__(self, modelInformation, candidateModels=None, policy='cheapest', latencyWindow=100, minimumLatencySamples=5, cooldownSeconds=30, maxErrorRate=0.5):
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(f'Error: Unknown routing policy {policy}, expected one of {", ".join(ROUTING_POLICIES)}.')
+
+        self.models = {model['name']: model for modelList in modelInformation.values() for model in modelList}
+        self.candidateModels = list(candidateModels or [model['name'] for model in modelInformation['latest_models']]) #Also the failover chain, in order
+        self.policy = policy
+        self.minimumLatencySamples = minimumLatencySamples
+        self.cooldownSeconds = cooldownSeconds
+        self.maxErrorRate = maxErrorRate
+
+        self.latencies = {modelName: deque(maxlen=latencyWindow) for modelName in self.candidateModels}
+        self.outcomes = {modelName: deque(maxlen=latencyWindow) for modelName in self.candidateModels}
+        self.cooldownUntil = {}
+        self.lock = Lock()
+
+    def get_p95_latency(self, gptModel):
+        """Function to get the nearest-rank 95th percentile of a model's recent latencies, None until there are enough samples"""
+        with self.lock:
+            latencies = sorted(self.latencies[gptModel])
+
+        if len(latencies) < self.minimumLatencySamples:
+            return None
+
+        return latencies[ceil(0.95 * len(latencies)) - 1]
+
+    def get_error_rate(self, gptModel):
+        """Function to get the share of a model's recent calls that failed"""
+        with self.lock:
+            outcomes = list(self.outcomes[gptModel])
+
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def is_cooling_down(self, gptModel, currentTime=None):
+        """Function to check if a model failed recently enough that it should only be tried after the others"""
+        return self.cooldownUntil.get(gptModel, 0) > (currentTime or monotonic())
+
+    def get_route(self, requiredTokens, policy=None):
+        """Function to list the models to try in order: only models whose context fits the request, ranked by the policy, with models cooling down after a failure or failing more than maxErrorRate of recent calls moved to the end"""
+        policy = policy or self.policy
+        fittingModels = [modelName for modelName in self.candidateModels if self.models[modelName]['max_tokens_supported'] >= requiredTokens]
+
+        if policy == 'cheapest':
+            fittingModels.sort(key=lambda modelName: self.models[modelName]['cost_per_1k_tokens'])
+        elif policy == 'fastest': #Models without enough samples rank first so every model gets measured
+            fittingModels.sort(key=lambda modelName: (self.get_p95_latency(modelName) or 0.0, self.models[modelName]['cost_per_1k_tokens']))
+        elif policy != 'failover':
+            raise ValueError(f'Error: Unknown routing policy {policy}, expected one of {", ".join(ROUTING_POLICIES)}.')
+
+        currentTime = monotonic()
+
+        return sorted(fittingModels, key=lambda modelName: (self.is_cooling_down(modelName, currentTime), self.get_error_rate(modelName) > self.maxErrorRate))
+
+    def record_success(self, gptModel, latencySeconds):
+        """Function to add a successful call's latency to the model's recent statistics"""
+        with self.lock:
+            self.latencies[gptModel].append(latencySeconds)
+            self.outcomes[gptModel].append(True)
+
+    def record_failure(self, gptModel, retryAfterSeconds=None):
+        """Function to note an overloaded or failing model and move it behind the others until its cooldown, or the server's retry-after, has passed"""
+        with self.lock:
+            self.outcomes[gptModel].append(False)
+            self.cooldownUntil[gptModel] = monotonic() + max(self.cooldownSeconds, retryAfterSeconds or 0)
+
+    def get_stats(self):
+        """Function to get each candidate model's p95 latency, error rate, sample count and cooldown state"""
+        return [{'model': modelName, 'p95_latency_seconds': self.get_p95_latency(modelName), 'error_rate': self.get_error_rate(modelName), 'samples': len(self.outcomes[modelName]), 'cooling_down': self.is_cooling_down(modelName)} for modelName in self.candidateModels]
@@ -0,0 +1,273 @@
+from os import makedirs, path, fsync, getpid
+from json import dump, dumps
+from sqlite3 import connect
+from threading import Lock
+from time import time, monotonic
+from atexit import register
+
+FSYNC_POLICIES = ('never', 'flush', 'rotate')
+
+
+class JSONFileSink():
+    """Custom class to write every record to its own JSON file, the original layout under the application folder"""
+    def __init__(self, baseFolder):
+        self.baseFolder = baseFolder
+        self.createdFolders = set()
+        self.lock = Lock()
+
+    def get_folder(self, folderName):
+        """Function to create an output folder once per process instead of on every write"""
+        outputFolder = f'{self.baseFolder}{folderName}/'
+
+        if outputFolder not in self.createdFolders:
+            makedirs(path.dirname(outputFolder), exist_ok=True)
+
+            with self.lock:
+                self.createdFolders.add(outputFolder)
+
+        return outputFolder
+
+    def write(self, folderName, fileName, record, mode='w', messageIndent=0):
+        """Function to save a single flattened record to a JSON file"""
+        with open(f'{self.get_folder(folderName)}{fileName}', mode, encoding='utf-8') as outputFile:
+            dump(record, outputFile, ensure_ascii=False, indent=messageIndent)
+
+    def write_many(self, folderName, namedRecords, mode='w', messageIndent=0):
+        """Function to save a list of (file name, record) pairs"""
+        for fileName, record in namedRecords:
+            self.write(folderName, fileName, record, mode, messageIndent)
+
+    def flush(self):
+        """Function kept for a common interface, every write goes straight to disk"""
+
+    def close(self):
+        """Function kept for a common interface, there is nothing to release"""
+
+
+class BufferedSink():
+    """Custom class holding the buffering, batched flush and rotation logic shared by the append-only sinks"""
+    def __init__(self, baseFolder, flushEveryRecords=500, flushIntervalSeconds=5, maxRecordsPerSegment=100000, fsyncPolicy='rotate'):
+        if fsyncPolicy not in FSYNC_POLICIES:
+            raise ValueError(f'fsyncPolicy must be one of {FSYNC_POLICIES}, got {fsyncPolicy}')
+
+        self.baseFolder = baseFolder
+        self.flushEveryRecords = flushEveryRecords
+        self.flushIntervalSeconds = flushIntervalSeconds
+        self.maxRecordsPerSegment = maxRecordsPerSegment
+        self.fsyncPolicy = fsyncPolicy
+
+        self.buffers = {}
+        self.bufferedRecords = 0
+        self.lastFlushTime = monotonic()
+        self.lock = Lock()
+
+        register(self.close) #Buffered records are not lost when the process exits without calling close
+
+    def get_row(self, fileName, record):
+        """Function to add the record name (the file name it would have had) to the flattened record"""
+        return {'record_name': fileName, **record} if fileName else dict(record)
+
+    def write(self, folderName, fileName, record, mode='w', messageIndent=0):
+        """Function to buffer a single flattened record, flushing once the batch size or interval is reached"""
+        self.write_many(folderName, [(fileName, record)])
+
+    def write_many(self, folderName, namedRecords, mode='w', messageIndent=0):
+        """Function to buffer a list of (file name, record) pairs in one step"""
+        with self.lock:
+            buffer = self.buffers.setdefault(folderName, [])
+
+            for fileName, record in namedRecords:
+                buffer.append(self.get_row(fileName, record))
+                self.bufferedRecords += 1
+
+            if self.bufferedRecords >= self.flushEveryRecords or monotonic() - self.lastFlushTime >= self.flushIntervalSeconds:
+                self.flush_buffers()
+
+    def flush(self):
+        """Function to write every buffered record now"""
+        with self.lock:
+            self.flush_buffers()
+
+    def flush_buffers(self):
+        """Function to hand each folder's buffered rows to the writer, the caller holds the lock"""
+        for folderName, rows in self.buffers.items():
+            if rows:
+                self.write_rows(folderName, rows)
+
+        self.buffers = {}
+        self.bufferedRecords = 0
+        self.lastFlushTime = monotonic()
+
+    def get_segment_file_name(self, folderName, segmentNumber, extension):
+        """Function to build a segment file name that is unique per process start and segment number"""
+        outputFolder = f'{self.baseFolder}{folderName}/'
+        makedirs(path.dirname(outputFolder), exist_ok=True)
+
+        return f'{outputFolder}segment_{self.startTime}_{getpid()}_{segmentNumber:05d}.{extension}'
+
+    def write_rows(self, folderName, rows):
+        """Function to persist a batch of rows for one folder, implemented by each sink"""
+        raise NotImplementedError
+
+    def close(self):
+        """Function to flush what is left and release open files"""
+        self.flush()
+
+
+class JSONLSink(BufferedSink):
+    """Custom class to append records to rotating JSONL segment files, one line per record, instead of one small file each"""
+    def __init__(self, baseFolder, flushEveryRecords=500, flushIntervalSeconds=5, maxRecordsPerSegment=100000, maxBytesPerSegment=256 * 1024 * 1024, fsyncPolicy='rotate'):
+        self.maxBytesPerSegment = maxBytesPerSegment
+        self.startTime = int(time())
+        self.segments = {}
+
+        super().__init__(baseFolder, flushEveryRecords, flushIntervalSeconds, maxRecordsPerSegment, fsyncPolicy)
+
+    def open_segment(self, folderName):
+        """Function to open the next segment file for a folder"""
+        segmentNumber = self.segments[folderName]['number'] + 1 if folderName in self.segments else 0
+        outputFile = open(self.get_segment_file_name(folderName, segmentNumber, 'jsonl'), 'a', encoding='utf-8')
+        self.segments[folderName] = {'number': segmentNumber, 'file': outputFile, 'records': 0, 'bytes': 0}
+
+        return self.segments[folderName]
+
+    def close_segment(self, segment):
+        """Function to close a segment file, syncing it to disk first if the policy asks for it"""
+        segment['file'].flush()
+
+        if self.fsyncPolicy != 'never':
+            fsync(segment['file'].fileno())
+
+        segment['file'].close()
+
+    def write_rows(self, folderName, rows):
+        """Function to append a batch of rows to the current segment, rotating when it grows past the record or byte limit"""
+        segment = self.segments.get(folderName) or self.open_segment(folderName)
+
+        for row in rows:
+            if segment['records'] >= self.maxRecordsPerSegment or segment['bytes'] >= self.maxBytesPerSegment:
+                self.close_segment(segment)
+                segment = self.open_segment(folderName)
+
+            line = dumps(row, ensure_ascii=False) + '\n'
+            segment['file'].write(line)
+            segment['records'] += 1
+            segment['bytes'] += len(line)
+
+        segment['file'].flush()
+
+        if self.fsyncPolicy == 'flush':
+            fsync(segment['file'].fileno())
+
+    def close(self):
+        """Function to flush what is left and close every open segment file"""
+        with self.lock:
+            self.flush_buffers()
+
+            for segment in self.segments.values():
+                if not segment['file'].closed:
+                    self.close_segment(segment)
+
+            self.segments = {}
+
+
+class SQLiteSink(BufferedSink):
+    """Custom class to insert records into one SQLite table per output folder, adding a column whenever a new field appears"""
+    def __init__(self, baseFolder, databaseFileName='records.sqlite', flushEveryRecords=500, flushIntervalSeconds=5, fsyncPolicy='flush'):
+        self.databaseFileName = f'{baseFolder}{databaseFileName}'
+        self.connection = None
+        self.tableColumns = {}
+
+        super().__init__(baseFolder, flushEveryRecords, flushIntervalSeconds, None, fsyncPolicy)
+
+    def get_connection(self):
+        """Function to open the database on first use"""
+        if self.connection is None:
+            makedirs(path.dirname(self.databaseFileName), exist_ok=True)
+            self.connection = connect(self.databaseFileName, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(f"PRAGMA synchronous={'FULL' if self.fsyncPolicy == 'flush' else 'NORMAL'}")
+
+        return self.connection
+
+    def get_table_name(self, folderName):
+        """Function to turn an output folder such as data/chat_messages into a table name such as chat_messages"""
+        return folderName.rstrip('/').split('/')[-1]
+
+    def get_columns(self, tableName, rows):
+        """Function to create the table or add any missing columns so every field of the batch has somewhere to go"""
+        connection = self.get_connection()
+
+        if tableName not in self.tableColumns:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS "{tableName}" (record_name TEXT)')
+            self.tableColumns[tableName] = [row[1] for row in connection.execute(f'PRAGMA table_info("{tableName}")')]
+
+        columns = self.tableColumns[tableName]
+
+        for row in rows:
+            for fieldName in row:
+                if fieldName not in columns:
+                    connection.execute(f'ALTER TABLE "{tableName}" ADD COLUMN "{fieldName}"')
+                    columns.append(fieldName)
+
+        return columns
+
+    def get_value(self, value):
+        """Function to store nested values (lists and dicts) as JSON text"""
+        return dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+
+    def write_rows(self, folderName, rows):
+        """Function to insert a batch of rows in a single transaction"""
+        tableName = self.get_table_name(folderName)
+        columns = self.get_columns(tableName, rows)
+        columnList = ', '.join(f'"{column}"' for column in columns)
+        placeholders = ', '.join('?' for column in columns)
+
+        self.connection.executemany(f'INSERT INTO "{tableName}" ({columnList}) VALUES ({placeholders})', [[self.get_value(row.get(column)) for column in columns] for row in rows])
+        self.connection.commit()
+
+    def close(self):
+        """Function to flush what is left and close the database"""
+        with self.lock:
+            self.flush_buffers()
+
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+class ParquetSink(BufferedSink):
+    """Custom class to write each flushed batch as a Parquet file per output folder, needs the optional pyarrow package"""
+    def __init__(self, baseFolder, flushEveryRecords=10000, flushIntervalSeconds=60, fsyncPolicy='never'):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.startTime = int(time())
+        self.segmentNumbers = {}
+
+        super().__init__(baseFolder, flushEveryRecords, flushIntervalSeconds, None, fsyncPolicy)
+
+    def write_rows(self, folderName, rows):
+        """Function to write a batch of rows as the next Parquet segment for a folder"""
+        segmentNumber = self.segmentNumbers.get(folderName, -1) + 1
+        self.segmentNumbers[folderName] = segmentNumber
+
+        table = self.pyarrow.Table.from_pylist([{fieldName: dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value for fieldName, value in row.items()} for row in rows])
+        self.pyarrow.parquet.write_table(table, self.get_segment_file_name(folderName, segmentNumber, 'parquet'))
+
+
+OUTPUT_SINKS = {'json': JSONFileSink, 'jsonl': JSONLSink, 'sqlite': SQLiteSink, 'parquet': ParquetSink}
+
+
+def create_output_sink(outputSink, baseFolder, outputSinkOptions=None):
+    """Function to build the output sink named by outputSink (json, jsonl, sqlite or parquet), or pass through an already built sink"""
+    if not isinstance(outputSink, str):
+        return outputSink
+
+    try:
+        return OUTPUT_SINKS[outputSink](baseFolder, **(outputSinkOptions or {}))
+    except ImportError as e: #Parquet needs the optional pyarrow package
+        print(f'Error: {outputSink} output sink not available, falling back to JSONL files. Full message: {e}')
+
+        return JSONLSink(baseFolder)
@@ -0,0 +1,38 @@
+from io import BytesIO
+import pypdfium2 as pdfium
+
+
+def render_pdf_page(pdf, pageNumber, renderDPIScale=3, renderRotationDegrees=0):
+    """Function to render one page of an open PDF to a PIL image"""
+    page = pdf[pageNumber]
+
+    try:
+        bitmap = page.render(
+            scale = renderDPIScale,    # 72 * scale dpi resolution, e.g. 3 scale = 72 * 3 or 216 dpi
+            rotation = renderRotationDegrees, # 0, 90, 180, or 270 degrees (default is 0)
+        )
+
+        return bitmap.to_pil()
+    finally:
+        page.close()
+
+
+def render_pdf_pages_to_files(pdfPath, pageNumbers, outputFileNames, renderDPIScale=3, renderRotationDegrees=0):
+    """Function to render a set of pages from one PDF to PNG files, opened once per call so it can run in a worker process"""
+    pdf = pdfium.PdfDocument(pdfPath)
+
+    try:
+        for pageNumber, outputFileName in zip(pageNumbers, outputFileNames):
+            render_pdf_page(pdf, pageNumber, renderDPIScale, renderRotationDegrees).save(outputFileName)
+    finally:
+        pdf.close()
+
+    return outputFileNames
+
+
+def encode_pil_image(image, imageFormat='PNG'):
+    """Function to encode a PIL image to bytes in memory"""
+    outputBuffer = BytesIO()
+    image.save(outputBuffer, format=imageFormat)
+
+    return outputBuffer.getvalue()
@@ -1,46 +1,340 @@
-from os import makedirs, path, listdir
-from json import dump, load
-from openai import OpenAI
-from time import sleep
-
-class OpenAIPythonIntegration(OpenAI):
-    """Custom class to utilize Python to directly work with OpenAI to do various functions"""
-    def __init__(self, applicationName, virtualEnvironmentName):
+from os import remove
+from hashlib import sha256
+from openai import OpenAI, APIConnectionError, APIStatusError
+from time import sleep, monotonic
+from functools import cached_property
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue
+from caller.retry import RetryPolicy, RETRYABLE_STATUS_CODES, parse_retry_after_seconds
+from caller.config_index import ConfigIndex
+from caller.record_index import RecordIndex
+from caller.output_sink import JSONFileSink, create_output_sink
+from caller.metrics import MetricsRegistry
+from caller.shared_clients import read_credential, get_shared_sdk_http_client
+
+RUN_PENDING_STATUSES = {'queued', 'in_progress', 'cancelling'} #Every other run status is final or needs action from the caller
+
+class OpenAIPythonIntegrationBase():
+    """Custom class holding the credential, retry, formatting and config lookup logic shared by the sync and async Python integrations"""
+    def setup_integration(self, applicationName, virtualEnvironmentName, maxRetries, retryDeadlineSeconds, outputSink='json', outputSinkOptions=None, metricsExporter=None, apiBaseURL=None):
+        """Function to set the attributes shared by both integrations, the OpenAI client itself is only opened on first use of client"""
         self.applicationName = applicationName
         self.virtualEnvironmentName = virtualEnvironmentName
+        self.apiBaseURL = apiBaseURL
+        self.clientLock = Lock()
         
-        self.apiKey = self.get_api_key()
-        self.organizationId = self.get_organization_key()
-    
-        super().__init__(organization=self.organizationId, api_key=self.apiKey)
+        self.retryPolicy = RetryPolicy(maxRetries=maxRetries, deadlineSeconds=retryDeadlineSeconds)
+        self.configIndex = ConfigIndex(f'./src/{self.applicationName}/config/')
+        self.configSink = JSONFileSink(f'./src/{self.applicationName}/') #Config files stay one JSON file each, the config index is rebuilt from them
+        self.outputSink = create_output_sink(outputSink, f'./src/{self.applicationName}/', outputSinkOptions)
+        self.metrics = MetricsRegistry(applicationName, exporter=metricsExporter) #Assistant runs do not report token usage, so there is nothing to price
+
+    def __getattr__(self, attributeName):
+        """Function to keep the OpenAI SDK surface (beta, chat, files, with_options and so on) on the integration by forwarding the names the SDK client class declares to client, any other missing attribute still raises"""
+        sdkClientClass = getattr(type(self), 'sdkClientClass', None)
+
+        if sdkClientClass is None or attributeName.startswith('_') or not (attributeName in sdkClientClass.__annotations__ or hasattr(sdkClientClass, attributeName)):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{attributeName}'")
+
+        return getattr(self.client, attributeName)
+
+    @cached_property
+    def client(self):
+        """Function to open the OpenAI client the first time a call needs it, so constructing the integration stays cheap"""
+        with self.clientLock: #Threads starting their first call together would otherwise each build a client
+            if 'client' not in self.__dict__:
+                self.__dict__['client'] = self.open_client()
+
+            return self.__dict__['client']
+
+    @cached_property
+    def apiKey(self):
+        """Function to resolve the API key the first time the client is opened"""
+        return self.get_api_key()
+
+    @cached_property
+    def organizationId(self):
+        """Function to resolve the organization key the first time the client is opened"""
+        return self.get_organization_key()
+
+    @cached_property
+    def recordIndex(self):
+        """Function to open the index over the saved chat messages and run logs the first time a query needs it"""
+        return RecordIndex(f'./src/{self.applicationName}/data/', outputSink=self.outputSink)
 
     def get_api_key(self):
-        """Function to get the API key to use for authorization when opening client object"""
-        try:
-            fileName = f'./{self.virtualEnvironmentName}/API_KEY.txt'
-            
-            with open(fileName, 'r', encoding='utf-8') as data:
-                key = data.read().strip()
-            return key
-        except FileNotFoundError as e:
-            print(f"Error: API key file not found! Full message: ${e}")
+        """Function to get the API key to use for authorization when opening client object, from OPENAI_API_KEY or the virtual environment folder"""
+        return read_credential('OPENAI_API_KEY', self.virtualEnvironmentName, 'API_KEY.txt', 'API key')
         
     def get_organization_key(self):
-        """Function to get the Organization key to use with the API key when opening client object"""
-        try:
-            fileName = f'./{self.virtualEnvironmentName}/ORGANIZATION_KEY.txt'
-            
-            with open(fileName, 'r', encoding='utf-8') as data:
-                key = data.read().strip()
-            return key
-        except FileNotFoundError as e:
-            print(f"Error: Organization key file not found! Full message: ${e}")
+        """Function to get the Organization key to use with the API key when opening client object, from OPENAI_ORG_ID or the virtual environment folder"""
+        return read_credential('OPENAI_ORG_ID', self.virtualEnvironmentName, 'ORGANIZATION_KEY.txt', 'Organization key')
+
+    def is_retryable_error(self, error):
+        """Function to decide if a failed SDK call should be retried (connection errors, timeouts, 429s and 5xx)"""
+        if isinstance(error, APIConnectionError):
+            return True
+
+        return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+    def get_operation_name(self, function):
+        """Function to name an SDK call for the metrics, e.g. Runs.create"""
+        return getattr(function, '__qualname__', str(function))
+
+    def get_retry_after_seconds(self, error):
+        """Function to read the Retry-After header from a failed SDK call, if there is one"""
+        response = getattr(error, 'response', None)
+
+        return parse_retry_after_seconds(response.headers) if response is not None else None
+
+    def write_json_file(self, folderName, fileName, outputDict, mode='w', messageIndent=0):
+        """Function to save a flattened response to a JSON file under the application folder"""
+        self.configSink.write(folderName, fileName, outputDict, mode, messageIndent)
+
+    def write_records(self, folderName, namedRecords, mode='w', messageIndent=0):
+        """Function to send a list of (file name, flattened response) pairs to the configured output sink"""
+        self.outputSink.write_many(folderName, namedRecords, mode, messageIndent)
+
+    def format_message_records(self, messages, userId, retryCount):
+        """Function to flatten every content part of a list of messages into (file name, record) pairs"""
+        return [(self.get_message_file_name(message, userId), self.format_message_response(message, response, userId, retryCount)) for message in messages for response in message.content]
+
+    def format_assistant_response(self, assistantResponse, retryCount):
+        """Function to flatten an assistant response into the fields saved to the config folder"""
+        assistantDict = {}
+
+        assistantDict['id'] = assistantResponse.id
+        assistantDict['name'] = assistantResponse.name
+        assistantDict['created_at'] = assistantResponse.created_at
+        assistantDict['model'] = assistantResponse.model
+        assistantDict['instructions'] = assistantResponse.instructions
+        assistantDict['type'] = assistantResponse.tools[0].type
+        assistantDict['metadata'] = assistantResponse.metadata
+        assistantDict['retry_count'] = retryCount
+
+        return assistantDict
+
+    def format_assistant_file_response(self, fileToAssistantResponse, fileName, retryCount):
+        """Function to flatten an assistant file response into the fields saved to the config folder"""
+        fileUploadDict = {}
+
+        fileUploadDict['id'] = fileToAssistantResponse.id
+        fileUploadDict['assistant_id'] = fileToAssistantResponse.assistant_id
+        fileUploadDict['created_at'] = fileToAssistantResponse.created_at
+        fileUploadDict['original_file_name'] = fileName
+        fileUploadDict['retry_count'] = retryCount
+
+        return fileUploadDict
+
+    def format_thread_response(self, threadResponse, assistantId, userId, retryCount):
+        """Function to flatten a thread response into the fields saved to the config folder"""
+        threadDict = {}
+
+        threadDict['id'] = threadResponse.id
+        threadDict['created_at'] = threadResponse.created_at
+        threadDict['assistant_id'] = assistantId
+        threadDict['user_id'] = userId
+        threadDict['retry_count'] = retryCount
+
+        return threadDict
+
+    def format_message_response(self, message, response, userId, retryCount):
+        """Function to flatten one content block of a thread message into the fields saved to the chat messages"""
+        messageResponseDict = {}
+
+        messageResponseDict['id'] = message.id
+        messageResponseDict['created_at'] = message.created_at
+        messageResponseDict['thread_id'] = message.thread_id
+        messageResponseDict['run_id'] = message.run_id
+        messageResponseDict['user_id'] = userId
+        messageResponseDict['user'] = message.role
+        messageResponseDict['response_type'] = response.type
+        messageResponseDict['response_text'] = response.text.value
+        messageResponseDict['retry_count'] = retryCount
+
+        return messageResponseDict
+
+    def get_message_page_parameters(self, threadId, afterMessageId, pageSize):
+        """Function to build the arguments for one page of a thread's messages, oldest first and starting after the last saved message"""
+        pageParameters = {'thread_id': threadId, 'order': 'asc', 'limit': pageSize}
+
+        if afterMessageId is not None:
+            pageParameters['after'] = afterMessageId
+
+        return pageParameters
+
+    def has_more_messages(self, messagePage, pageSize):
+        """Function to decide if another page of messages should be fetched, using has_more when the API sends it"""
+        hasMore = getattr(messagePage, 'has_more', None)
+
+        return hasMore if hasMore is not None else len(messagePage.data) == pageSize
+
+    def save_message_page(self, threadId, userId, messages, retryCount, mode='w', messageIndent=0):
+        """Function to bulk write one page of messages and then move the thread's high-water mark past them, returning the new mark"""
+        self.write_records('data/chat_messages', self.format_message_records(messages, userId, retryCount), mode, messageIndent)
+        self.outputSink.flush() #The mark must never get ahead of what is on disk
+
+        lastMessage = messages[-1]
+        self.configIndex.set_thread_sync_state(threadId, lastMessage.id, lastMessage.created_at, len(messages))
+
+        return lastMessage.id
+
+    def get_message_file_name(self, message, userId):
+        """Function to get the chat messages file name for a thread message"""
+        return f'{userId}_{message.role}_{message.id}_{message.created_at}_{message.run_id}.json'
+
+    def get_run_log_file_name(self, runResponse):
+        """Function to get the run logs file name for a run"""
+        return f'{runResponse.id}_{runResponse.created_at}_{runResponse.thread_id}.json'
+
+    def format_run_response(self, runResponse, userId, retryCount):
+        """Function to flatten a run response into the fields saved to the run logs"""
+        runResponseDict = {}
+
+        runResponseDict['id'] = runResponse.id
+        runResponseDict['assistant_id'] = runResponse.assistant_id
+        runResponseDict['thread_id'] = runResponse.thread_id
+        runResponseDict['user_id'] = userId
+        runResponseDict['status'] = runResponse.status
+        runResponseDict['created_at'] = runResponse.created_at
+        runResponseDict['started_at'] = runResponse.started_at
+        runResponseDict['completed_at'] = runResponse.completed_at
+        runResponseDict['expires_at'] = runResponse.expires_at
+        runResponseDict['failed_at'] = runResponse.failed_at
+        runResponseDict['error_message'] = runResponse.last_error.message if runResponse.last_error else None
+        runResponseDict['retry_count'] = retryCount
+
+        return runResponseDict
+
+    def get_assistant_id_from_config(self, assistantName):
+        """Function to look up the ID of a previously created assistant from the config index"""
+        assistantId = self.configIndex.get_assistant_id(assistantName)
+
+        if assistantId is not None:
+            print('Found existing assistant with id: ' + assistantId)
+            return assistantId
+        else:
+            raise Exception('Error: Assistant does not exist by name entered.  Please check the application and assistant name or call the create assistant function.')
+
+    def check_for_existing_assistant_file_id_from_config(self, assistantId, fileName):
+        """Function to look up the ID of a file previously uploaded to an assistant from the config index"""
+        fileId = self.configIndex.get_assistant_file_id(assistantId, fileName)
+
+        if fileId is not None:
+            print('Found file associated with id: ' + fileId)
+            return fileId
+        else:
+            raise Exception('Error: File has not been uploaded to the assistant.  Please check the assistant ID and file name or call the upload file function.')
+
+    def get_thread_id_for_user(self, assistantId, userId):
+        """Function to look up the thread previously created for an assistant and user from the config index"""
+        userSpecificThreadId = self.configIndex.get_thread_id(assistantId, userId)
+
+        if userSpecificThreadId is not None:
+            print('Found existing thread for assistant and user with id: ' + str(userSpecificThreadId))
+            return userSpecificThreadId
+        else:
+            raise Exception('Error: Thread does not exist for assistant and user ID.  Please check the assistant ID, application name, and user ID or call the create thread function.')
+
+    def get_file_hash(self, fileName, chunkSize=1024 * 1024):
+        """Function to hash the contents of a file under the application data folder"""
+        fileHash = sha256()
+
+        with open(f'./src/{self.applicationName}/data/{fileName}', mode='rb') as fileToHash:
+            for chunk in iter(lambda: fileToHash.read(chunkSize), b''):
+                fileHash.update(chunk)
+
+        return fileHash.hexdigest()
+
+    def get_changed_files(self, assistantId, fileNames, contentHashes):
+        """Function to look up the files already attached to an assistant and list the ones that are new or whose content changed"""
+        existingFiles = {fileName: self.configIndex.get_assistant_file(assistantId, fileName) for fileName in fileNames}
+        changedFiles = [fileName for fileName in fileNames if not (existingFiles[fileName] and existingFiles[fileName]['content_hash'] == contentHashes[fileName])]
+
+        return existingFiles, changedFiles
+
+    def group_files_by_hash(self, fileNames, contentHashes):
+        """Function to group file names by content hash so each distinct content is uploaded once, even when several files in a batch share it"""
+        filesByHash = {}
+
+        for fileName in fileNames:
+            filesByHash.setdefault(contentHashes[fileName], []).append(fileName)
+
+        return filesByHash
+
+    def add_upload_result(self, uploadedFiles, summary, hashFiles, uploadResult):
+        """Function to note one upload against every file name with that content, only the first counting as the upload"""
+        for position, fileName in enumerate(hashFiles):
+            uploadedFiles[fileName] = uploadResult if position == 0 else {**uploadResult, 'retry_count': 0, 'uploaded': False}
+            summary['uploaded' if uploadedFiles[fileName]['uploaded'] else 'reused'] += 1
+
+    def get_assistant_file_ids(self, currentFileIds, uploadedFiles, existingFiles):
+        """Function to get an assistant's file IDs once the uploaded files are attached, dropping older versions of the same file names"""
+        newFileIds = [uploadedFile['file_id'] for uploadedFile in uploadedFiles.values()]
+        replacedFileIds = {existingFiles[fileName]['file_id'] for fileName in uploadedFiles if existingFiles[fileName]} - set(newFileIds)
+
+        return list(dict.fromkeys([fileId for fileId in currentFileIds if fileId not in replacedFileIds] + newFileIds))
+
+    def save_assistant_files(self, assistantId, uploadedFiles, existingFiles, contentHashes, retryCount, fileWriteMode='w', messageIndent=0):
+        """Function to record files attached to an assistant in the config folder and index, removing the configs of the versions they replaced"""
+        for fileName, uploadedFile in uploadedFiles.items():
+            fileUploadDict = {
+                'id': uploadedFile['file_id'],
+                'assistant_id': assistantId,
+                'created_at': uploadedFile['created_at'],
+                'original_file_name': fileName,
+                'content_hash': contentHashes[fileName],
+                'bytes': uploadedFile['bytes'],
+                'retry_count': uploadedFile['retry_count'] + retryCount
+            }
+            configFileName = f"{uploadedFile['file_id']}_{fileName}_{assistantId}.json"
+
+            if existingFiles[fileName] and existingFiles[fileName]['config_file'] not in (None, configFileName): #Stale versions would otherwise win when the index is rebuilt
+                try:
+                    remove(f'./src/{self.applicationName}/config/{existingFiles[fileName]["config_file"]}')
+                except FileNotFoundError:
+                    pass
+
+            self.write_json_file('config', configFileName, fileUploadDict, fileWriteMode, messageIndent)
+            self.configIndex.add_assistant_file(fileUploadDict, configFileName)
+
+
+class OpenAIPythonIntegration(OpenAIPythonIntegrationBase):
+    """Custom class to utilize Python to directly work with OpenAI to do various functions"""
+    sdkClientClass = OpenAI
+    def __init__(self, applicationName, virtualEnvironmentName, maxRetries=5, retryDeadlineSeconds=120, outputSink='json', outputSinkOptions=None, metricsExporter=None, apiBaseURL=None, shareHTTPClient=True):
+        self.shareHTTPClient = shareHTTPClient
+        self.setup_integration(applicationName, virtualEnvironmentName, maxRetries, retryDeadlineSeconds, outputSink, outputSinkOptions, metricsExporter, apiBaseURL)
+
+    def open_client(self):
+        """Function to build the OpenAI client, on the connection pool shared by every integration in the process unless shareHTTPClient is off"""
+        return OpenAI(organization=self.organizationId, api_key=self.apiKey, base_url=self.apiBaseURL, http_client=get_shared_sdk_http_client() if self.shareHTTPClient else None, max_retries=0) #Retries are handled by the shared retry policy instead
+
+    def close(self):
+        """Function to flush the output sink, export the metrics and close the config index along with the OpenAI client"""
+        self.outputSink.close()
+        self.metrics.export()
+        self.configIndex.close()
+
+        if 'recordIndex' in self.__dict__:
+            self.recordIndex.close()
+
+        if 'client' in self.__dict__ and not self.shareHTTPClient: #The shared pool stays open for other integrations and closes at exit
+            self.client.close()
+
+    def call_with_retry(self, function, **kwargs):
+        """Function to call an OpenAI SDK method with retries on transient failures, returning the result and the number of retries used"""
+        with self.metrics.time_call(self.get_operation_name(function)) as callRecord:
+            result, callRecord['retry_count'] = self.retryPolicy.call(lambda: function(**kwargs), self.is_retryable_error, self.get_retry_after_seconds)
+
+            return result, callRecord['retry_count']
 
     def create_assistant(self, name, instructions, metadata = {}, assistantType='retrieval', gptModel='gpt-4-1106-preview', mode='w', messageIndent=0):
         """Function to directly use OpenAI to create an assistant"""
         try:
-            assistantDict = {}
-            assistantResponse = self.beta.assistants.create(
+            assistantResponse, retryCount = self.call_with_retry(
+                self.client.beta.assistants.create,
                 name=name,
                 instructions=instructions,
                 model=gptModel,
@@ -48,156 +342,103 @@ class OpenAIPythonIntegration(OpenAI):
                 metadata=metadata
             ) 
 
-            assistantDict['id'] = assistantResponse.id
-            assistantDict['name'] = assistantResponse.name
-            assistantDict['created_at'] = assistantResponse.created_at
-            assistantDict['model'] = assistantResponse.model
-            assistantDict['instructions'] = assistantResponse.instructions
-            assistantDict['type'] = assistantResponse.tools[0].type
-            assistantDict['metadata'] = assistantResponse.metadata
+            assistantDict = self.format_assistant_response(assistantResponse, retryCount)
+            configFileName = f'{assistantResponse.id}_{assistantResponse.name}.json'
 
-            makedirs(path.dirname(f'./src/{self.applicationName}/config/'), exist_ok=True)
-            
-            with open(f'./src/{self.applicationName}/config/{assistantResponse.id}_{assistantResponse.name}.json', mode, encoding='utf-8') as outputFile:
-                dump(assistantDict, outputFile, ensure_ascii=False, indent=messageIndent)
+            self.write_json_file('config', configFileName, assistantDict, mode, messageIndent)
+            self.configIndex.add_assistant(assistantDict, configFileName)
             print('Success! Assistant successfully created and saved to config file with id: ' + str(assistantResponse.id))
 
         except Exception as e:
             print('Failure! Assistant failed to create, full response: ' + str(e))
 
-        print('Created assistant with id: ' + str(assistantResponse.id))
+    def upload_file_to_assistant(self, fileName, assistantId, filePurpose='assistants', fileReadMode = 'rb', fileWriteMode = 'w', messageIndent=0):
+        """Function to directly upload a file to OpenAI, skipping the upload when the same content is already there"""
+        return self.sync_files_to_assistant(assistantId, [fileName], maxWorkers=1, filePurpose=filePurpose, showProgress=False, fileWriteMode=fileWriteMode, messageIndent=messageIndent)
+
+    def upload_file_by_hash(self, fileName, contentHash, filePurpose='assistants'):
+        """Function to get the OpenAI file for some content, uploading it only if that content was never uploaded before"""
+        fileId = self.configIndex.get_uploaded_file_id(contentHash)
 
-    def get_assistant_id_from_config(self, assistantName):
-        """Function to review the previously generated assistant json file configurations to return the ID associated"""
-        configFiles = listdir(f'./src/{self.applicationName}/config/')
-        assistantFiles = []
+        if fileId is not None:
+            return {'file_id': fileId, 'bytes': None, 'created_at': None, 'retry_count': 0, 'uploaded': False}
+
+        with open(f'./src/{self.applicationName}/data/{fileName}', mode='rb') as fileToUpload:
+            uploadResponse, retryCount = self.call_with_retry(self.client.files.create, file=fileToUpload, purpose=filePurpose)
+
+        self.configIndex.add_uploaded_file(contentHash, uploadResponse.id, fileName, uploadResponse.bytes, uploadResponse.created_at)
+
+        return {'file_id': uploadResponse.id, 'bytes': uploadResponse.bytes, 'created_at': uploadResponse.created_at, 'retry_count': retryCount, 'uploaded': True}
+
+    def sync_files_to_assistant(self, assistantId, fileNames, maxWorkers=8, filePurpose='assistants', showProgress=True, fileWriteMode='w', messageIndent=0):
+        """Function to make an assistant's files match the given files under the data folder, hashing contents to skip unchanged files, uploading new content concurrently and attaching everything in one assistant update"""
+        from tqdm import tqdm
+
+        summary = {'unchanged': 0, 'uploaded': 0, 'reused': 0, 'failed': 0}
 
-        for file in configFiles:
-            if file.startswith('asst'):
-                assistantFiles.append(file)
-        
-        for file in assistantFiles:
-            with open(f'./src/{self.applicationName}/config/{file}', 'r') as data:
-                config = load(data)
-                name = config['name']
-            
-                if name == assistantName:
-                    assistantId = config['id']
-                    print('Found existing assistant with id: ' + assistantId)
-        
         try:
-            return assistantId
-        except UnboundLocalError:
-            raise Exception('Error: Assistant does not exist by name entered.  Please check the application and assistant name or call the create assistant function.')
-    
-    def upload_file_to_assistant(self, fileName, assistantId, filePurpose='assistants', fileReadMode = 'rb', fileWriteMode = 'w', messageIndent=0):
-        """Function to directly upload a file to OpenAI"""
-        fileUploadDict = {}
+            with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+                contentHashes = dict(zip(fileNames, executor.map(self.get_file_hash, fileNames)))
+                existingFiles, changedFiles = self.get_changed_files(assistantId, fileNames, contentHashes)
+                summary['unchanged'] = len(fileNames) - len(changedFiles)
+
+                filesByHash = self.group_files_by_hash(changedFiles, contentHashes)
+                uploadFutures = {executor.submit(self.upload_file_by_hash, hashFiles[0], contentHash, filePurpose): contentHash for contentHash, hashFiles in filesByHash.items()}
+                uploadedFiles = {}
+
+                with tqdm(total=len(changedFiles), desc='Uploading files', unit='file', disable=not showProgress) as progressBar:
+                    for future in as_completed(uploadFutures):
+                        hashFiles = filesByHash[uploadFutures[future]]
+
+                        try:
+                            self.add_upload_result(uploadedFiles, summary, hashFiles, future.result())
+                        except Exception as e:
+                            summary['failed'] += len(hashFiles)
+                            print('Failure! Could not upload file ' + ', '.join(hashFiles) + ', full error message: ' + str(e))
+
+                        progressBar.update(len(hashFiles))
+
+            if uploadedFiles:
+                self.attach_files_to_assistant(assistantId, uploadedFiles, existingFiles, contentHashes, fileWriteMode, messageIndent)
+
+            print(f"Success! Files synced to assistant: {summary['uploaded']} uploaded, {summary['reused']} reused, {summary['unchanged']} unchanged, {summary['failed']} failed")
+        except Exception as e:
+            print('Failure! Could not sync files to assistant, full error message: ' + str(e))
+
+        return summary
+
+    def attach_files_to_assistant(self, assistantId, uploadedFiles, existingFiles, contentHashes, fileWriteMode='w', messageIndent=0):
+        """Function to attach uploaded files to an assistant with a single update, replacing older versions of the same file names, and record them in the config"""
+        assistantResponse, retrieveRetryCount = self.call_with_retry(self.client.beta.assistants.retrieve, assistant_id=assistantId)
+
+        assistantResponse, updateRetryCount = self.call_with_retry(self.client.beta.assistants.update, assistant_id=assistantId, file_ids=self.get_assistant_file_ids(assistantResponse.file_ids, uploadedFiles, existingFiles))
+
+        self.save_assistant_files(assistantId, uploadedFiles, existingFiles, contentHashes, retrieveRetryCount + updateRetryCount, fileWriteMode, messageIndent)
 
-        with open(f'./src/{self.applicationName}/data/{fileName}', mode=fileReadMode) as fileToUpload:
-            try:
-                uploadResponse = self.files.create(
-                    file=fileToUpload,
-                    purpose=filePurpose
-                )
-            
-                print('Succcess! File uploaded.')
-            except Exception as e:
-                print('Failure! Could not upload file, full error message: ' + str(e))
-            else:
-                try:
-                    fileToAssistantResponse = self.beta.assistants.files.create(
-                        assistant_id = assistantId,
-                        file_id = uploadResponse.id
-                    )
-                
-                    print('Succcess! File id associated with assistant: ' + str(fileToAssistantResponse.id))
-
-                    fileUploadDict['id'] = fileToAssistantResponse.id
-                    fileUploadDict['assistant_id'] = fileToAssistantResponse.assistant_id
-                    fileUploadDict['created_at'] = fileToAssistantResponse.created_at
-                    fileUploadDict['original_file_name'] = fileName
-
-                    makedirs(path.dirname(f'./src/{self.applicationName}/config/'), exist_ok=True)
-        
-                    with open(f'./src/{self.applicationName}/config/{fileToAssistantResponse.id}_{fileName}_{fileToAssistantResponse.assistant_id}.json', fileWriteMode, encoding='utf-8') as outputFile:
-                        dump(fileUploadDict, outputFile, ensure_ascii=False, indent=messageIndent)
-                
-                except Exception as e:
-                    print('Failure! Could not associate uploaded file to assistant, full error message: ' + str(e))
-            
-    def check_for_existing_assistant_file_id_from_config(self, assistantId, fileName):
-        """Function to review the previously generated file upload json configurations to return the ID associated"""
-        configFiles = listdir(f'./src/{self.applicationName}/config/')
-        assistantFiles = []
-
-        for file in configFiles:
-            if file.startswith('file') and file.endswith(f'{assistantId}.json'):
-                assistantFiles.append(file)
-
-        for file in assistantFiles:
-            with open(f'./src/{self.applicationName}/config/{file}', 'r') as data:
-                config = load(data)
-                name = config['original_file_name']
-            
-                if name == fileName:
-                    fileId = config['id']
-                    print('Found file associated with id: ' + config['id'])
-    
-        return fileId
-    
     def create_assistant_thread(self, assistantId, userId, metadata = {}, mode='w', messageIndent=0):
         """Function to directly create a thread and associate with an assistant at OpenAI"""
         try:
-            threadDict = {}
-            threadResponse = self.beta.threads.create(
+            threadResponse, retryCount = self.call_with_retry(
+                self.client.beta.threads.create,
                 metadata=metadata
             )
 
-            threadDict['id'] = threadResponse.id
-            threadDict['created_at'] = threadResponse.created_at
-            threadDict['assistant_id'] = assistantId
-            threadDict['user_id'] = userId
+            threadDict = self.format_thread_response(threadResponse, assistantId, userId, retryCount)
+            configFileName = f'{threadResponse.id}_{threadResponse.created_at}_{assistantId}.json'
 
-            makedirs(path.dirname(f'./src/{self.applicationName}/config/'), exist_ok=True)
-            
-            with open(f'./src/{self.applicationName}/config/{threadResponse.id}_{threadResponse.created_at}_{assistantId}.json', mode, encoding='utf-8') as outputFile:
-                dump(threadDict, outputFile, ensure_ascii=False, indent=messageIndent)
+            self.write_json_file('config', configFileName, threadDict, mode, messageIndent)
+            self.configIndex.add_thread(threadDict, configFileName)
             print('Success! Thread successfully created and saved to config file with id: ' + str(threadResponse.id))
 
+            return threadResponse.id
+
         except Exception as e:
             print('Failure! Thread failed to create, full response: ' + str(e))
 
-
-    def get_thread_id_for_user(self, assistantId, userId):
-        """Function to review the previously generated thread json file configurations to return the ID associated"""
-        configFiles = listdir(f'./src/{self.applicationName}/config/')
-        threadFiles = []
-
-        for file in configFiles:
-            if file.startswith('thread') and file.endswith(f'{assistantId}.json'):
-                threadFiles.append(file)
-    
-        for file in threadFiles:
-            with open(f'./src/{self.applicationName}/config/{file}', 'r') as data:
-                config = load(data)
-                threadId = config['id']
-                userId = config['user_id']
-
-            if userId == userId:
-                userSpecificFileId = threadId
-                print('Found existing thread for assistant and user with id: ' + str(userSpecificFileId))
-            
-        try:
-            return userSpecificFileId
-        except UnboundLocalError:
-            raise Exception('Error: Thread does not exist for assistant and user ID.  Please check the assistant ID, application name, and user ID or call the create thread function.')
-        
     def add_message_in_existing_thread(self, threadId, message, fileListToInclude, userId, metadata={}, mode='w', messageIndent=0):
         try:
-            messageResponseDict = {}
-
-            messageResponse = self.beta.threads.messages.create(
+            messageResponse, retryCount = self.call_with_retry(
+                self.client.beta.threads.messages.create,
                 thread_id = threadId,
                 role = 'user',
                 content = message,
@@ -205,27 +446,40 @@ class OpenAIPythonIntegration(OpenAI):
                 metadata=metadata
             )
 
-            messageResponseDict['id'] = messageResponse.id
-            messageResponseDict['created_at'] = messageResponse.created_at
-            messageResponseDict['thread_id'] = messageResponse.thread_id
-            messageResponseDict['run_id'] = messageResponse.run_id
-            messageResponseDict['user_id'] = userId
-            messageResponseDict['user'] = messageResponse.role
-            messageResponseDict['response_type'] = messageResponse.content[0].type
-            messageResponseDict['response_text'] = messageResponse.content[0].text.value
-
-            makedirs(path.dirname(f'./src/{self.applicationName}/data/chat_messages/'), exist_ok=True)
-
-            with open(f'./src/{self.applicationName}/data/chat_messages/{userId}_{messageResponse.role}_{messageResponse.id}_{messageResponse.created_at}_{messageResponse.run_id}.json', mode, encoding='utf-8') as outputFile:
-                dump(messageResponseDict, outputFile, ensure_ascii=False, indent=messageIndent)
+            messageResponseDict = self.format_message_response(messageResponse, messageResponse.content[0], userId, retryCount)
+            self.write_records('data/chat_messages', [(self.get_message_file_name(messageResponse, userId), messageResponseDict)], mode, messageIndent)
 
             print('Success! Message added to thread, full response: ' + str(messageResponse))
+
+            return messageResponseDict
         except Exception as e:
             print('Failure! Message not added to thread, full response: ' + str(e))
 
-    def run_thread_for_assistant_response(self, threadId, assistantId, userId, metadata={}, mode='w', messageIndent=0, runProcessingStatus='in_progress', maxRetries=5, retryWaitTimeSeconds=3):
+    def wait_for_run_completion(self, threadId, runId, initialPollIntervalSeconds=0.25, maxPollIntervalSeconds=3, pollBackoffMultiplier=1.5, runDeadlineSeconds=300):
+        """Function to poll a run with a short first interval that backs off until the run leaves the queued/in progress states or the deadline passes, returning the last run response and the retries used"""
+        deadline = monotonic() + runDeadlineSeconds
+        pollIntervalSeconds = initialPollIntervalSeconds
+        totalRetryCount = 0
+
+        while True:
+            sleep(max(0.0, min(pollIntervalSeconds, deadline - monotonic())))
+
+            runResponse, retryCount = self.call_with_retry(
+                self.client.beta.threads.runs.retrieve,
+                thread_id = threadId,
+                run_id = runId
+            )
+            totalRetryCount += retryCount
+
+            if runResponse.status not in RUN_PENDING_STATUSES or monotonic() >= deadline:
+                return runResponse, totalRetryCount
+
+            pollIntervalSeconds = min(maxPollIntervalSeconds, pollIntervalSeconds * pollBackoffMultiplier)
+
+    def run_thread_for_assistant_response(self, threadId, assistantId, userId, metadata={}, mode='w', messageIndent=0, initialPollIntervalSeconds=0.25, maxPollIntervalSeconds=3, pollBackoffMultiplier=1.5, runDeadlineSeconds=300):
         try:
-            createRunResponse = self.beta.threads.runs.create(
+            createRunResponse, runRetryCount = self.call_with_retry(
+                self.client.beta.threads.runs.create,
                 thread_id = threadId,
                 assistant_id = assistantId,
                 metadata=metadata
@@ -234,93 +488,128 @@ class OpenAIPythonIntegration(OpenAI):
             print('Failure! Could not run thread, full response: ' + str(e))
         else:
             try:
-                runResponseDict = {}
-                tryCount = 1
-                
-                while runProcessingStatus == 'in_progress' and tryCount <= maxRetries:
-                    runResponse = self.beta.threads.runs.retrieve(
-                        thread_id = threadId,
-                        run_id = createRunResponse.id
-                    )
-
-                    runProcessingStatus = runResponse.status
-                    tryCount += 1
-                    sleep(retryWaitTimeSeconds)
-
-                if runProcessingStatus == 'in_progress':
-                    print('Failure! Run not completed within max retry limit.  Please try again later.')
+                runResponse, retryCount = self.wait_for_run_completion(threadId, createRunResponse.id, initialPollIntervalSeconds, maxPollIntervalSeconds, pollBackoffMultiplier, runDeadlineSeconds)
+
+                if runResponse.status in RUN_PENDING_STATUSES:
+                    print('Failure! Run not completed before the deadline.  Please try again later.')
                 else:
-                    runResponseDict['id'] = runResponse.id
-                    runResponseDict['assistant_id'] = runResponse.assistant_id
-                    runResponseDict['thread_id'] = runResponse.thread_id
-                    runResponseDict['user_id'] = userId
-                    runResponseDict['status'] = runResponse.status
-                    runResponseDict['created_at'] = runResponse.created_at
-                    runResponseDict['started_at'] = runResponse.started_at
-                    runResponseDict['completed_at'] = runResponse.completed_at
-                    runResponseDict['expires_at'] = runResponse.expires_at
-                    runResponseDict['failed_at'] = runResponse.failed_at
-                    runResponseDict['error_message'] = runResponse.last_error
-
-                    makedirs(path.dirname(f'./src/{self.applicationName}/data/run_logs/'), exist_ok=True)
-            
-                    with open(f'./src/{self.applicationName}/data/run_logs/{runResponse.id}_{runResponse.created_at}_{runResponse.thread_id}.json', mode, encoding='utf-8') as outputFile:
-                        dump(runResponseDict, outputFile, ensure_ascii=False, indent=messageIndent)
+                    runResponseDict = self.format_run_response(runResponse, userId, runRetryCount + retryCount)
+                    self.write_records('data/run_logs', [(self.get_run_log_file_name(runResponse), runResponseDict)], mode, messageIndent)
+
+                    return runResponseDict
             
             except Exception as e:
                 print('Failure! Could not retrieve run thread, full response: ' + str(e))
 
-
     def get_latest_assistant_message_in_existing_thread(self, threadId, userId, assistantRoleName = 'assistant', mode='w', messageIndent=0):
         try:
-            threadMessageResponse = self.beta.threads.messages.list(thread_id = threadId)
+            threadMessageResponse, retryCount = self.call_with_retry(self.client.beta.threads.messages.list, thread_id = threadId)
             latestMessage = threadMessageResponse.data[0]
 
             if latestMessage.role == assistantRoleName:
-                for response in latestMessage.content:
-                    messageResponseDict = {}
-                    
-                    messageResponseDict['id'] = latestMessage.id
-                    messageResponseDict['created_at'] = latestMessage.created_at
-                    messageResponseDict['thread_id'] = latestMessage.thread_id
-                    messageResponseDict['run_id'] = latestMessage.run_id
-                    messageResponseDict['user_id'] = userId
-                    messageResponseDict['user'] = latestMessage.role
-                    messageResponseDict['response_type'] = response.type
-                    messageResponseDict['response_text'] = response.text.value
-
-                    makedirs(path.dirname(f'./src/{self.applicationName}/data/chat_messages/'), exist_ok=True)
-        
-                    with open(f'./src/{self.applicationName}/data/chat_messages/{userId}_{latestMessage.role}_{latestMessage.id}_{latestMessage.created_at}_{latestMessage.run_id}.json', mode, encoding='utf-8') as outputFile:
-                        dump(messageResponseDict, outputFile, ensure_ascii=False, indent=messageIndent)
+                messageRecords = self.format_message_records([latestMessage], userId, retryCount)
+                self.write_records('data/chat_messages', messageRecords, mode, messageIndent)
+
+                return [messageResponseDict for fileName, messageResponseDict in messageRecords]
             else:
                 print('Failure! Latest message is not an assistant response.  Please re-run the function to run the assistant thread and try again.')
         except Exception as e:
             print('Failure! Could not retrieve thread messages, full response: ' + str(e))
 
-    def get_all_messages_in_existing_thread(self, threadId, userId, mode='w', messageIndent=0):
+    def get_all_messages_in_existing_thread(self, threadId, userId, mode='w', messageIndent=0, pageSize=100, fullResync=False):
+        """Function to save every message in a thread newer than the last sync, paging through the message list with after cursors"""
         try:
-            threadMessageResponse = self.beta.threads.messages.list(thread_id = threadId)
-            latestMessage = threadMessageResponse.data
-
-            for message in latestMessage:
-                for response in message.content:
-                    messageResponseDict = {}
-
-                    messageResponseDict['id'] = message.id
-                    messageResponseDict['created_at'] = message.created_at
-                    messageResponseDict['thread_id'] = message.thread_id
-                    messageResponseDict['run_id'] = message.run_id
-                    messageResponseDict['user_id'] = userId
-                    messageResponseDict['user'] = message.role
-                    messageResponseDict['response_type'] = response.type
-                    messageResponseDict['response_text'] = response.text.value
-
-                    makedirs(path.dirname(f'./src/{self.applicationName}/data/chat_messages/'), exist_ok=True)
-        
-                    with open(f'./src/{self.applicationName}/data/chat_messages/{userId}_{message.role}_{message.id}_{message.created_at}_{message.run_id}.json', mode, encoding='utf-8') as outputFile:
-                        dump(messageResponseDict, outputFile, ensure_ascii=False, indent=messageIndent)
-            
-            print('Success! All thread messages retrieved and saved')
+            if fullResync:
+                self.configIndex.clear_thread_sync_state(threadId)
+
+            syncState = self.configIndex.get_thread_sync_state(threadId)
+            afterMessageId = syncState['last_message_id'] if syncState else None
+            newMessages = 0
+
+            while True:
+                messagePage, retryCount = self.call_with_retry(self.client.beta.threads.messages.list, **self.get_message_page_parameters(threadId, afterMessageId, pageSize))
+
+                if messagePage.data:
+                    afterMessageId = self.save_message_page(threadId, userId, messagePage.data, retryCount, mode, messageIndent)
+                    newMessages += len(messagePage.data)
+
+                if not self.has_more_messages(messagePage, pageSize):
+                    break
+
+            print(f'Success! {newMessages} new thread messages retrieved and saved')
+
+            return newMessages
         except Exception as e:
             print('Failure! Could not retrieve thread messages, full response: ' + str(e))
+
+    def get_or_create_thread_for_user(self, assistantId, userId, metadata={}):
+        """Function to look up a user's thread for an assistant, creating it the first time the user is seen"""
+        try:
+            return self.get_thread_id_for_user(assistantId, userId)
+        except Exception:
+            return self.create_assistant_thread(assistantId, userId, metadata={**metadata, 'assistantId': assistantId, 'userId': str(userId)})
+
+    def run_user_job(self, assistantId, threadId, userId, message, fileListToInclude, metadata, pollingOptions):
+        """Function to run one message for a user: add it to the thread, run the assistant and fetch the reply, traced as one assistant run"""
+        jobResult = {'user_id': userId, 'thread_id': threadId, 'message': message, 'status': 'failed', 'run': None, 'responses': []}
+
+        with self.metrics.trace('assistant_run', user_id=userId, thread_id=threadId) as traceRecord:
+            if threadId is None:
+                jobResult['error_message'] = 'Thread could not be found or created'
+            else:
+                with self.metrics.step(traceRecord, 'add_message'):
+                    messageAdded = self.add_message_in_existing_thread(threadId, message, fileListToInclude, userId, metadata) is not None
+
+                if not messageAdded:
+                    jobResult['error_message'] = 'Message could not be added to thread'
+                else:
+                    with self.metrics.step(traceRecord, 'run'):
+                        jobResult['run'] = self.run_thread_for_assistant_response(threadId, assistantId, userId, metadata, **pollingOptions)
+
+                    if jobResult['run'] is None:
+                        jobResult['error_message'] = 'Run did not finish'
+                    else:
+                        jobResult['status'] = jobResult['run']['status']
+
+                        if jobResult['status'] == 'completed':
+                            with self.metrics.step(traceRecord, 'fetch_reply'):
+                                jobResult['responses'] = self.get_latest_assistant_message_in_existing_thread(threadId, userId) or []
+
+            traceRecord['status'] = jobResult['status']
+
+        return jobResult
+
+    def run_jobs_for_user(self, assistantId, userId, messages, fileListToInclude, metadata, pollingOptions, resultQueue):
+        """Function to work through one user's messages in order on their thread, since a thread only allows one active run"""
+        try:
+            threadId = self.get_or_create_thread_for_user(assistantId, userId, metadata)
+
+            for message in messages:
+                resultQueue.put(self.run_user_job(assistantId, threadId, userId, message, fileListToInclude, metadata, pollingOptions))
+        except Exception as e:
+            print('Failure! Could not finish jobs for user ' + str(userId) + ', full response: ' + str(e))
+        finally:
+            resultQueue.put(None) #Marks this user as finished
+
+    def run_user_jobs(self, assistantId, jobs, maxConcurrentThreads=8, fileListToInclude=[], metadata={}, **pollingOptions):
+        """Function to run a queue of (userId, message) jobs against one assistant, keeping each user's messages in order while different users' threads run concurrently, and yielding each result as it finishes"""
+        messagesByUser = {}
+        for userId, message in jobs:
+            messagesByUser.setdefault(userId, []).append(message)
+
+        resultQueue = Queue()
+
+        with ThreadPoolExecutor(max_workers=maxConcurrentThreads) as executor:
+            for userId, messages in messagesByUser.items():
+                executor.submit(self.run_jobs_for_user, assistantId, userId, messages, fileListToInclude, metadata, pollingOptions, resultQueue)
+
+            finishedUsers = 0
+            while finishedUsers < len(messagesByUser):
+                jobResult = resultQueue.get()
+
+                if jobResult is None:
+                    finishedUsers += 1
+                else:
+                    yield jobResult
+
+        self.outputSink.flush()
@@ -0,0 +1,133 @@
+from re import findall
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket():
+    """Custom class to track a budget that refills continuously up to its capacity every minute"""
+    def __init__(self, capacityPerMinute):
+        self.capacity = float(capacityPerMinute)
+        self.available = float(capacityPerMinute)
+        self.lastRefill = monotonic()
+        self.blockedUntil = 0.0
+
+    def refill(self, currentTime):
+        """Function to add back the budget earned since the last refill"""
+        elapsedSeconds = currentTime - self.lastRefill
+        self.available = min(self.capacity, self.available + elapsedSeconds * self.capacity / 60)
+        self.lastRefill = currentTime
+
+    def get_wait_seconds(self, amount, currentTime):
+        """Function to get how long until the bucket can cover the amount requested (0 if it can now)"""
+        amount = min(amount, self.capacity) #Anything larger than the whole budget is let through once the bucket is full
+        waitSeconds = max(0.0, self.blockedUntil - currentTime)
+
+        if self.available < amount:
+            waitSeconds = max(waitSeconds, (amount - self.available) * 60 / self.capacity)
+
+        return waitSeconds
+
+
+class RateLimiter():
+    """Custom class to delay calls so each model stays under its requests-per-minute and tokens-per-minute limits"""
+    def __init__(self, modelLimits = {}):
+        self.requestBuckets = {}
+        self.tokenBuckets = {}
+        self.lock = Lock()
+
+        for modelName, limits in modelLimits.items():
+            self.set_model_limits(modelName, limits.get('requests_per_minute'), limits.get('tokens_per_minute'))
+
+    def set_model_limits(self, modelName, requestsPerMinute, tokensPerMinute):
+        """Function to create or resize the buckets for a model"""
+        for buckets, limit in ((self.requestBuckets, requestsPerMinute), (self.tokenBuckets, tokensPerMinute)):
+            if not limit:
+                continue
+
+            if modelName in buckets:
+                bucket = buckets[modelName]
+                bucket.available = min(bucket.available, float(limit))
+                bucket.capacity = float(limit)
+            else:
+                buckets[modelName] = TokenBucket(limit)
+
+    def acquire(self, modelName, numTokens):
+        """Function to block until the model has budget for one request using numTokens, then charge it and return the seconds waited and the tokens actually charged"""
+        totalWaitSeconds = 0.0
+
+        while True:
+            with self.lock:
+                currentTime = monotonic()
+                requestBucket = self.requestBuckets.get(modelName)
+                tokenBucket = self.tokenBuckets.get(modelName)
+                waitSeconds = 0.0
+
+                for bucket, amount in ((requestBucket, 1), (tokenBucket, numTokens)):
+                    if bucket is not None:
+                        bucket.refill(currentTime)
+                        waitSeconds = max(waitSeconds, bucket.get_wait_seconds(amount, currentTime))
+
+                if waitSeconds == 0:
+                    chargedTokens = 0
+
+                    if requestBucket is not None:
+                        requestBucket.available -= 1
+                    if tokenBucket is not None:
+                        chargedTokens = min(numTokens, tokenBucket.capacity)
+                        tokenBucket.available -= chargedTokens
+
+                    return totalWaitSeconds, chargedTokens
+
+            sleep(waitSeconds)
+            totalWaitSeconds += waitSeconds
+
+    def settle(self, modelName, chargedTokens, actualTokens):
+        """Function to correct the token budget once the real usage of a call is known, refunding at most the tokens acquire charged"""
+        with self.lock:
+            tokenBucket = self.tokenBuckets.get(modelName)
+
+            if tokenBucket is not None:
+                tokenBucket.available = min(tokenBucket.capacity, tokenBucket.available + chargedTokens - max(0, actualTokens))
+
+    def update_from_headers(self, modelName, headers):
+        """Function to sync the buckets with the x-ratelimit-* headers OpenAI returns on each response"""
+        limitRequests = self.parse_number(headers.get('x-ratelimit-limit-requests'))
+        limitTokens = self.parse_number(headers.get('x-ratelimit-limit-tokens'))
+
+        with self.lock:
+            self.set_model_limits(modelName, limitRequests, limitTokens)
+            currentTime = monotonic()
+
+            for buckets, remainingHeader, resetHeader in ((self.requestBuckets, 'x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests'), (self.tokenBuckets, 'x-ratelimit-remaining-tokens', 'x-ratelimit-reset-tokens')):
+                bucket = buckets.get(modelName)
+                remaining = self.parse_number(headers.get(remainingHeader))
+
+                if bucket is None or remaining is None:
+                    continue
+
+                bucket.refill(currentTime)
+                bucket.available = min(bucket.available, remaining) #The server count also includes calls from other processes on the same key
+
+                resetSeconds = self.parse_duration_seconds(headers.get(resetHeader))
+                if remaining <= 0 and resetSeconds is not None:
+                    bucket.blockedUntil = max(bucket.blockedUntil, currentTime + resetSeconds)
+
+    def parse_number(self, value):
+        """Function to read a numeric header value, returning None when missing or invalid"""
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def parse_duration_seconds(self, value):
+        """Function to convert OpenAI reset durations such as 20ms, 1.5s or 6m0s to seconds"""
+        if not value:
+            return None
+
+        unitSeconds = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+        parts = findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)', value)
+
+        if not parts:
+            return self.parse_number(value)
+
+        return sum(float(amount) * unitSeconds[unit] for amount, unit in parts)
@@ -0,0 +1,374 @@
+from os import makedirs, path, scandir
+from json import load, loads
+from sqlite3 import connect, OperationalError
+from threading import Lock
+from caller.output_sink import JSONFileSink, JSONLSink, SQLiteSink, ParquetSink
+
+RECORD_FOLDERS = ('chat_messages', 'run_logs')
+SEGMENT_EXTENSIONS = ('.jsonl', '.parquet')
+RECORD_COLUMNS = ('record_id', 'user_id', 'thread_id', 'run_id', 'assistant_id', 'conversation_id', 'model', 'role', 'status', 'created_at', 'started_at', 'completed_at', 'prompt_tokens', 'completion_tokens', 'total_tokens')
+FILTER_COLUMNS = {'userId': 'user_id', 'threadId': 'thread_id', 'runId': 'run_id', 'assistantId': 'assistant_id', 'conversationId': 'conversation_id', 'model': 'model', 'role': 'role', 'status': 'status'}
+
+
+class RecordIndex():
+    """Custom class to keep a SQLite index over the saved chat_messages and run_logs records, whether the output sink wrote them as JSON files, JSONL or Parquet segments or SQLite rows, reading only what was added or changed since the last refresh, so records can be filtered and totalled without opening every file"""
+    def __init__(self, dataFolder, costPerThousandTokens={}, indexFileName='record_index.sqlite', outputSink=None):
+        self.dataFolder = dataFolder
+        self.costPerThousandTokens = costPerThousandTokens
+        self.indexFileName = f'{dataFolder}{indexFileName}'
+        self.outputSink = outputSink
+        self.sinkDatabaseFileName = outputSink.databaseFileName if isinstance(outputSink, SQLiteSink) else None
+        self.connection = None
+        self.lock = Lock()
+        self.readsOutputSink = outputSink is None or isinstance(outputSink, (JSONFileSink, JSONLSink, SQLiteSink, ParquetSink))
+
+        if not self.readsOutputSink:
+            print(f'Error: Records written by {type(outputSink).__name__} cannot be indexed, only the json, jsonl, sqlite and parquet sinks are.  Record queries and conversation history will not include them.')
+
+    def get_connection(self):
+        """Function to open the index on first use, creating its table if needed"""
+        if self.connection is None:
+            makedirs(path.dirname(self.dataFolder), exist_ok=True)
+
+            self.connection = connect(self.indexFileName, check_same_thread=False)
+            self.connection.executescript(f"""
+                CREATE TABLE IF NOT EXISTS records (file_name TEXT PRIMARY KEY, folder TEXT NOT NULL, modified_ns INTEGER NOT NULL, size INTEGER NOT NULL, {', '.join(f'{column} {"INTEGER" if column.endswith(("_at", "_tokens")) else "TEXT"}' for column in RECORD_COLUMNS)});
+                CREATE INDEX IF NOT EXISTS records_user_id ON records (user_id, created_at);
+                CREATE INDEX IF NOT EXISTS records_thread_id ON records (thread_id, created_at);
+                CREATE INDEX IF NOT EXISTS records_run_id ON records (run_id);
+                CREATE INDEX IF NOT EXISTS records_model ON records (model, created_at);
+                CREATE INDEX IF NOT EXISTS records_created_at ON records (folder, created_at);
+                CREATE TABLE IF NOT EXISTS sources (source_name TEXT PRIMARY KEY, folder TEXT NOT NULL, read_position INTEGER NOT NULL, modified_ns INTEGER, size INTEGER);
+            """)
+
+            if 'source_name' not in [row[1] for row in self.connection.execute('PRAGMA table_info(records)')]: #Indexes created when only JSON files were indexed
+                self.connection.execute('ALTER TABLE records ADD COLUMN source_name TEXT')
+
+            self.connection.execute('CREATE INDEX IF NOT EXISTS records_source_name ON records (source_name)')
+
+        return self.connection
+
+    def get_record_values(self, record):
+        """Function to pull the indexed fields out of a chat response, thread message or run log record"""
+        userId = record.get('user_id')
+
+        return (
+            record.get('id'),
+            str(userId) if userId is not None else None,
+            record.get('thread_id'),
+            record.get('run_id'),
+            record.get('assistant_id'),
+            record.get('conversation_id'),
+            record.get('model'),
+            record.get('user'), #Thread messages keep the role under user
+            record.get('status'),
+            record.get('created_at', record.get('date_time_unix')),
+            record.get('started_at'),
+            record.get('completed_at'),
+            record.get('prompt_tokens'),
+            record.get('completion_tokens'),
+            record.get('total_tokens')
+        )
+
+    def write_record(self, connection, fileName, sourceName, folderName, modifiedNs, size, record):
+        """Function to upsert one record's indexed fields, the caller commits"""
+        connection.execute(f"INSERT OR REPLACE INTO records (file_name, source_name, folder, modified_ns, size, {', '.join(RECORD_COLUMNS)}) VALUES ({', '.join('?' * (len(RECORD_COLUMNS) + 5))})", (fileName, sourceName, folderName, modifiedNs, size, *self.get_record_values(record)))
+
+    def save_source_position(self, connection, sourceName, folderName, readPosition, modifiedNs=None, size=None):
+        """Function to remember how far into a segment file or SQLite table the index has read, the caller commits"""
+        connection.execute('INSERT OR REPLACE INTO sources (source_name, folder, read_position, modified_ns, size) VALUES (?, ?, ?, ?, ?)', (sourceName, folderName, readPosition, modifiedNs, size))
+
+    def drop_source(self, connection, sourceName):
+        """Function to remove a segment file or table and its records from the index, the caller commits"""
+        connection.execute('DELETE FROM records WHERE source_name = ?', (sourceName,))
+        connection.execute('DELETE FROM sources WHERE source_name = ?', (sourceName,))
+
+    def index_json_file(self, connection, folderName, entry, indexedFiles):
+        """Function to index a record saved as its own JSON file unless it is unchanged since the last refresh, returning the number of records read"""
+        fileName = f'{folderName}/{entry.name}'
+        fileStats = entry.stat()
+
+        if indexedFiles.pop(fileName, None) == (fileStats.st_mtime_ns, fileStats.st_size):
+            return 0
+
+        try:
+            with open(entry.path, 'r', encoding='utf-8') as data:
+                record = load(data)
+        except ValueError as e: #A file still being written, it is picked up on a later refresh
+            print(f'Error: Could not read record file {fileName}. Full message: {e}')
+            return 0
+
+        self.write_record(connection, fileName, fileName, folderName, fileStats.st_mtime_ns, fileStats.st_size, record)
+
+        return 1
+
+    def index_jsonl_segment(self, connection, folderName, entry, sourcePositions):
+        """Function to index the lines appended to a JSONL segment since the last refresh, keyed by their byte offset, returning the number of records read"""
+        sourceName = f'{folderName}/{entry.name}'
+        fileStats = entry.stat()
+        readPosition, modifiedNs, size = sourcePositions.get(sourceName, (0, None, None))
+
+        if (modifiedNs, size) == (fileStats.st_mtime_ns, fileStats.st_size):
+            return 0
+
+        if fileStats.st_size < readPosition: #Rewritten rather than appended to, start over
+            self.drop_source(connection, sourceName)
+            readPosition = 0
+
+        recordsRead = 0
+
+        with open(entry.path, 'rb') as segmentFile:
+            segmentFile.seek(readPosition)
+
+            for line in segmentFile:
+                if not line.endswith(b'\n'): #The sink is still writing this line, it is picked up on a later refresh
+                    break
+
+                lineOffset = readPosition
+                readPosition += len(line)
+
+                if not line.strip():
+                    continue
+
+                try:
+                    record = loads(line)
+                except ValueError as e:
+                    print(f'Error: Could not read record line {lineOffset} of {sourceName}. Full message: {e}')
+                    continue
+
+                self.write_record(connection, f'{sourceName}#{lineOffset}', sourceName, folderName, 0, 0, record)
+                recordsRead += 1
+
+        self.save_source_position(connection, sourceName, folderName, readPosition, fileStats.st_mtime_ns, fileStats.st_size)
+
+        return recordsRead
+
+    def index_parquet_segment(self, connection, folderName, entry, sourcePositions):
+        """Function to index a Parquet segment, keyed by row number, the first time it is seen, since the sink writes each segment whole, returning the number of records read"""
+        from pyarrow.parquet import read_table
+
+        sourceName = f'{folderName}/{entry.name}'
+        fileStats = entry.stat()
+
+        if sourcePositions.get(sourceName, (0, None, None))[1:] == (fileStats.st_mtime_ns, fileStats.st_size):
+            return 0
+
+        self.drop_source(connection, sourceName)
+        records = read_table(entry.path).to_pylist()
+
+        for rowNumber, record in enumerate(records):
+            self.write_record(connection, f'{sourceName}#{rowNumber}', sourceName, folderName, 0, 0, record)
+
+        self.save_source_position(connection, sourceName, folderName, len(records), fileStats.st_mtime_ns, fileStats.st_size)
+
+        return len(records)
+
+    def open_sink_database(self):
+        """Function to open the SQLite output sink's database read only, None when it has not been created yet"""
+        if self.sinkDatabaseFileName is None or not path.exists(self.sinkDatabaseFileName):
+            return None
+
+        return connect(f'file:{self.sinkDatabaseFileName}?mode=ro', uri=True, check_same_thread=False)
+
+    def index_sink_table(self, connection, sinkConnection, folderName, sourcePositions):
+        """Function to index the rows the SQLite output sink inserted into a folder's table since the last refresh, keyed by rowid, returning the number of records read, or None when the table does not exist yet"""
+        sourceName = f'sqlite:{folderName}'
+        readPosition = sourcePositions.get(sourceName, (0, None, None))[0]
+
+        try:
+            cursor = sinkConnection.execute(f'SELECT rowid, * FROM "{folderName}" WHERE rowid > ? ORDER BY rowid', (readPosition,))
+        except OperationalError: #Nothing has been written to this folder yet
+            return None
+
+        columnNames = [column[0] for column in cursor.description][1:]
+        recordsRead = 0
+
+        for rowId, *values in cursor:
+            self.write_record(connection, f'{sourceName}#{rowId}', sourceName, folderName, 0, 0, dict(zip(columnNames, values)))
+            readPosition = rowId
+            recordsRead += 1
+
+        self.save_source_position(connection, sourceName, folderName, readPosition)
+
+        return recordsRead
+
+    def refresh(self):
+        """Function to bring the index up to date, reading new and changed JSON files, the lines and rows appended to segment files or the SQLite sink, and dropping rows whose source was deleted, returning the number of records read"""
+        if self.outputSink is not None: #Buffered sinks hold recent records in memory until flushed
+            self.outputSink.flush()
+
+        with self.lock:
+            connection = self.get_connection()
+            indexedFiles = {fileName: (modifiedNs, size) for fileName, modifiedNs, size in connection.execute('SELECT file_name, modified_ns, size FROM records WHERE source_name IS NULL OR source_name = file_name')}
+            sourcePositions = {sourceName: (readPosition, modifiedNs, size) for sourceName, readPosition, modifiedNs, size in connection.execute('SELECT source_name, read_position, modified_ns, size FROM sources')}
+            seenSources = set()
+            recordsRead = 0
+
+            for folderName in RECORD_FOLDERS:
+                try:
+                    entries = list(scandir(f'{self.dataFolder}{folderName}'))
+                except FileNotFoundError:
+                    continue
+
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        recordsRead += self.index_json_file(connection, folderName, entry, indexedFiles)
+                    elif entry.name.endswith('.jsonl'):
+                        recordsRead += self.index_jsonl_segment(connection, folderName, entry, sourcePositions)
+                        seenSources.add(f'{folderName}/{entry.name}')
+                    elif entry.name.endswith('.parquet'):
+                        recordsRead += self.index_parquet_segment(connection, folderName, entry, sourcePositions)
+                        seenSources.add(f'{folderName}/{entry.name}')
+
+            sinkConnection = self.open_sink_database()
+
+            if sinkConnection is not None:
+                try:
+                    for folderName in RECORD_FOLDERS:
+                        tableRecordsRead = self.index_sink_table(connection, sinkConnection, folderName, sourcePositions)
+
+                        if tableRecordsRead is not None:
+                            recordsRead += tableRecordsRead
+                            seenSources.add(f'sqlite:{folderName}')
+                finally:
+                    sinkConnection.close()
+
+            connection.executemany('DELETE FROM records WHERE file_name = ?', [(fileName,) for fileName in indexedFiles])
+
+            for sourceName in set(sourcePositions) - seenSources:
+                self.drop_source(connection, sourceName)
+
+            connection.commit()
+
+            return recordsRead
+
+    def get_where_clause(self, folderName=None, createdAfter=None, createdBefore=None, **filters):
+        """Function to turn keyword filters (userId, threadId, runId, assistantId, conversationId, model, role, status and a created_at range in unix seconds) into a WHERE clause and its parameters"""
+        conditions = []
+        parameters = []
+
+        if folderName is not None:
+            conditions.append('folder = ?')
+            parameters.append(folderName)
+
+        for filterName, filterValue in filters.items():
+            if filterName not in FILTER_COLUMNS:
+                raise ValueError(f'Error: Unknown record filter {filterName}, expected one of {", ".join(FILTER_COLUMNS)}.')
+
+            conditions.append(f'{FILTER_COLUMNS[filterName]} = ?')
+            parameters.append(str(filterValue) if filterName == 'userId' else filterValue)
+
+        if createdAfter is not None:
+            conditions.append('created_at >= ?')
+            parameters.append(createdAfter)
+
+        if createdBefore is not None:
+            conditions.append('created_at < ?')
+            parameters.append(createdBefore)
+
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), parameters
+
+    def fetch_all(self, statement, parameters=(), refresh=True):
+        """Function to run a query against the index, refreshing it first so new files are included"""
+        if refresh:
+            self.refresh()
+
+        with self.lock:
+            return self.get_connection().execute(statement, parameters).fetchall()
+
+    def read_record(self, fileName, openSources):
+        """Function to load one indexed record from its JSON file, segment line or offset, Parquet row or SQLite sink row, keeping segment tables and the sink database open in openSources for the rest of the loop"""
+        sourceName, separator, position = fileName.rpartition('#')
+
+        if not separator or not (sourceName.startswith('sqlite:') or sourceName.endswith(SEGMENT_EXTENSIONS)):
+            with open(f'{self.dataFolder}{fileName}', 'r', encoding='utf-8') as data:
+                return load(data)
+
+        if sourceName.endswith('.jsonl'):
+            with open(f'{self.dataFolder}{sourceName}', 'rb') as segmentFile:
+                segmentFile.seek(int(position))
+                return loads(segmentFile.readline())
+
+        if sourceName.endswith('.parquet'):
+            if sourceName not in openSources:
+                from pyarrow.parquet import read_table
+
+                openSources[sourceName] = read_table(f'{self.dataFolder}{sourceName}').to_pylist()
+
+            return openSources[sourceName][int(position)]
+
+        if 'sqlite' not in openSources:
+            openSources['sqlite'] = self.open_sink_database()
+
+            if openSources['sqlite'] is None:
+                raise FileNotFoundError(self.sinkDatabaseFileName)
+
+        cursor = openSources['sqlite'].execute(f'SELECT * FROM "{sourceName[len("sqlite:"):]}" WHERE rowid = ?', (int(position),))
+        row = cursor.fetchone()
+
+        if row is None:
+            raise FileNotFoundError(fileName)
+
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def iter_records(self, folderName=None, refresh=True, **filters):
+        """Function to yield the matching records oldest first, reading each one only when the loop reaches it. Records from the SQLite sink hold nested values as JSON text"""
+        whereClause, parameters = self.get_where_clause(folderName, **filters)
+        openSources = {}
+
+        try:
+            for (fileName,) in self.fetch_all(f'SELECT file_name FROM records {whereClause} ORDER BY created_at, file_name', parameters, refresh):
+                try:
+                    yield self.read_record(fileName, openSources)
+                except FileNotFoundError: #Removed since the last refresh
+                    continue
+        finally:
+            if openSources.get('sqlite') is not None:
+                openSources['sqlite'].close()
+
+    def count_records(self, folderName=None, refresh=True, **filters):
+        """Function to count the matching records without opening any files"""
+        whereClause, parameters = self.get_where_clause(folderName, **filters)
+
+        return self.fetch_all(f'SELECT COUNT(*) FROM records {whereClause}', parameters, refresh)[0][0]
+
+    def get_group_column(self, groupBy):
+        """Function to check a group by name (a filter name or column) and return its column"""
+        groupColumn = FILTER_COLUMNS.get(groupBy, groupBy)
+
+        if groupColumn not in RECORD_COLUMNS and groupColumn != 'folder':
+            raise ValueError(f'Error: Cannot group records by {groupBy}.')
+
+        return groupColumn
+
+    def get_token_usage(self, groupBy='model', refresh=True, **filters):
+        """Function to total the prompt, completion and overall tokens of the matching chat responses by a column such as model or user_id, with their cost from the cost per 1k tokens"""
+        groupColumn = self.get_group_column(groupBy)
+        whereClause, parameters = self.get_where_clause('chat_messages', **filters)
+        rows = self.fetch_all(f'SELECT {groupColumn}, model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens) FROM records {whereClause} {"AND" if whereClause else "WHERE"} total_tokens IS NOT NULL GROUP BY {groupColumn}, model', parameters, refresh)
+        usage = {}
+
+        for groupValue, gptModel, responseCount, promptTokens, completionTokens, totalTokens in rows: #Grouped by model too, so each model is priced at its own rate
+            groupUsage = usage.setdefault(groupValue, {groupColumn: groupValue, 'responses': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'cost': 0.0})
+            groupUsage['responses'] += responseCount
+            groupUsage['prompt_tokens'] += promptTokens
+            groupUsage['completion_tokens'] += completionTokens
+            groupUsage['total_tokens'] += totalTokens
+            groupUsage['cost'] += totalTokens / 1000 * self.costPerThousandTokens.get(gptModel, 0)
+
+        return list(usage.values())
+
+    def get_run_durations(self, groupBy='assistant_id', refresh=True, **filters):
+        """Function to get the number of runs and their average and longest duration (completed_at minus started_at, in seconds) by a column such as assistant_id or user_id"""
+        groupColumn = self.get_group_column(groupBy)
+        whereClause, parameters = self.get_where_clause('run_logs', **filters)
+        rows = self.fetch_all(f'SELECT {groupColumn}, COUNT(*), AVG(completed_at - started_at), MAX(completed_at - started_at) FROM records {whereClause} {"AND" if whereClause else "WHERE"} started_at IS NOT NULL AND completed_at IS NOT NULL GROUP BY {groupColumn}', parameters, refresh)
+
+        return [{groupColumn: groupValue, 'runs': runCount, 'average_seconds': averageSeconds, 'max_seconds': maxSeconds} for groupValue, runCount, averageSeconds, maxSeconds in rows]
+
+    def close(self):
+        """Function to close the index connection"""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
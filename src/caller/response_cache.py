@@ -0,0 +1,148 @@
+from os import makedirs, path, listdir, remove, replace, fdopen
+from json import dump, load, dumps
+from hashlib import sha256
+from heapq import nsmallest
+from threading import Lock
+from time import time
+from tempfile import mkstemp
+
+
+class ChatResponseCache():
+    """Custom class to persist OpenAI responses locally, keyed by a hash of the request payload, so repeat requests skip the API"""
+    def __init__(self, cacheFolder, maxEntries=5000, maxAgeSeconds=None):
+        self.cacheFolder = cacheFolder
+        self.maxEntries = maxEntries
+        self.maxAgeSeconds = maxAgeSeconds
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.entries = None #cache key -> unix time written, loaded on first use
+        self.lock = Lock()
+
+    def get_cache_key(self, payload):
+        """Function to build a stable hash for a request payload regardless of key order"""
+        serializedPayload = dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+        return sha256(serializedPayload.encode('utf-8')).hexdigest()
+
+    def get_entry_file_name(self, cacheKey):
+        """Function to get the local file name for a cache key"""
+        return f'{self.cacheFolder}{cacheKey}.json'
+
+    def load_entries(self):
+        """Function to scan the cache folder once and keep the keys and write times in memory"""
+        self.entries = {}
+
+        if path.isdir(self.cacheFolder):
+            for file in listdir(self.cacheFolder):
+                if file.endswith('.json'):
+                    self.entries[file[:-5]] = path.getmtime(f'{self.cacheFolder}{file}')
+
+    def is_expired(self, writtenAt, currentTime):
+        """Function to check if an entry is older than the max age allowed"""
+        return self.maxAgeSeconds is not None and currentTime - writtenAt > self.maxAgeSeconds
+
+    def remove_entry(self, cacheKey):
+        """Function to drop an entry from memory and disk"""
+        self.entries.pop(cacheKey, None)
+
+        try:
+            remove(self.get_entry_file_name(cacheKey))
+        except FileNotFoundError:
+            pass
+
+        self.evictions += 1
+
+    def get(self, payload):
+        """Function to return the cached response for a payload, or None if it is missing or expired"""
+        cacheKey = self.get_cache_key(payload)
+
+        with self.lock:
+            if self.entries is None:
+                self.load_entries()
+
+            writtenAt = self.entries.get(cacheKey)
+
+            if writtenAt is None:
+                self.misses += 1
+                return None
+
+            if self.is_expired(writtenAt, time()):
+                self.remove_entry(cacheKey)
+                self.misses += 1
+                return None
+
+        try:
+            with open(self.get_entry_file_name(cacheKey), 'r', encoding='utf-8') as data:
+                cachedResponse = load(data)['response']
+        except (FileNotFoundError, ValueError, KeyError):
+            with self.lock:
+                self.entries.pop(cacheKey, None)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+
+        return cachedResponse
+
+    def set(self, payload, response):
+        """Function to save a response for a payload and evict old entries past the size or age limits"""
+        cacheKey = self.get_cache_key(payload)
+        fileName = self.get_entry_file_name(cacheKey)
+        writtenAt = time()
+
+        makedirs(path.dirname(self.cacheFolder), exist_ok=True)
+
+        fileDescriptor, temporaryFileName = mkstemp(suffix='.tmp', dir=path.dirname(self.cacheFolder)) #Each writer gets its own file, so identical requests finishing together never share one
+        with fdopen(fileDescriptor, 'w', encoding='utf-8') as outputFile:
+            dump({'written_at': writtenAt, 'payload': payload, 'response': response}, outputFile, ensure_ascii=False)
+
+        try:
+            replace(temporaryFileName, fileName)
+        except PermissionError: #Another writer is replacing the same entry (Windows), its copy is just as good
+            remove(temporaryFileName)
+
+        with self.lock:
+            if self.entries is None:
+                self.load_entries()
+
+            self.entries[cacheKey] = writtenAt
+            self.evict(writtenAt)
+
+    def evict(self, currentTime):
+        """Function to remove expired entries and then the oldest entries until under the max entry count"""
+        if self.maxAgeSeconds is not None:
+            for cacheKey, writtenAt in list(self.entries.items()):
+                if self.is_expired(writtenAt, currentTime):
+                    self.remove_entry(cacheKey)
+
+        overflowCount = len(self.entries) - self.maxEntries
+
+        if overflowCount > 0:
+            for cacheKey, writtenAt in nsmallest(overflowCount, self.entries.items(), key=lambda entry: entry[1]):
+                self.remove_entry(cacheKey)
+
+    def clear(self):
+        """Function to remove every cached entry"""
+        with self.lock:
+            if self.entries is None:
+                self.load_entries()
+
+            for cacheKey in list(self.entries):
+                self.remove_entry(cacheKey)
+
+    def get_stats(self):
+        """Function to return the hit/miss counters for the cache"""
+        with self.lock:
+            totalLookups = self.hits + self.misses
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries) if self.entries is not None else None,
+                'hit_rate': self.hits / totalLookups if totalLookups else 0.0
+            }
@@ -0,0 +1,100 @@
+from asyncio import sleep as asyncSleep
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from random import uniform
+from time import monotonic, sleep
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryableHTTPError(Exception):
+    """Custom error raised when OpenAI answers with a status code that is worth retrying (429 or 5xx)"""
+    def __init__(self, statusCode, responseJSON, retryAfterSeconds=None):
+        self.statusCode = statusCode
+        self.responseJSON = responseJSON
+        self.retryAfterSeconds = retryAfterSeconds
+
+        super().__init__(f'Error: OpenAI returned status {statusCode}. Full response: {responseJSON}')
+
+
+def parse_retry_after_seconds(headers):
+    """Function to read the Retry-After (or retry-after-ms) header as seconds, returning None when missing"""
+    if headers is None:
+        return None
+
+    retryAfterMilliseconds = headers.get('retry-after-ms')
+    if retryAfterMilliseconds is not None:
+        try:
+            return float(retryAfterMilliseconds) / 1000
+        except ValueError:
+            pass
+
+    retryAfter = headers.get('retry-after')
+    if retryAfter is None:
+        return None
+
+    try:
+        return float(retryAfter)
+    except ValueError:
+        try: #Retry-After can also be an HTTP date
+            return max(0.0, (parsedate_to_datetime(retryAfter) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+class RetryPolicy():
+    """Custom class to retry transient failures with exponential backoff, full jitter and an overall deadline per call"""
+    def __init__(self, maxRetries=5, baseDelaySeconds=0.5, maxDelaySeconds=30, deadlineSeconds=120):
+        self.maxRetries = maxRetries
+        self.baseDelaySeconds = baseDelaySeconds
+        self.maxDelaySeconds = maxDelaySeconds
+        self.deadlineSeconds = deadlineSeconds
+
+    def get_delay_seconds(self, retryNumber, retryAfterSeconds=None):
+        """Function to get the wait before the next attempt, never less than what the server asked for"""
+        backoffSeconds = uniform(0, min(self.maxDelaySeconds, self.baseDelaySeconds * 2 ** retryNumber))
+
+        if retryAfterSeconds is not None:
+            return max(backoffSeconds, retryAfterSeconds)
+
+        return backoffSeconds
+
+    def call(self, function, isRetryable, getRetryAfterSeconds=lambda error: getattr(error, 'retryAfterSeconds', None)):
+        """Function to run a call until it succeeds, fails with a non-retryable error, or runs out of retries or time, returning the result and the number of retries used"""
+        startTime = monotonic()
+        retryCount = 0
+
+        while True:
+            try:
+                return function(), retryCount
+            except Exception as e:
+                if not isRetryable(e) or retryCount >= self.maxRetries:
+                    raise
+
+                delaySeconds = self.get_delay_seconds(retryCount, getRetryAfterSeconds(e))
+
+                if self.deadlineSeconds is not None and monotonic() - startTime + delaySeconds > self.deadlineSeconds:
+                    raise
+
+                sleep(delaySeconds)
+                retryCount += 1
+
+    async def call_async(self, function, isRetryable, getRetryAfterSeconds=lambda error: getattr(error, 'retryAfterSeconds', None)):
+        """Function to await a coroutine function with the same retry rules as call, without blocking the event loop while waiting"""
+        startTime = monotonic()
+        retryCount = 0
+
+        while True:
+            try:
+                return await function(), retryCount
+            except Exception as e:
+                if not isRetryable(e) or retryCount >= self.maxRetries:
+                    raise
+
+                delaySeconds = self.get_delay_seconds(retryCount, getRetryAfterSeconds(e))
+
+                if self.deadlineSeconds is not None and monotonic() - startTime + delaySeconds > self.deadlineSeconds:
+                    raise
+
+                await asyncSleep(delaySeconds)
+                retryCount += 1
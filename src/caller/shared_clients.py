@@ -0,0 +1,49 @@
+from os import environ
+from threading import Lock
+from atexit import register
+
+sharedClients = {}
+sharedClientsLock = Lock()
+
+
+def read_credential(environmentVariableName, virtualEnvironmentName, fileName, credentialLabel):
+    """Function to read a credential from an environment variable, falling back to a key file in the virtual environment folder"""
+    if environ.get(environmentVariableName):
+        return environ[environmentVariableName].strip()
+
+    try:
+        with open(f'./{virtualEnvironmentName}/{fileName}', 'r', encoding='utf-8') as data:
+            return data.read().strip()
+    except FileNotFoundError as e:
+        print(f"Error: {credentialLabel} file not found and {environmentVariableName} is not set! Full message: ${e}")
+
+
+def get_shared_client(clientKey, create_client):
+    """Function to get the process-wide client stored under a key, creating it on first use and closing it when the process exits"""
+    with sharedClientsLock:
+        if clientKey not in sharedClients:
+            sharedClients[clientKey] = create_client()
+            register(sharedClients[clientKey].close)
+
+        return sharedClients[clientKey]
+
+
+def get_shared_http_client(poolSize=10, keepAlive=True, connectTimeoutSeconds=10, readTimeoutSeconds=120, useHTTP2=False):
+    """Function to get one pooled REST client per process and settings, so every OpenAIAPIIntegration in the process reuses the same warm connections"""
+    def create_client():
+        from caller.http_client import PooledHTTPClient
+
+        return PooledHTTPClient(poolSize=poolSize, keepAlive=keepAlive, connectTimeoutSeconds=connectTimeoutSeconds, readTimeoutSeconds=readTimeoutSeconds, useHTTP2=useHTTP2)
+
+    return get_shared_client(('rest', poolSize, keepAlive, connectTimeoutSeconds, readTimeoutSeconds, useHTTP2), create_client)
+
+
+def get_shared_sdk_http_client():
+    """Function to get one httpx client per process for the OpenAI SDK, so every OpenAIPythonIntegration shares its connection pool and TLS setup. It is kept apart from the REST pool because the SDK only accepts an httpx client, while the REST calls stay on the requests pool for its timed connections (connect_seconds in the metrics)"""
+    def create_client():
+        from httpx import Client
+        from openai._constants import DEFAULT_TIMEOUT, DEFAULT_LIMITS
+
+        return Client(timeout=DEFAULT_TIMEOUT, limits=DEFAULT_LIMITS, follow_redirects=True)
+
+    return get_shared_client(('sdk',), create_client)
@@ -0,0 +1,145 @@
+from os import makedirs, path
+from json import dumps, loads
+from hashlib import blake2b, sha256
+from random import Random
+from re import compile
+from threading import Lock
+from time import time
+
+MERSENNE_PRIME = (1 << 61) - 1
+PUNCTUATION = compile(r'[^\w\s]')
+WHITESPACE = compile(r'\s+')
+
+
+class SimilarPromptCache():
+    """Custom class to find saved answers to near-duplicate prompts (differing only by case, whitespace, punctuation or a few words) with a local MinHash/LSH index per model and system prompt"""
+    def __init__(self, cacheFolder, similarityThreshold=0.85, numPermutations=64, numBands=16, shingleSize=5):
+        if numPermutations % numBands:
+            raise ValueError('Error: numPermutations must be a multiple of numBands.')
+
+        self.cacheFolder = cacheFolder
+        self.similarityThreshold = similarityThreshold
+        self.numBands = numBands
+        self.rowsPerBand = numPermutations // numBands
+        self.shingleSize = shingleSize
+
+        seededRandom = Random(numPermutations) #Fixed seed, so signatures saved by earlier runs stay comparable
+        self.permutations = [(seededRandom.randrange(1, MERSENNE_PRIME), seededRandom.randrange(0, MERSENNE_PRIME)) for permutationNumber in range(numPermutations)]
+
+        self.hits = 0
+        self.misses = 0
+
+        self.indexes = {} #namespace -> entries and LSH buckets, each loaded from disk on first use
+        self.lock = Lock()
+
+    def get_namespace(self, gptModel, systemPrompt):
+        """Function to get the index name for a model and system prompt, answers are only reused within the same pair"""
+        return sha256(dumps([gptModel, systemPrompt], ensure_ascii=False).encode('utf-8')).hexdigest()[:32]
+
+    def get_index_file_name(self, namespace):
+        """Function to get the local JSONL file that holds one namespace's entries"""
+        return f'{self.cacheFolder}{namespace}.jsonl'
+
+    def normalize_prompt(self, prompt):
+        """Function to lowercase a prompt and drop punctuation and repeated whitespace"""
+        return WHITESPACE.sub(' ', PUNCTUATION.sub(' ', prompt.lower())).strip()
+
+    def get_signature(self, normalizedPrompt):
+        """Function to get the MinHash signature of a prompt's character shingles"""
+        if len(normalizedPrompt) <= self.shingleSize:
+            shingles = {normalizedPrompt}
+        else:
+            shingles = {normalizedPrompt[position:position + self.shingleSize] for position in range(len(normalizedPrompt) - self.shingleSize + 1)}
+
+        hashedShingles = [int.from_bytes(blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') for shingle in shingles]
+
+        return [min((multiplier * hashedShingle + increment) % MERSENNE_PRIME for hashedShingle in hashedShingles) for multiplier, increment in self.permutations]
+
+    def get_band_keys(self, signature):
+        """Function to split a signature into the LSH bands used to find candidate matches"""
+        return [(bandNumber, tuple(signature[bandNumber * self.rowsPerBand:(bandNumber + 1) * self.rowsPerBand])) for bandNumber in range(self.numBands)]
+
+    def get_similarity(self, signature, otherSignature):
+        """Function to estimate the Jaccard similarity of two prompts from their signatures"""
+        return sum(1 for value, otherValue in zip(signature, otherSignature) if value == otherValue) / len(signature)
+
+    def add_to_index(self, index, entry):
+        """Function to add an entry to an in-memory index, its LSH buckets and the set of full signatures"""
+        index['entries'].append(entry)
+        index['signatures'].add(tuple(entry['signature']))
+
+        for bandKey in self.get_band_keys(entry['signature']):
+            index['buckets'].setdefault(bandKey, []).append(len(index['entries']) - 1)
+
+    def get_index(self, namespace):
+        """Function to get a namespace's index, reading its JSONL file the first time it is needed. Call with the lock held"""
+        if namespace not in self.indexes:
+            index = {'entries': [], 'buckets': {}, 'signatures': set()}
+
+            try:
+                with open(self.get_index_file_name(namespace), 'r', encoding='utf-8') as indexFile:
+                    for line in indexFile:
+                        if line.strip():
+                            self.add_to_index(index, loads(line))
+            except FileNotFoundError:
+                pass
+            except ValueError as e: #A line cut short by a crash, keep the entries before it
+                print(f'Error: Similar prompt index {namespace} has an unreadable entry. Full message: {e}')
+
+            self.indexes[namespace] = index
+
+        return self.indexes[namespace]
+
+    def find(self, gptModel, systemPrompt, userPrompt, similarityThreshold=None):
+        """Function to find the saved response whose prompt is most similar to this one, returning it with its similarity score, or None when nothing reaches the threshold"""
+        similarityThreshold = self.similarityThreshold if similarityThreshold is None else similarityThreshold
+        signature = self.get_signature(self.normalize_prompt(userPrompt))
+        bestEntry = None
+        bestSimilarity = 0.0
+
+        with self.lock:
+            index = self.get_index(self.get_namespace(gptModel, systemPrompt))
+            candidatePositions = {position for bandKey in self.get_band_keys(signature) for position in index['buckets'].get(bandKey, ())}
+
+            for position in candidatePositions:
+                similarity = self.get_similarity(signature, index['entries'][position]['signature'])
+
+                if similarity > bestSimilarity:
+                    bestEntry, bestSimilarity = index['entries'][position], similarity
+
+            if bestEntry is None or bestSimilarity < similarityThreshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        return {'similarity': bestSimilarity, 'response': bestEntry['response']}
+
+    def add(self, formattedResponse, gptModel=None):
+        """Function to index a formatted chat response under the model it was requested with (the answering model name when not given) and its system prompt, appending it to the namespace's file so the index grows with each saved response"""
+        namespace = self.get_namespace(gptModel or formattedResponse['model'], formattedResponse['system_prompt'])
+        entry = {'written_at': time(), 'signature': self.get_signature(self.normalize_prompt(formattedResponse['user_prompt'])), 'response': formattedResponse}
+
+        with self.lock:
+            index = self.get_index(namespace)
+
+            if tuple(entry['signature']) in index['signatures']:
+                return #The same normalized prompt is already indexed
+
+            makedirs(path.dirname(self.cacheFolder), exist_ok=True)
+            with open(self.get_index_file_name(namespace), 'a', encoding='utf-8') as indexFile:
+                indexFile.write(dumps(entry, ensure_ascii=False) + '\n')
+
+            self.add_to_index(index, entry)
+
+    def get_stats(self):
+        """Function to return the hit/miss counters for the cache"""
+        with self.lock:
+            totalLookups = self.hits + self.misses
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': sum(len(index['entries']) for index in self.indexes.values()),
+                'hit_rate': self.hits / totalLookups if totalLookups else 0.0
+            }
@@ -0,0 +1,40 @@
+from functools import lru_cache
+
+DEFAULT_ENCODING_NAME = 'cl100k_base'
+
+
+@lru_cache(maxsize=None)
+def get_encoding_name(gptModel=None):
+    """Function to resolve the tiktoken encoding name for a model, falling back to cl100k_base for unknown or missing models"""
+    if gptModel:
+        from tiktoken.model import encoding_name_for_model #tiktoken is only imported once tokens are first counted
+
+        try:
+            return encoding_name_for_model(gptModel)
+        except KeyError:
+            pass
+
+    return DEFAULT_ENCODING_NAME
+
+
+@lru_cache(maxsize=None)
+def load_encoding(encodingName):
+    """Function to load a tiktoken encoding once per process and reuse it"""
+    from tiktoken import get_encoding
+
+    return get_encoding(encodingName)
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(encodingName, inputToCheck):
+    """Function to count the tokens in a string, memoized so repeated strings such as system prompts are only tokenized once"""
+    return len(load_encoding(encodingName).encode(inputToCheck, disallowed_special=()))
+
+
+def count_tokens_in_batch(encodingName, inputsToCheck, numThreads=8):
+    """Function to count tokens for many strings at once, tokenizing each distinct string a single time across multiple threads"""
+    uniqueInputs = list(dict.fromkeys(inputsToCheck))
+    encodedInputs = load_encoding(encodingName).encode_batch(uniqueInputs, num_threads=numThreads, disallowed_special=())
+    tokenCounts = {inputToCheck: len(encodedInput) for inputToCheck, encodedInput in zip(uniqueInputs, encodedInputs)}
+
+    return [tokenCounts[inputToCheck] for inputToCheck in inputsToCheck]
@@ -6,28 +6,23 @@ userPrompt = "I recently received a $25k cash bonus from my company.  I already
 gptTemperature = 1
 
 ###MAIN###
-client = OpenAIAPIIntegration(applicationName='sample_chat_app', virtualEnvironmentName='local')
-gptModel = client.modelInformation['latest_models'][0]['name'] #0 = GPT 3.5, 1 = GPT 4
-modelLimitTokens = client.modelInformation['latest_models'][0]['max_tokens_supported']
+client = OpenAIAPIIntegration(applicationName='sample_chat_app', virtualEnvironmentName='local', routingPolicy='cheapest') #Or 'fastest', or 'failover' to try the latest models in order
 
-tokenCheckPass = client.check_num_tokens_for_inputs(systemPrompt, userPrompt, modelLimitTokens)
-
-if tokenCheckPass:
+try:
+    rawResponse = client.get_routed_chat_response(systemPrompt, userPrompt, gptTemperature) #Skips models whose context is too small and fails over if one is overloaded
+except Exception as e:
+    print(f'Error: Issue getting response from OpenAI!  Full message: {e}')
+else:
     try:
-        rawResponse = client.get_chat_response(systemPrompt, userPrompt, gptModel, gptTemperature)
+        formattedResponse = client.format_chat_response(rawResponse, systemPrompt, userPrompt)
     except Exception as e:
-        print(f'Error: Issue getting response from OpenAI!  Full message: {e}')
+        print(f'Error: Issue formatting response from OpenAI! Full message: {e}')
+        print(rawResponse)
     else:
         try:
-            formattedResponse = client.format_chat_response(rawResponse, systemPrompt, userPrompt)
+            client.write_formatted_chat_response_to_json_file(formattedResponse)
         except Exception as e:
-            print(f'Error: Issue formatting response from OpenAI! Full message: {e}')
-            print(rawResponse)
+            print(f'Error: Issue writing results to JSON! Full message: {e}')
+            print(formattedResponse)
         else:
-            try:
-                client.write_formatted_chat_response_to_json_file(formattedResponse)
-            except Exception as e:
-                print(f'Error: Issue writing results to JSON! Full message: {e}')
-                print(formattedResponse)
-            else:
-                print("Response successfully received and written to file!")
+            print("Response successfully received from " + formattedResponse['routed_model'] + " and written to file!")